@@ -1,16 +1,44 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+import asyncio
 import io
+import json
 import os
 import shutil
 import time
 from datetime import datetime
 from typing import List
-import psutil
 
-from src.prediction import predict_from_bytes
+from src.prediction import predict_batch, predict_named, prediction_cache
+from src.prediction_log import PredictionLog
+from src.archives import is_archive, iter_archive_images, take
+from src.ingest import copy_upload, persist_uploads, run_ingest_job
+from src.scenes import OUTPUTS as SCENE_OUTPUTS, SceneTooLarge, UnreadableScene, check_scene, run_scene_job
+from src.jobs import JobRegistry
+from src.datastore import TrainingStore, is_store
+from src.screening import Screener
+from src.metrics import metrics
+from src.counters import SharedCounters
+from src.sampler import SystemSampler
+from src.profiling import SamplingProfiler, format_cprofile, start_cprofile
+from src.tracing import end_trace, should_sample, span, start_trace
+from src.training import TrainingManager, FINISHED_STATUSES, MODES as RETRAIN_MODES
+from src.preprocessing import InvalidImage, preprocess_image_from_bytes
 from src.model import model_instance
+from src.batching import MicroBatcher
+from src.executor import InferenceExecutor, Overloaded
+from src.config import (
+    BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS,
+    EXECUTOR_KIND, EXECUTOR_WORKERS, EXECUTOR_MAX_QUEUE, EXECUTOR_RETRY_AFTER,
+    PREDICT_BATCH_CHUNK, PREDICT_BATCH_MAX_FILES, ARCHIVE_MAX_MEMBER_BYTES,
+    INGEST_CHUNK_SIZE, INGEST_WRITE_CONCURRENCY, TRAINING_DIR,
+    TRAINING_STORE_DIR, TRAINING_STORE_KEEP_UPLOADS, RETRAIN_MODE, SCREEN_ENABLED,
+    JOB_DB_PATH, SCENE_DIR, SCENE_TILE_SIZE, SCENE_STRIDE, SCENE_BATCH_SIZE,
+    TRACE_FORCE_HEADER, DEBUG_PROFILING, PROFILE_MAX_SECONDS,
+    SERVING_WORKERS, SERVING_WORKER_INDEX, SERVING_COUNTERS_PATH, READY_MAX_LOOP_LAG_MS, PREDICTION_LOG_DIR
+)
 
 app = FastAPI(title="land cover classification api")
 
@@ -23,240 +51,506 @@ app.add_middleware(
 )
 
 start_time = time.time()
-prediction_count = 0
-prediction_times = []
-training_logs = []
-training_status = "idle"
-training_progress = 0
+counters = SharedCounters(("pid", "predictions"), SERVING_COUNTERS_PATH, SERVING_WORKERS, SERVING_WORKER_INDEX)
+counters.set("pid", os.getpid())
+prediction_latency = metrics.histogram("prediction_seconds")
+read_seconds = metrics.histogram("stage_seconds", stage="read")
+
+jobs = JobRegistry(JOB_DB_PATH)
+executor = InferenceExecutor(EXECUTOR_KIND, EXECUTOR_WORKERS, EXECUTOR_MAX_QUEUE, EXECUTOR_RETRY_AFTER)
+batcher = MicroBatcher(predict_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, executor=executor)
+training = TrainingManager(TRAINING_DIR, promote=model_instance.activate)
+training_store = TrainingStore(TRAINING_STORE_DIR)
+screener = Screener(training_store) if SCREEN_ENABLED else None
+profile_lock = asyncio.Lock()
+prediction_log = PredictionLog(PREDICTION_LOG_DIR, worker=SERVING_WORKER_INDEX) if PREDICTION_LOG_DIR else None
+sampler = SystemSampler(queue_depth=lambda: batcher.stats()["queue_depth"] + executor.in_flight)
+
+@app.on_event("startup")
+async def start_inference():
+    await asyncio.to_thread(model_instance.ensure_loaded)
+    executor.start()
+    await batcher.start()
+    await training.start()
+    await sampler.start()
+    if prediction_log is not None:
+        prediction_log.start()
+
+@app.on_event("shutdown")
+async def stop_inference():
+    await sampler.stop()
+    await training.stop()
+    await batcher.stop()
+    executor.shutdown()
+    if prediction_log is not None:
+        await asyncio.to_thread(prediction_log.stop)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    token = None
+    if should_sample(bool(TRACE_FORCE_HEADER and request.headers.get(TRACE_FORCE_HEADER))):
+        trace, token = start_trace()
+    try:
+        response = await call_next(request)
+    finally:
+        if token is not None:
+            end_trace(token)
+
+    route = request.scope.get("route")
+    endpoint = route.path if route is not None else "unmatched"
+    metrics.observe("request_seconds", time.perf_counter() - start, endpoint=endpoint)
+    metrics.inc("requests_total", endpoint=endpoint, status=str(response.status_code))
+    if token is not None:
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["X-Trace-Id"] = trace.id
+    return response
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
 
 @app.get("/")
 def read_root():
     return {"message": "land cover classification api", "status": "running"}
 
-@app.get("/health")
-def health_check():
-    uptime_seconds = time.time() - start_time
-    uptime_hours = uptime_seconds / 3600
-
-    cpu_percent = psutil.cpu_percent(interval=0.1)
-    memory = psutil.virtual_memory()
+def build_health(system):
+    latency = prediction_latency.snapshot(scale=1000, digits=2)
+    return {
+        "prediction_count": counters.total("predictions"),
+        "average_latency_ms": latency["mean"],
+        "p99_latency_ms": latency["p99"],
+        "cpu_percent": system["cpu_percent"],
+        "memory_percent": system["memory_percent"],
+        "system": system
+    }
 
-    avg_latency = sum(prediction_times[-100:]) / len(prediction_times[-100:]) if prediction_times else 0
+sampler.report("health", build_health)
 
+@app.get("/health")
+async def health_check():
+    uptime_seconds = time.time() - start_time
     return {
         "status": "healthy",
-        "uptime_hours": round(uptime_hours, 2),
+        "uptime_hours": round(uptime_seconds / 3600, 2),
         "uptime_seconds": round(uptime_seconds, 2),
-        "prediction_count": prediction_count,
-        "average_latency_ms": round(avg_latency * 1000, 2),
-        "cpu_percent": cpu_percent,
-        "memory_percent": memory.percent,
+        **sampler.get("health"),
+        "sample_age_seconds": round(sampler.age(), 3),
+        "model": model_instance.describe(),
+        "worker": SERVING_WORKER_INDEX,
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/live")
+async def liveness():
+    if sampler.samples and sampler.stale():
+        return JSONResponse(status_code=503, content={"status": "stalled", "sample_age_seconds": round(sampler.age(), 3)})
+    return {"status": "alive"}
+
+@app.get("/ready")
+async def readiness():
+    reasons = []
+    if model_instance.active is None:
+        reasons.append("model not loaded")
+    if executor.pool is None:
+        reasons.append("inference pool not started")
+    elif executor.in_flight >= executor.capacity:
+        reasons.append("inference queue full")
+    if sampler.system["event_loop_lag_ms"] > READY_MAX_LOOP_LAG_MS:
+        reasons.append(f"event loop lag {sampler.system['event_loop_lag_ms']}ms")
+    if reasons:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "not ready", "reasons": reasons},
+            headers={"Retry-After": str(executor.retry_after)}
+        )
+    return {"status": "ready"}
+
 @app.post("/predict")
 async def predict_image(file: UploadFile = File(...)):
-    global prediction_count, prediction_times
-
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="file must be an image")
 
-    start = time.time()
-
-    try:
-        contents = await file.read()
-        image_bytes = io.BytesIO(contents)
+    with executor.admit():
+        start = time.time()
+        started = time.perf_counter()
 
-        result = predict_from_bytes(image_bytes)
-
-        latency = time.time() - start
-        prediction_times.append(latency)
-        prediction_count += 1
+        try:
+            with read_seconds.timer(), span("read"):
+                contents = await file.read()
+            read_at = time.perf_counter()
+            with span("cache"):
+                version = model_instance.version
+                cache_key = prediction_cache.make_key(contents, version)
+                result = prediction_cache.get(cache_key)
+            cached = result is not None
+            looked_up_at = decoded_at = time.perf_counter()
+
+            if result is None:
+                image_bytes = io.BytesIO(contents)
+                img_array = await executor.run(preprocess_image_from_bytes, image_bytes)
+                decoded_at = time.perf_counter()
+                result = await batcher.submit(img_array)
+                prediction_cache.put(cache_key, result)
+
+            latency = time.time() - start
+            prediction_latency.observe(latency)
+            counters.inc("predictions")
+            if prediction_log is not None:
+                finished = time.perf_counter()
+                prediction_log.log(
+                    cache_key.partition(":")[0], version, result, cached=cached,
+                    read=(read_at - started) * 1000,
+                    cache=(looked_up_at - read_at) * 1000,
+                    preprocess=(decoded_at - looked_up_at) * 1000,
+                    inference=0.0 if cached else (finished - decoded_at) * 1000,
+                    total=(finished - started) * 1000
+                )
+
+            return {
+                **result,
+                "latency_ms": round(latency * 1000, 2)
+            }
+
+        except InvalidImage as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
-        return {
-            **result,
-            "latency_ms": round(latency * 1000, 2)
-        }
+async def iter_upload_chunks(files, chunk_size):
+    chunk = []
+    for file in files:
+        if is_archive(file.filename, file.content_type):
+            members = iter_archive_images(file.file, file.filename, ARCHIVE_MAX_MEMBER_BYTES)
+            while True:
+                with read_seconds.timer():
+                    items = await asyncio.to_thread(take, members, chunk_size - len(chunk))
+                if not items:
+                    break
+                chunk.extend(items)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        else:
+            with read_seconds.timer():
+                contents = await file.read()
+            chunk.append((file.filename, contents))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+async def stream_batch_predictions(files):
+    start = time.time()
+    images = 0
+    errors = 0
 
+    try:
+        async for chunk in iter_upload_chunks(files, PREDICT_BATCH_CHUNK):
+            started = time.perf_counter()
+            version, records, digests = await executor.run_admitted(predict_named, chunk)
+            image_ms = (time.perf_counter() - started) * 1000 / len(chunk)
+            for record, digest in zip(records, digests):
+                record["index"] = images + errors
+                if "error" in record:
+                    errors += 1
+                else:
+                    images += 1
+                    counters.inc("predictions")
+                    if prediction_log is not None:
+                        prediction_log.log(digest, version, record, endpoint="predict-batch", inference=image_ms, total=image_ms)
+                yield json.dumps(record) + "\n"
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        errors += 1
+        yield json.dumps({"error": str(e)}) + "\n"
+
+    elapsed = time.time() - start
+    yield json.dumps({
+        "summary": True,
+        "images": images,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "images_per_second": round(images / elapsed, 2) if elapsed > 0 else 0
+    }) + "\n"
+
+@app.post("/predict-batch")
+async def predict_image_batch(request: Request):
+    executor.check_capacity()
+
+    form = await request.form(max_files=PREDICT_BATCH_MAX_FILES)
+    files = [item for item in form.getlist("files") if not isinstance(item, str)]
+    if not files:
+        await form.close()
+        raise HTTPException(status_code=400, detail="no files uploaded")
+
+    return StreamingResponse(
+        stream_batch_predictions(files),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(form.close)
+    )
 
 @app.post("/upload-bulk")
 async def upload_bulk_data(files: List[UploadFile] = File(...)):
-    upload_dir = "uploads/bulk_data"
-    os.makedirs(upload_dir, exist_ok=True)
+    executor.check_capacity()
 
+    upload_dir = "uploads/bulk_data"
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    batch_dir = os.path.join(upload_dir, f"batch_{timestamp}")
+    batch_id = f"batch_{timestamp}"
+    batch_dir = os.path.join(upload_dir, batch_id)
     os.makedirs(batch_dir, exist_ok=True)
 
-    saved_files = []
-    validation_results = []
-    valid_classes = ['trees', 'shrubland', 'grassland', 'cropland', 'built-up', 'bare_sparse', 'water', 'wetland', 'mangroves']
-
-    code_to_class = {
-        '10': 'trees',
-        '20': 'shrubland',
-        '30': 'grassland',
-        '40': 'cropland',
-        '50': 'built-up',
-        '60': 'bare_sparse',
-        '80': 'water',
-        '90': 'wetland',
-        '95': 'mangroves'
-    }
+    saved, errors = await persist_uploads(files, batch_dir, INGEST_WRITE_CONCURRENCY)
 
-    for file in files:
-        try:
-            if file.content_type.startswith('image/'):
-                path_parts = file.filename.replace('\\', '/').split('/')
-
-                if len(path_parts) >= 2:
-                    class_folder = path_parts[-2].lower()
-                    filename = path_parts[-1]
-
-                    class_dir = os.path.join(batch_dir, class_folder)
-                    os.makedirs(class_dir, exist_ok=True)
-
-                    file_path = os.path.join(class_dir, filename)
-                    contents = await file.read()
-                    with open(file_path, "wb") as buffer:
-                        buffer.write(contents)
-
-                    image_bytes = io.BytesIO(contents)
-                    prediction = predict_from_bytes(image_bytes)
-                    predicted_code = str(prediction['predicted_class'])
-                    predicted_class = code_to_class.get(predicted_code, predicted_code).lower()
-
-                    validation_note = None
-                    if class_folder == 'bare_sparse':
-                        similar_classes = ['shrubland', 'cropland', 'grassland', 'built-up']
-                        confidence_threshold = 0.85
-
-                        print(f"DEBUG bare_sparse: claimed={class_folder}, predicted={predicted_class}, conf={prediction['confidence']}")
-                        print(f"DEBUG in similar? {predicted_class in similar_classes}, above threshold? {prediction['confidence'] >= confidence_threshold}")
-
-                        if predicted_class == class_folder:
-                            is_valid = True
-                            print(f"DEBUG: Exact match")
-                        elif predicted_class in similar_classes and prediction['confidence'] >= confidence_threshold:
-                            is_valid = True
-                            validation_note = f"Accepted: {predicted_class} is similar to bare_sparse"
-                            print(f"DEBUG: Accepted as similar, is_valid={is_valid}, note={validation_note}")
-                        else:
-                            is_valid = False
-                            print(f"DEBUG: Rejected")
-                    else:
-                        is_valid = predicted_class == class_folder
-
-                    result = {
-                        'filename': file.filename,
-                        'claimed_class': class_folder,
-                        'predicted_class': predicted_class,
-                        'confidence': prediction['confidence'],
-                        'valid': is_valid
-                    }
-                    if validation_note:
-                        result['note'] = validation_note
-
-                    validation_results.append(result)
-
-                    saved_files.append(file.filename)
-                else:
-                    validation_results.append({
-                        'filename': file.filename,
-                        'claimed_class': 'unknown',
-                        'predicted_class': 'n/a',
-                        'confidence': 0,
-                        'valid': False,
-                        'error': 'file must be in class folder (e.g., trees/image1.png)'
-                    })
-        except Exception as e:
-            print(f"Error processing {file.filename}: {str(e)}")
-            validation_results.append({
-                'filename': file.filename,
-                'claimed_class': 'error',
-                'predicted_class': 'n/a',
-                'confidence': 0,
-                'valid': False,
-                'error': str(e)
-            })
-
-    valid_count = sum(1 for r in validation_results if r['valid'])
+    job = jobs.create(
+        "upload-bulk",
+        total=len(saved) + len(errors),
+        meta={"batch_id": batch_id, "batch_path": batch_dir}
+    )
+    job.task = asyncio.create_task(run_ingest_job(
+        job, saved, errors, executor, INGEST_CHUNK_SIZE, training_store, TRAINING_STORE_KEEP_UPLOADS, screener
+    ))
 
     return {
-        "status": "success",
-        "files_uploaded": len(saved_files),
-        "valid_files": valid_count,
-        "invalid_files": len(saved_files) - valid_count,
-        "validation_results": validation_results,
-        "batch_id": f"batch_{timestamp}",
-        "batch_path": batch_dir
+        "status": "accepted",
+        "job_id": job.id,
+        "files_uploaded": len(saved),
+        "batch_id": batch_id,
+        "batch_path": batch_dir,
+        "progress_url": f"/upload-bulk/{job.id}"
     }
 
-def retrain_model_task(train_data_path: str, epochs: int):
-    global training_logs, training_status, training_progress
-    training_logs = []
-    training_status = "training"
-    training_progress = 0
-
-    training_logs.append(f"[{datetime.now().strftime('%H:%M:%S')}] Retraining started")
-    training_logs.append(f"[{datetime.now().strftime('%H:%M:%S')}] Training data path: {train_data_path}")
-    training_logs.append(f"[{datetime.now().strftime('%H:%M:%S')}] Epochs: {epochs}")
-
-    def update_progress(current_epoch, total_epochs):
-        global training_progress
-        training_progress = int((current_epoch / total_epochs) * 95)
-
+@app.get("/upload-bulk/{job_id}")
+def get_upload_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None or job.kind != "upload-bulk":
+        raise HTTPException(status_code=404, detail=f"upload job not found: {job_id}")
+    return job.to_dict()
+
+@app.get("/training-data")
+def get_training_data():
+    stats = training_store.stats()
+    if screener is not None:
+        stats["screening"] = screener.describe()
+    return stats
+
+@app.post("/scenes")
+async def submit_scene(file: UploadFile = File(...), tile_size: int = SCENE_TILE_SIZE, stride: int = SCENE_STRIDE):
+    if tile_size < 1 or stride < 1:
+        raise HTTPException(status_code=400, detail="tile_size and stride must be positive")
+    executor.check_capacity()
+
+    job = jobs.create("scene", meta={"filename": file.filename, "tile_size": tile_size, "stride": stride})
+    job_dir = os.path.join(SCENE_DIR, job.id)
+    extension = os.path.splitext(file.filename or "")[1].lower()
+    path = os.path.join(job_dir, f"input{extension if extension.isascii() and extension[1:].isalnum() else ''}")
+    await asyncio.to_thread(copy_upload, file.file, path)
     try:
-        result = model_instance.retrain(
-            train_data_path,
-            epochs=epochs,
-            log_callback=lambda msg: training_logs.append(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}"),
-            progress_callback=update_progress
-        )
-        training_logs.append(f"[{datetime.now().strftime('%H:%M:%S')}] Retraining completed: {result}")
-        training_progress = 100
-        training_status = "completed"
-    except Exception as e:
-        training_logs.append(f"[{datetime.now().strftime('%H:%M:%S')}] Error: {str(e)}")
-        training_status = "failed"
-
+        await asyncio.to_thread(check_scene, path)
+    except (SceneTooLarge, UnreadableScene) as e:
+        job.fail(e)
+        await asyncio.to_thread(shutil.rmtree, job_dir, True)
+        raise HTTPException(status_code=413 if isinstance(e, SceneTooLarge) else 400, detail=str(e))
+
+    job.task = asyncio.create_task(
+        run_scene_job(job, path, job_dir, executor, tile_size, stride, SCENE_BATCH_SIZE)
+    )
+    return {"status": "accepted", "job_id": job.id, "progress_url": f"/scenes/{job.id}"}
+
+@app.get("/scenes/{job_id}")
+def get_scene_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None or job.kind != "scene":
+        raise HTTPException(status_code=404, detail=f"scene job not found: {job_id}")
+    return job.to_dict()
+
+@app.get("/scenes/{job_id}/{name}")
+def get_scene_output(job_id: str, name: str):
+    job = jobs.get(job_id)
+    if job is None or job.kind != "scene" or name not in SCENE_OUTPUTS:
+        raise HTTPException(status_code=404, detail=f"scene output not found: {job_id}/{name}")
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"scene job is {job.status}")
+    return FileResponse(os.path.join(SCENE_DIR, job_id, name), filename=f"{job_id}-{name}")
 
 @app.post("/retrain")
 async def trigger_retrain(
-    background_tasks: BackgroundTasks,
-    train_data_path: str = "uploads/bulk_data",
-    epochs: int = 10
+    train_data_path: str = TRAINING_STORE_DIR,
+    epochs: int = 10,
+    mode: str = RETRAIN_MODE
 ):
     if not os.path.exists(train_data_path):
         raise HTTPException(status_code=404, detail=f"training data path not found: {train_data_path}")
+    if mode not in RETRAIN_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(RETRAIN_MODES)}")
+    if mode == "incremental" and not is_store(train_data_path):
+        raise HTTPException(status_code=400, detail="incremental retraining needs a training data store path")
 
-    background_tasks.add_task(retrain_model_task, train_data_path, epochs)
+    job = training.submit(train_data_path, epochs, mode)
 
     return {
-        "status": "retraining initiated",
+        "status": "retraining queued",
+        "job_id": job["job_id"],
         "train_data_path": train_data_path,
         "epochs": epochs,
-        "message": "retraining running in background"
+        "mode": mode,
+        "progress_url": f"/retrain/{job['job_id']}",
+        "message": "retraining queued, it runs in a separate training process"
     }
 
-@app.get("/metrics")
-def get_metrics():
-    recent_latencies = prediction_times[-100:]
+@app.get("/retrain")
+def list_retrain_jobs(limit: int = 50):
+    return {"jobs": training.store.list(limit)}
+
+@app.get("/retrain/{job_id}")
+def get_retrain_job(job_id: str, tail: int = 200):
+    job = training.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"training job not found: {job_id}")
+    return {**job, "logs": training.store.read_logs(job_id, tail)}
+
+@app.post("/retrain/{job_id}/cancel")
+def cancel_retrain_job(job_id: str):
+    job = training.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"training job not found: {job_id}")
+    if job["status"] in FINISHED_STATUSES or job["status"] == "promoting":
+        raise HTTPException(status_code=409, detail=f"training job already {job['status']}")
+    return training.cancel(job_id)
+
+@app.get("/models")
+def list_models():
+    return {
+        "active": model_instance.describe(),
+        "registry": model_instance.registry.describe()
+    }
+
+async def activate_model(activate, *args):
+    try:
+        swap = await asyncio.to_thread(activate, *args)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "active", **swap}
+
+@app.post("/models/{version}/promote")
+async def promote_model(version: str):
+    if version not in model_instance.registry.versions():
+        raise HTTPException(status_code=404, detail=f"model version not found: {version}")
+    return await activate_model(model_instance.activate, version)
+
+@app.post("/models/rollback")
+async def rollback_model():
+    return await activate_model(model_instance.rollback)
+
+def build_metrics(system):
+    latency = prediction_latency.snapshot(scale=1000, digits=2)
+    return {
+        "total_predictions": counters.total("predictions"),
+        "average_latency_ms": latency["mean"],
+        "min_latency_ms": latency["min"],
+        "max_latency_ms": latency["max"],
+        "p50_latency_ms": latency["p50"],
+        "p90_latency_ms": latency["p90"],
+        "p99_latency_ms": latency["p99"],
+        "window_seconds": metrics.window_seconds,
+        "series": metrics.snapshot(),
+        "batching": batcher.stats(),
+        "executor": executor.stats(),
+        "cache": prediction_cache.stats(),
+        "cascade": model_instance.cascade_stats(),
+        "prediction_log": prediction_log.stats() if prediction_log is not None else None,
+        "system": system,
+        "worker": SERVING_WORKER_INDEX,
+        "workers": [
+            {"index": index, "pid": row["pid"], "predictions": row["predictions"]}
+            for index, row in enumerate(counters.per_slot()) if row["pid"]
+        ]
+    }
 
+sampler.report("metrics", build_metrics)
+
+@app.get("/metrics")
+async def get_metrics():
     return {
-        "total_predictions": prediction_count,
-        "average_latency_ms": round(sum(recent_latencies) / len(recent_latencies) * 1000, 2) if recent_latencies else 0,
-        "min_latency_ms": round(min(recent_latencies) * 1000, 2) if recent_latencies else 0,
-        "max_latency_ms": round(max(recent_latencies) * 1000, 2) if recent_latencies else 0,
-        "uptime_hours": round((time.time() - start_time) / 3600, 2)
+        **sampler.get("metrics"),
+        "uptime_hours": round((time.time() - start_time) / 3600, 2),
+        "sample_age_seconds": round(sampler.age(), 3)
+    }
+
+@app.get("/metrics/prometheus", response_class=PlainTextResponse)
+def get_prometheus_metrics():
+    cache = prediction_cache.stats()
+    cascade = model_instance.cascade_stats()
+    gauges = {
+        "uptime_seconds": ("seconds since the api started", time.time() - start_time),
+        "predictions_total": ("images classified through /predict and /predict-batch, all workers", counters.total("predictions")),
+        "executor_in_flight": ("requests admitted to the inference pool", executor.in_flight),
+        "executor_rejected_total": ("requests rejected with 503", executor.rejected),
+        "batch_queue_depth": ("requests waiting for a micro-batch", batcher.stats()["queue_depth"]),
+        "cache_hits_total": ("prediction cache hits", cache["hits"]),
+        "cache_misses_total": ("prediction cache misses", cache["misses"]),
+        "cascade_images_total": ("images classified through the fast cascade model", cascade.get("images", 0)),
+        "cascade_escalated_total": ("cascade images escalated to the full model", cascade.get("escalated", 0)),
+        "prediction_log_written_total": ("predictions written to the prediction log", prediction_log.written if prediction_log else 0),
+        "prediction_log_dropped_total": ("predictions dropped because the prediction log buffer was full", prediction_log.dropped if prediction_log else 0),
+        "cpu_percent": ("host cpu utilisation, last sample", sampler.system["cpu_percent"]),
+        "memory_percent": ("host memory utilisation, last sample", sampler.system["memory_percent"]),
+        "process_rss_bytes": ("resident memory of this worker, last sample", sampler.system["process_rss_mb"] * 1024 * 1024),
+        "event_loop_lag_seconds_max": ("worst event loop lag over the last sample interval", sampler.system["event_loop_lag_ms"] / 1000),
+        "inference_queue_depth": ("requests queued for or running inference, last sample", sampler.system["inference_queue_depth"])
     }
+    return PlainTextResponse(metrics.prometheus(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/profile", response_class=PlainTextResponse)
+async def debug_profile(seconds: float = 10, mode: str = "sampling", output: str = "top", interval_ms: float = 5):
+    if not DEBUG_PROFILING:
+        raise HTTPException(status_code=404, detail="profiling disabled, set DEBUG_PROFILING=1")
+    if mode not in ("sampling", "cprofile"):
+        raise HTTPException(status_code=400, detail=f"unknown profile mode: {mode}")
+    if profile_lock.locked():
+        raise HTTPException(status_code=409, detail="a profile is already being captured")
+
+    seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+    async with profile_lock:
+        if mode == "cprofile":
+            profile = start_cprofile()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+            return format_cprofile(profile)
+
+        profiler = SamplingProfiler(max(0.001, interval_ms / 1000))
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(profiler.stop)
+        return profiler.collapsed() if output == "collapsed" else profiler.top()
 
 @app.get("/training-logs")
 def get_training_logs():
+    jobs_list = training.store.list(limit=1)
+    if not jobs_list:
+        return {"status": "idle", "logs": [], "progress": 0}
+
+    job = jobs_list[0]
+    if job["status"] == "completed":
+        status = "completed"
+    elif job["status"] in FINISHED_STATUSES:
+        status = "failed"
+    else:
+        status = "training"
+
     return {
-        "status": training_status,
-        "logs": training_logs,
-        "progress": training_progress
+        "status": status,
+        "logs": training.store.read_logs(job["job_id"]),
+        "progress": job["progress"],
+        "job": job
     }
@@ -0,0 +1,91 @@
+import argparse
+import time
+
+import numpy as np
+
+from src.model import CODE_TO_NAME, MAPPING_PATH, build_label_lookup, decode_predictions
+
+
+def legacy_format_prediction(row, reverse_mapping, code_to_name):
+    class_idx = int(np.argmax(row))
+    confidence = float(row[class_idx])
+
+    class_code = reverse_mapping.get(class_idx, f"unknown_{class_idx}")
+    if hasattr(class_code, 'item'):
+        class_code = int(class_code.item())
+    elif isinstance(class_code, np.generic):
+        class_code = int(class_code)
+
+    top_3_indices = np.argsort(row)[-3:][::-1]
+    top_3 = []
+    for idx in top_3_indices:
+        idx = int(idx)
+        class_val = reverse_mapping.get(idx, f"unknown_{idx}")
+        if hasattr(class_val, 'item'):
+            class_val = int(class_val.item())
+        elif isinstance(class_val, np.generic):
+            class_val = int(class_val)
+        top_3.append({'class': class_val, 'confidence': float(row[idx])})
+
+    class_name = code_to_name.get(class_code, f"unknown_{class_code}")
+    top_3_with_names = []
+    for item in top_3:
+        top_3_with_names.append({
+            'class': code_to_name.get(item['class'], f"unknown_{item['class']}"),
+            'confidence': item['confidence']
+        })
+
+    return {
+        'predicted_class': class_code,
+        'predicted_class_name': class_name,
+        'confidence': confidence,
+        'top_3': top_3_with_names
+    }
+
+
+def softmax_batch(batch_size, num_classes, rng):
+    logits = rng.normal(size=(batch_size, num_classes)).astype(np.float32)
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def median_ms(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="post-processing microbenchmark: per-row loop vs vectorized top-k")
+    parser.add_argument('--batch-sizes', default='1,32,256,4096')
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    reverse_mapping = np.load(MAPPING_PATH, allow_pickle=True).item()
+    num_classes = len(reverse_mapping)
+    index_codes, index_names = build_label_lookup(reverse_mapping, CODE_TO_NAME, num_classes)
+    rng = np.random.default_rng(0)
+
+    report = {}
+    print(f"{'batch':>8}{'legacy ms':>14}{'vectorized ms':>16}{'speedup':>10}{'top-1 diffs':>14}")
+    for batch_size in (int(b) for b in args.batch_sizes.split(',')):
+        predictions = softmax_batch(batch_size, num_classes, rng)
+
+        legacy = [legacy_format_prediction(row, reverse_mapping, CODE_TO_NAME) for row in predictions]
+        vectorized = decode_predictions(predictions, index_codes, index_names, args.k)
+        mismatches = sum(a['predicted_class'] != b['predicted_class'] for a, b in zip(legacy, vectorized))
+
+        legacy_ms = median_ms(lambda: [legacy_format_prediction(row, reverse_mapping, CODE_TO_NAME) for row in predictions], args.repeats)
+        vectorized_ms = median_ms(lambda: decode_predictions(predictions, index_codes, index_names, args.k), args.repeats)
+        report[batch_size] = {'legacy_ms': round(legacy_ms, 3), 'vectorized_ms': round(vectorized_ms, 3), 'mismatches': mismatches}
+        print(f"{batch_size:>8}{legacy_ms:>14.3f}{vectorized_ms:>16.3f}{legacy_ms / vectorized_ms:>9.1f}x{mismatches:>14}")
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
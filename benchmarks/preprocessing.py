@@ -0,0 +1,92 @@
+import argparse
+import io
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from src.export import list_images
+from src.preprocessing import preprocess_image_from_bytes, preprocess_many
+
+
+def legacy_preprocess_image_from_bytes(image_bytes, target_size=(64, 64)):
+    img = Image.open(image_bytes).convert('RGB')
+    img = img.resize(target_size)
+    img_array = np.array(img) / 255.0
+    img_array = np.expand_dims(img_array, axis=0)
+    return img_array
+
+
+def synthetic_jpeg(size, seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def load_corpus(data_dir, limit):
+    return [open(path, 'rb').read() for path in list_images(data_dir, limit)]
+
+
+def time_per_image(fn, payloads, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn(payloads)
+        timings.append((time.perf_counter() - started) / len(payloads))
+    return float(np.median(timings)) * 1e6
+
+
+def peak_allocation(fn, payloads):
+    tracemalloc.start()
+    fn(payloads)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / len(payloads)
+
+
+def bench(payloads, repeats):
+    candidates = {
+        'legacy': lambda items: [legacy_preprocess_image_from_bytes(io.BytesIO(item)) for item in items],
+        'single': lambda items: [preprocess_image_from_bytes(item) for item in items],
+        'batched': lambda items: preprocess_many(items),
+    }
+    results = {}
+    for name, fn in candidates.items():
+        fn(payloads[:1])
+        results[name] = {
+            'us_per_image': round(time_per_image(fn, payloads, repeats), 1),
+            'peak_bytes_per_image': int(peak_allocation(fn, payloads))
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="preprocessing microbenchmark: legacy vs single-path engine")
+    parser.add_argument('--data-dir', default='data/real_training_data')
+    parser.add_argument('--limit', type=int, default=200)
+    parser.add_argument('--jpeg-size', type=int, default=1024)
+    parser.add_argument('--jpeg-count', type=int, default=20)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    corpora = {
+        f'{args.data_dir} png': load_corpus(args.data_dir, args.limit),
+        f'{args.jpeg_size}px jpeg': [synthetic_jpeg(args.jpeg_size, seed) for seed in range(args.jpeg_count)],
+    }
+
+    report = {}
+    for label, payloads in corpora.items():
+        if not payloads:
+            continue
+        report[label] = bench(payloads, args.repeats)
+        print(f"{label} ({len(payloads)} images)")
+        for name, result in report[label].items():
+            print(f"  {name:8} {result['us_per_image']:>10} us/image {result['peak_bytes_per_image']:>12} peak bytes/image")
+    return report
+
+
+if __name__ == '__main__':
+    main()
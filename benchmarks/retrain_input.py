@@ -0,0 +1,84 @@
+import argparse
+import os
+import tempfile
+import time
+
+from src.data_pipeline import build_generators, build_store_data, build_tfdata
+from src.datastore import TrainingStore, import_directory
+
+DATA_DIRS = ('data/demo_training_data', 'data/real_training_data', 'data/complete_training_data')
+
+
+def iterate_generator(generator):
+    for i in range(len(generator)):
+        generator[i]
+
+
+def iterate_dataset(dataset):
+    for _ in dataset:
+        pass
+
+
+def epoch_times(iterate, source, epochs):
+    timings = []
+    for _ in range(epochs):
+        started = time.perf_counter()
+        iterate(source)
+        timings.append(round(time.perf_counter() - started, 3))
+    return timings
+
+
+def fit_epoch_times(data, epochs):
+    from src.backends import load_keras_model
+    from src.model import MODEL_PATH
+
+    model = load_keras_model(MODEL_PATH)
+    model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    timings = []
+    for _ in range(epochs):
+        started = time.perf_counter()
+        model.fit(data.train, epochs=1, validation_data=data.validation, verbose=0)
+        timings.append(round(time.perf_counter() - started, 3))
+    return timings
+
+
+def build_store(data_dir, store_dir, batch_size):
+    import_directory(TrainingStore(store_dir), data_dir, os.path.basename(data_dir.rstrip('/')))
+    return build_store_data(store_dir, batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="retraining input pipeline epoch times: ImageDataGenerator vs tf.data vs the training data store")
+    parser.add_argument('--data-dirs', default=','.join(DATA_DIRS))
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--fit', action='store_true', help="time model.fit epochs instead of input iteration only")
+    args = parser.parse_args()
+
+    report = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for data_dir in args.data_dirs.split(','):
+            if not os.path.isdir(data_dir):
+                continue
+            candidates = {
+                'generator': build_generators(data_dir, args.batch_size),
+                'tfdata_memory': build_tfdata(data_dir, args.batch_size, 'memory'),
+                'tfdata_disk': build_tfdata(data_dir, args.batch_size, 'disk', cache_dir),
+                'store': build_store(data_dir, os.path.join(cache_dir, f"store_{os.path.basename(data_dir)}"), args.batch_size)
+            }
+            report[data_dir] = {}
+            print(f"{data_dir} ({candidates['generator'].train_samples} train / {candidates['generator'].validation_samples} validation)")
+            for name, data in candidates.items():
+                if args.fit:
+                    timings = fit_epoch_times(data, args.epochs)
+                elif name == 'generator':
+                    timings = epoch_times(iterate_generator, data.train, args.epochs)
+                else:
+                    timings = epoch_times(iterate_dataset, data.train, args.epochs)
+                report[data_dir][name] = timings
+                print(f"  {name:14} epoch seconds: {timings}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from src.config import TFLITE_MODEL_PATH
+
+MODES = {
+    'eager': {'SERVING_MODE': 'eager', 'TF_RUN_EAGERLY': '1'},
+    'graph': {'SERVING_MODE': 'graph', 'TF_RUN_EAGERLY': '0'},
+    'tflite': {'INFERENCE_BACKEND': 'tflite', 'TF_RUN_EAGERLY': '0'},
+}
+
+
+def measure(batch_sizes, iterations):
+    started = time.perf_counter()
+    from src.model import LandCoverModel
+    model = LandCoverModel().ensure_loaded()
+    startup_s = time.perf_counter() - started
+
+    rng = np.random.default_rng(0)
+    first = rng.random((1, 64, 64, 3), dtype=np.float32)
+    started = time.perf_counter()
+    model.predict(first)
+    first_request_ms = (time.perf_counter() - started) * 1000
+
+    steady = {}
+    for batch_size in batch_sizes:
+        images = rng.random((batch_size, 64, 64, 3), dtype=np.float32)
+        model.predict_batch(images)
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            model.predict_batch(images)
+            timings.append(time.perf_counter() - started)
+        timings = np.array(timings) * 1000
+        steady[batch_size] = {
+            'p50_ms': round(float(np.percentile(timings, 50)), 3),
+            'p99_ms': round(float(np.percentile(timings, 99)), 3),
+            'per_image_ms': round(float(np.median(timings)) / batch_size, 3)
+        }
+
+    return {
+        'startup_s': round(startup_s, 3),
+        'first_request_ms': round(first_request_ms, 3),
+        'steady_state': steady
+    }
+
+
+def run_mode(mode, batch_sizes, iterations):
+    env = {**os.environ, **MODES[mode], 'TF_CPP_MIN_LOG_LEVEL': '3'}
+    cmd = [
+        sys.executable, '-m', 'benchmarks.serving', '--child',
+        '--batch-sizes', ','.join(str(b) for b in batch_sizes),
+        '--iterations', str(iterations)
+    ]
+    output = subprocess.run(cmd, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare serving latency across inference modes and backends")
+    parser.add_argument('--batch-sizes', default='1,8,32')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--child', action='store_true')
+    args = parser.parse_args()
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+
+    if args.child:
+        print(json.dumps(measure(batch_sizes, args.iterations)))
+        return
+
+    modes = [mode for mode in MODES if mode != 'tflite' or os.path.exists(TFLITE_MODEL_PATH)]
+    results = {mode: run_mode(mode, batch_sizes, args.iterations) for mode in modes}
+
+    def row(label, values):
+        print(f"{label:24}" + ''.join(f"{value:>12}" for value in values))
+
+    row('', modes)
+    row('startup (s)', [results[mode]['startup_s'] for mode in modes])
+    row('first request (ms)', [results[mode]['first_request_ms'] for mode in modes])
+    for batch_size in batch_sizes:
+        steady = [results[mode]['steady_state'][str(batch_size)] for mode in modes]
+        row(f'batch {batch_size} p50 (ms)', [s['p50_ms'] for s in steady])
+        row(f'batch {batch_size} p99 (ms)', [s['p99_ms'] for s in steady])
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
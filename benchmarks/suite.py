@@ -0,0 +1,389 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from src.config import INFERENCE_BACKEND, SERVING_MODE
+from src.export import list_images
+
+SUITES = ('preprocess', 'predict', 'retrain', 'api', 'bulk')
+DEFAULT_BASELINE = 'benchmarks/baseline.json'
+RESULTS_DIR = 'benchmarks/results'
+
+
+def metric(value, unit, better='lower'):
+    return {'value': round(float(value), 4), 'unit': unit, 'better': better}
+
+
+def latency_metrics(prefix, timings_ms):
+    timings_ms = np.asarray(timings_ms)
+    return {
+        f'{prefix}.p50_ms': metric(np.percentile(timings_ms, 50), 'ms'),
+        f'{prefix}.p90_ms': metric(np.percentile(timings_ms, 90), 'ms'),
+        f'{prefix}.p99_ms': metric(np.percentile(timings_ms, 99), 'ms')
+    }
+
+
+def bench_preprocess(args):
+    from benchmarks.preprocessing import load_corpus, synthetic_jpeg, time_per_image
+    from src.preprocessing import preprocess_image_from_bytes
+
+    corpora = {
+        'png': load_corpus(args.data_dir, args.limit),
+        f'jpeg{args.jpeg_size}': [synthetic_jpeg(args.jpeg_size, seed) for seed in range(args.jpeg_count)]
+    }
+    results = {}
+    for label, payloads in corpora.items():
+        if not payloads:
+            continue
+        fn = lambda items: [preprocess_image_from_bytes(item) for item in items]
+        fn(payloads[:1])
+        results[f'preprocess.{label}.us_per_image'] = metric(time_per_image(fn, payloads, args.repeats), 'us')
+    return results
+
+
+def bench_predict(args):
+    from benchmarks.serving import measure
+
+    report = measure(args.batch_sizes, args.iterations)
+    results = {
+        'predict.startup_s': metric(report['startup_s'], 's'),
+        'predict.first_request_ms': metric(report['first_request_ms'], 'ms')
+    }
+    for batch_size, steady in report['steady_state'].items():
+        results[f'predict.batch{batch_size}.p50_ms'] = metric(steady['p50_ms'], 'ms')
+        results[f'predict.batch{batch_size}.p99_ms'] = metric(steady['p99_ms'], 'ms')
+        results[f'predict.batch{batch_size}.images_per_s'] = metric(1000 / steady['per_image_ms'], 'images/s', 'higher')
+    return results
+
+
+def bench_retrain(args):
+    from benchmarks.retrain_input import build_store, epoch_times, fit_epoch_times, iterate_dataset
+    from src.data_pipeline import build_tfdata
+
+    results = {}
+    for data_dir in args.retrain_dirs:
+        if not os.path.isdir(data_dir):
+            continue
+        name = os.path.basename(data_dir.rstrip('/'))
+        data = build_tfdata(data_dir, args.retrain_batch_size, 'memory')
+        timings = epoch_times(iterate_dataset, data.train, args.epochs)
+        results[f'retrain.{name}.input_first_epoch_s'] = metric(timings[0], 's')
+        results[f'retrain.{name}.input_epoch_s'] = metric(np.median(timings[1:] or timings), 's')
+        with tempfile.TemporaryDirectory() as store_dir:
+            started = time.perf_counter()
+            store_data = build_store(data_dir, store_dir, args.retrain_batch_size)
+            results[f'retrain.{name}.store_import_s'] = metric(time.perf_counter() - started, 's')
+            timings = epoch_times(iterate_dataset, store_data.train, args.epochs)
+            results[f'retrain.{name}.store_epoch_s'] = metric(np.median(timings), 's')
+        if args.fit:
+            timings = fit_epoch_times(data, args.epochs)
+            results[f'retrain.{name}.fit_first_epoch_s'] = metric(timings[0], 's')
+            results[f'retrain.{name}.fit_epoch_s'] = metric(np.median(timings[1:] or timings), 's')
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class LocalServer:
+    def __init__(self, workers=1, cache=False, startup_timeout=300):
+        self.workers = workers
+        self.cache = cache
+        self.startup_timeout = startup_timeout
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.process = None
+        self.log = None
+        self.store_dir = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            command = [sys.executable, '-m', 'src.serve', '--workers', str(self.workers)]
+        else:
+            command = [sys.executable, '-m', 'uvicorn', 'api.main:app']
+        command += ['--host', '127.0.0.1', '--port', str(self.port), '--log-level', 'warning']
+        self.store_dir = tempfile.mkdtemp(prefix='landcover-store-')
+        env = {**os.environ, 'TF_CPP_MIN_LOG_LEVEL': '3', 'TRAINING_STORE_DIR': self.store_dir}
+        if not self.cache:
+            env['PREDICTION_CACHE_SIZE'] = '0'
+            env['PREDICTION_CACHE_DISK_PATH'] = ''
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        self.wait_ready()
+        return self
+
+    def wait_ready(self):
+        import httpx
+
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.log.seek(0)
+                raise RuntimeError(f"api server exited with {self.process.returncode}:\n{self.log.read().decode()[-2000:]}")
+            try:
+                if httpx.get(f'{self.url}/ready', timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.5)
+        raise TimeoutError(f"api server not ready after {self.startup_timeout}s")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+
+
+async def open_loop(client, url, payloads, rate, duration, seed=0):
+    rng = random.Random(seed)
+    loop = asyncio.get_running_loop()
+
+    async def send(scheduled_at, name, payload):
+        try:
+            response = await client.post(url, files={'file': (name, payload, 'image/png')})
+            status = response.status_code
+        except Exception:
+            status = 0
+        return status, (loop.time() - scheduled_at) * 1000
+
+    started = loop.time()
+    offset = 0.0
+    tasks = []
+    while True:
+        offset += rng.expovariate(rate)
+        if offset >= duration:
+            break
+        delay = started + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        name, payload = payloads[len(tasks) % len(payloads)]
+        tasks.append(asyncio.create_task(send(started + offset, name, payload)))
+    responses = await asyncio.gather(*tasks)
+    return responses, loop.time() - started
+
+
+async def drive_api(server, args):
+    import httpx
+
+    payloads = [(os.path.basename(path), open(path, 'rb').read()) for path in list_images(args.data_dir, args.limit)]
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    results = {}
+    async with httpx.AsyncClient(base_url=server.url, limits=limits, timeout=args.request_timeout) as client:
+        await open_loop(client, '/predict', payloads, min(args.rates), args.warmup_seconds)
+        for rate in args.rates:
+            responses, elapsed = await open_loop(client, '/predict', payloads, rate, args.duration)
+            ok = [latency for status, latency in responses if status == 200]
+            prefix = f'api.predict.rate{rate:g}'
+            results[f'{prefix}.throughput_rps'] = metric(len(ok) / elapsed, 'req/s', 'higher')
+            results[f'{prefix}.error_rate'] = metric(1 - len(ok) / max(1, len(responses)), 'ratio')
+            if ok:
+                results.update(latency_metrics(prefix, ok))
+
+        for path in ('/health', '/metrics'):
+            timings = []
+            for _ in range(args.probe_requests):
+                started = time.perf_counter()
+                (await client.get(path)).raise_for_status()
+                timings.append((time.perf_counter() - started) * 1000)
+            results.update(latency_metrics(f'api{path.replace("/", ".")}', timings))
+    return results
+
+
+def bench_api(args):
+    with LocalServer(args.api_workers, args.cache) as server:
+        return asyncio.run(drive_api(server, args))
+
+
+def bench_bulk(args):
+    import httpx
+
+    results = {}
+    with LocalServer(args.api_workers, args.cache) as server, httpx.Client(base_url=server.url, timeout=args.request_timeout) as client:
+        for data_dir in args.bulk_dirs:
+            paths = list_images(data_dir, args.bulk_limit)
+            if not paths:
+                continue
+            name = os.path.basename(data_dir.rstrip('/'))
+            files = [('files', (os.path.relpath(path, data_dir), open(path, 'rb').read(), 'image/png')) for path in paths]
+
+            started = time.perf_counter()
+            response = client.post('/upload-bulk', files=files)
+            response.raise_for_status()
+            accepted = response.json()
+            accepted_s = time.perf_counter() - started
+            while True:
+                job = client.get(accepted['progress_url']).json()
+                if job['status'] not in ('queued', 'running'):
+                    break
+                time.sleep(0.05)
+            total_s = time.perf_counter() - started
+
+            batch_path = os.path.normpath(accepted['batch_path'])
+            if batch_path.startswith(os.path.join('uploads', 'bulk_data')):
+                shutil.rmtree(batch_path, ignore_errors=True)
+            if job['status'] != 'completed':
+                raise RuntimeError(f"bulk upload job ended as {job['status']}: {job.get('error')}")
+
+            results[f'bulk.{name}.upload_s'] = metric(accepted_s, 's')
+            results[f'bulk.{name}.total_s'] = metric(total_s, 's')
+            results[f'bulk.{name}.images_per_s'] = metric(len(paths) / total_s, 'images/s', 'higher')
+    return results
+
+
+RUNNERS = {
+    'preprocess': bench_preprocess,
+    'predict': bench_predict,
+    'retrain': bench_retrain,
+    'api': bench_api,
+    'bulk': bench_bulk
+}
+
+
+def environment(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': commit or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'inference_backend': INFERENCE_BACKEND,
+        'serving_mode': SERVING_MODE,
+        'args': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'save_baseline')}
+    }
+
+
+def compare(results, baseline, tolerance):
+    rows = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            rows.append({'metric': name, 'baseline': None, 'current': current['value'], 'change': None, 'status': 'new'})
+            continue
+        if previous['value']:
+            change = (current['value'] - previous['value']) / abs(previous['value'])
+        else:
+            change = 0.0 if current['value'] == previous['value'] else math.copysign(math.inf, current['value'])
+        worse = change if current['better'] == 'lower' else -change
+        status = 'regression' if worse > tolerance else 'improved' if worse < -tolerance else 'ok'
+        rows.append({
+            'metric': name, 'baseline': previous['value'], 'current': current['value'],
+            'change': round(change, 4) if math.isfinite(change) else None, 'status': status
+        })
+    return rows
+
+
+def print_comparison(rows):
+    print(f"{'metric':52}{'baseline':>12}{'current':>12}{'change':>10}  status")
+    for row in rows:
+        baseline = '-' if row['baseline'] is None else f"{row['baseline']:g}"
+        change = '-' if row['change'] is None else f"{row['change'] * 100:+.1f}%"
+        print(f"{row['metric']:52}{baseline:>12}{row['current']:>12g}{change:>10}  {row['status']}")
+
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(',') if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="offline benchmark suite with json output and baseline comparison")
+    parser.add_argument('--suites', type=parse_list, default=list(SUITES), help=f"comma separated subset of {','.join(SUITES)}")
+    parser.add_argument('--data-dir', default='data/real_training_data', help="images for preprocess, predict and api runs")
+    parser.add_argument('--limit', type=int, default=200)
+    parser.add_argument('--jpeg-size', type=int, default=1024)
+    parser.add_argument('--jpeg-count', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--batch-sizes', type=lambda value: parse_list(value, int), default=[1, 8, 32])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--retrain-dirs', type=parse_list, default=['data/demo_training_data', 'data/real_training_data'])
+    parser.add_argument('--retrain-batch-size', type=int, default=8)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--fit', action=argparse.BooleanOptionalAction, default=True, help="also time model.fit epochs")
+    parser.add_argument('--rates', type=lambda value: parse_list(value, float), default=[10.0, 25.0, 50.0], help="open-loop arrival rates (req/s)")
+    parser.add_argument('--duration', type=float, default=10, help="seconds per arrival rate")
+    parser.add_argument('--warmup-seconds', type=float, default=3)
+    parser.add_argument('--max-connections', type=int, default=256)
+    parser.add_argument('--request-timeout', type=float, default=60)
+    parser.add_argument('--probe-requests', type=int, default=200, help="sequential /health and /metrics requests timed after the load runs")
+    parser.add_argument('--api-workers', type=int, default=1, help="more than 1 starts the server through src.serve")
+    parser.add_argument('--cache', action='store_true', help="keep the prediction cache enabled in the api server")
+    parser.add_argument('--bulk-dirs', type=parse_list, default=['data/demo_training_data', 'data/real_training_data'])
+    parser.add_argument('--bulk-limit', type=int, default=None)
+    parser.add_argument('--output', default=None, help=f"result file, defaults to {RESULTS_DIR}/<timestamp>.json")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="write these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="relative change that counts as a regression")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    random.seed(0)
+    np.random.seed(0)
+    results = {}
+    timings = {}
+    for suite in SUITES:
+        if suite not in args.suites:
+            continue
+        print(f"running {suite}...", flush=True)
+        started = time.perf_counter()
+        results.update(RUNNERS[suite](args))
+        timings[suite] = round(time.perf_counter() - started, 1)
+
+    report = {'environment': environment(args), 'suite_seconds': timings, 'results': results}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['baseline'] = {'path': args.baseline, 'environment': baseline.get('environment')}
+        report['comparison'] = compare(results, baseline['results'], args.tolerance)
+        print_comparison(report['comparison'])
+    else:
+        for name, value in results.items():
+            print(f"{name:52}{value['value']:>12g} {value['unit']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'environment': report['environment'], 'results': results}, f, indent=2)
+        print(f"baseline written to {args.baseline}")
+
+    regressions = [row for row in report.get('comparison', []) if row['status'] == 'regression']
+    if regressions:
+        print(f"{len(regressions)} metrics regressed by more than {args.tolerance * 100:g}%")
+        if args.fail_on_regression:
+            sys.exit(1)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -78,11 +78,23 @@ function Retrain() {
           startTime = Date.now();
         }
       });
-      console.log('Upload completed, response received');
+      console.log('Upload completed, validation job', response.data.job_id);
       setUploadProgress(95);
-      setUploadResult(response.data);
-      setValidationResults(response.data.validation_results);
-      setBatchPath(response.data.batch_path);
+
+      let job = null;
+      while (true) {
+        const jobResponse = await axios.get(`http://localhost:8000${response.data.progress_url}`);
+        job = jobResponse.data;
+        if (job.status === 'completed' || job.status === 'failed') break;
+        await new Promise(resolve => setTimeout(resolve, 500));
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Validation failed');
+      }
+
+      setUploadResult(job.result);
+      setValidationResults(job.result.validation_results);
+      setBatchPath(job.result.batch_path || job.result.train_data_path);
 
       setTimeout(() => {
         setUploadProgress(100);
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import random
+import time
+
+from locust import HttpUser, between, constant, task
+
+import locustfile
+
+TRAIN_DATA_PATH = os.environ.get("LOCUST_TRAIN_DATA_PATH", "data/demo_training_data")
+TRAIN_EPOCHS = int(os.environ.get("LOCUST_TRAIN_EPOCHS", 5))
+IDLE_SECONDS = float(os.environ.get("LOCUST_IDLE_SECONDS", 30))
+IMAGE_DIR = os.environ.get("LOCUST_IMAGE_DIR", "data/real_training_data")
+FINISHED_STATUSES = ("completed", "rejected", "failed", "cancelled")
+
+training_active = False
+
+
+def distinct_images(image_dir):
+    images = {}
+    for root, _, filenames in sorted(os.walk(image_dir)):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+                path = os.path.join(root, filename)
+                with open(path, "rb") as f:
+                    images.setdefault(hashlib.md5(f.read()).hexdigest(), path)
+    return list(images.values())
+
+
+class PredictDuringRetrainUser(locustfile.LandCoverUser):
+    wait_time = between(1, 3)
+
+    def on_start(self):
+        self.test_images = distinct_images(IMAGE_DIR)
+        self.sent = random.randrange(max(1, len(self.test_images)))
+
+    @task(5)
+    def predict_image(self):
+        if not self.test_images:
+            return
+
+        image_path = self.test_images[self.sent % len(self.test_images)]
+        self.sent += 1
+        phase = "retraining" if training_active else "idle"
+        with open(image_path, "rb") as f:
+            files = {"file": (os.path.basename(image_path), f, "image/jpeg")}
+            self.client.post("/predict", files=files, name=f"/predict [{phase}]")
+
+
+class RetrainUser(HttpUser):
+    fixed_count = 1
+    wait_time = constant(IDLE_SECONDS)
+
+    def on_start(self):
+        self.done = False
+        time.sleep(IDLE_SECONDS)
+
+    @task
+    def retrain_once(self):
+        global training_active
+        if self.done:
+            return
+
+        response = self.client.post(
+            "/retrain", params={"train_data_path": TRAIN_DATA_PATH, "epochs": TRAIN_EPOCHS}
+        )
+        if response.status_code != 200:
+            self.done = True
+            return
+
+        job_id = response.json()["job_id"]
+        training_active = True
+        try:
+            while True:
+                job = self.client.get(f"/retrain/{job_id}", params={"tail": 1}, name="/retrain/[job_id]").json()
+                if job["status"] in FINISHED_STATUSES:
+                    print(f"retrain job {job_id} {job['status']} after {job['elapsed_seconds']}s")
+                    break
+                time.sleep(2)
+        finally:
+            training_active = False
+            self.done = True
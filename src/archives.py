@@ -0,0 +1,51 @@
+import itertools
+import tarfile
+import zipfile
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp')
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+ARCHIVE_CONTENT_TYPES = (
+    'application/zip',
+    'application/x-zip-compressed',
+    'application/x-tar',
+    'application/gzip',
+    'application/x-gzip',
+)
+
+
+def is_image_name(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def is_archive(filename, content_type=None):
+    name = (filename or '').lower()
+    return name.endswith(ZIP_EXTENSIONS + TAR_EXTENSIONS) or content_type in ARCHIVE_CONTENT_TYPES
+
+
+def iter_archive_images(fileobj, filename, max_member_bytes):
+    if (filename or '').lower().endswith(ZIP_EXTENSIONS) or zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not is_image_name(info.filename):
+                    continue
+                if info.file_size > max_member_bytes:
+                    yield info.filename, None
+                    continue
+                yield info.filename, archive.read(info)
+        return
+
+    fileobj.seek(0)
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for member in archive:
+            if not member.isfile() or not is_image_name(member.name):
+                continue
+            if member.size > max_member_bytes:
+                yield member.name, None
+                continue
+            yield member.name, archive.extractfile(member).read()
+
+
+def take(iterator, count):
+    return list(itertools.islice(iterator, count))
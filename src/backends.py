@@ -0,0 +1,191 @@
+import os
+import threading
+
+import numpy as np
+
+from src.config import (
+    SERVING_MODE, TF_RUN_EAGERLY, WARMUP_BATCH_SIZES, TFLITE_NUM_THREADS, TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS
+)
+
+IMAGE_SHAPE = (64, 64, 3)
+
+
+def load_keras_model(model_path):
+    import tensorflow as tf
+    from tensorflow import keras
+
+    if TF_RUN_EAGERLY:
+        tf.config.run_functions_eagerly(True)
+    try:
+        if TF_INTRA_OP_THREADS:
+            tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+        if TF_INTER_OP_THREADS:
+            tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+    except RuntimeError:
+        pass
+    return keras.models.load_model(model_path)
+
+
+def embedding_model(model):
+    from tensorflow import keras
+
+    return keras.Model(model.inputs[0], [model.outputs[0], model.layers[-1].input])
+
+
+def load_tflite_interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        try:
+            import tensorflow as tf
+        except ImportError:
+            raise ImportError("tflite backend needs tflite-runtime or tensorflow installed")
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class KerasBackend:
+    name = 'keras'
+
+    def __init__(self, model_path, serving_mode=SERVING_MODE):
+        if serving_mode not in ('graph', 'eager'):
+            raise ValueError(f"unknown serving mode: {serving_mode}")
+        self.model_path = model_path
+        self.serving_mode = serving_mode
+        self.model = load_keras_model(model_path)
+        self.serve_fn = None
+        self.embed_fn = None
+        self.embedding_model = embedding_model(self.model)
+        self.num_classes = self.model.output_shape[-1]
+        self.embedding_dim = self.embedding_model.output_shape[1][-1]
+        self.build_serving_fn()
+
+    def build_serving_fn(self):
+        if self.serving_mode != 'graph':
+            self.serve_fn = None
+            self.embed_fn = None
+            return
+
+        import tensorflow as tf
+        model = self.model
+        embedding = self.embedding_model
+
+        @tf.function(input_signature=[tf.TensorSpec((None, *IMAGE_SHAPE), tf.float32)])
+        def serve(images):
+            return model(images, training=False)
+
+        @tf.function(input_signature=[tf.TensorSpec((None, *IMAGE_SHAPE), tf.float32)])
+        def embed(images):
+            return embedding(images, training=False)
+
+        self.serve_fn = serve
+        self.embed_fn = embed
+
+    def forward(self, image_array):
+        if self.serve_fn is None:
+            return self.model.predict(image_array, verbose=0)
+
+        import tensorflow as tf
+        images = tf.convert_to_tensor(image_array, dtype=tf.float32)
+        return self.serve_fn(images).numpy()
+
+    def forward_embed(self, image_array):
+        if self.embed_fn is None:
+            probabilities, embeddings = self.embedding_model.predict(image_array, verbose=0)
+            return probabilities, embeddings
+
+        import tensorflow as tf
+        probabilities, embeddings = self.embed_fn(tf.convert_to_tensor(image_array, dtype=tf.float32))
+        return probabilities.numpy(), embeddings.numpy()
+
+    def describe(self):
+        return f"keras ({self.serving_mode})"
+
+
+class TFLiteBackend:
+    name = 'tflite'
+
+    def __init__(self, model_path, num_threads=TFLITE_NUM_THREADS):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"tflite model missing: {model_path} (run python -m src.export)")
+        self.interpreter_class = load_tflite_interpreter_class()
+        self.model_path = model_path
+        self.num_threads = num_threads or None
+        self._local = threading.local()
+        interpreter = self._interpreter()
+        self.output_indices = self.signature_outputs(interpreter)
+        details = {detail['index']: detail for detail in interpreter.get_output_details()}
+        self.input_detail = interpreter.get_input_details()[0]
+        self.output_detail = details[self.output_indices[0]]
+        self.embedding_detail = details[self.output_indices[1]] if len(self.output_indices) > 1 else None
+        self.num_classes = int(self.output_detail['shape'][-1])
+        self.embedding_dim = int(self.embedding_detail['shape'][-1]) if self.embedding_detail else None
+
+    @staticmethod
+    def signature_outputs(interpreter):
+        signatures = interpreter.get_signature_list()
+        if len(signatures) == 1:
+            outputs = interpreter.get_signature_runner().get_output_details()
+            return [outputs[name]['index'] for name in sorted(outputs)]
+        return [detail['index'] for detail in interpreter.get_output_details()]
+
+    def _interpreter(self, batch_size=None):
+        local = self._local
+        if getattr(local, 'interpreter', None) is None:
+            local.interpreter = self.interpreter_class(model_path=self.model_path, num_threads=self.num_threads)
+            local.interpreter.allocate_tensors()
+            local.batch_size = int(local.interpreter.get_input_details()[0]['shape'][0])
+        if batch_size is not None and batch_size != local.batch_size:
+            local.interpreter.resize_tensor_input(self.input_detail['index'], [batch_size, *IMAGE_SHAPE])
+            local.interpreter.allocate_tensors()
+            local.batch_size = batch_size
+        return local.interpreter
+
+    def _run(self, image_array, embed):
+        interpreter = self._interpreter(len(image_array))
+        interpreter.set_tensor(self.input_detail['index'], self._quantize(image_array))
+        interpreter.invoke()
+        output = self._dequantize(interpreter.get_tensor(self.output_detail['index']), self.output_detail)
+        if not embed:
+            return output
+        return output, self._dequantize(interpreter.get_tensor(self.embedding_detail['index']), self.embedding_detail)
+
+    def _quantize(self, image_array):
+        dtype = self.input_detail['dtype']
+        if dtype == np.float32:
+            return np.asarray(image_array, dtype=np.float32)
+        scale, zero_point = self.input_detail['quantization']
+        info = np.iinfo(dtype)
+        quantized = np.round(np.asarray(image_array) / scale + zero_point)
+        return np.clip(quantized, info.min, info.max).astype(dtype)
+
+    def _dequantize(self, output, detail):
+        if detail['dtype'] == np.float32:
+            return output
+        scale, zero_point = detail['quantization']
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def forward(self, image_array):
+        return self._run(image_array, embed=False)
+
+    def forward_embed(self, image_array):
+        if self.embedding_detail is None:
+            raise ValueError(f"{self.model_path} has no embedding output, re-export it with python -m src.export")
+        return self._run(image_array, embed=True)
+
+    def describe(self):
+        return f"tflite ({self.input_detail['dtype'].__name__} input)"
+
+
+def create_backend(name, keras_model_path, tflite_model_path):
+    if name == 'keras':
+        return KerasBackend(keras_model_path)
+    if name == 'tflite':
+        return TFLiteBackend(tflite_model_path)
+    raise ValueError(f"unknown inference backend: {name}")
+
+
+def warm_up(backend, batch_sizes=WARMUP_BATCH_SIZES):
+    for batch_size in batch_sizes:
+        backend.forward(np.zeros((batch_size, *IMAGE_SHAPE), dtype=np.float32))
+    print(f"{backend.describe()} backend warmed up (batch sizes {list(batch_sizes)})")
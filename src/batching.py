@@ -0,0 +1,130 @@
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.metrics import metrics
+from src.tracing import Trace, current_trace
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5, executor=None):
+        self.predict_fn = predict_fn
+        self.inference_executor = executor
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self.batch_size_histogram = metrics.histogram('batch_size')
+        self.queue_wait_histogram = metrics.histogram('batch_queue_wait_seconds')
+        self.batches_run = 0
+        self.images_run = 0
+        self.queue = None
+        self.worker = None
+        self.executor = None
+
+    async def start(self):
+        if self.worker is not None:
+            return
+        self.queue = asyncio.Queue()
+        if self.inference_executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batcher")
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.worker is None:
+            return
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        self.worker = None
+
+        while not self.queue.empty():
+            _, _, future, _ = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("batcher stopped"))
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    async def submit(self, image_array):
+        if self.worker is None:
+            raise RuntimeError("batcher not started")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image_array, time.perf_counter(), future, current_trace.get()))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _dispatch(self, images):
+        if self.inference_executor is not None:
+            return await self.inference_executor.run(self.predict_fn, images)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, contextvars.copy_context().run, self.predict_fn, images)
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+
+            dispatched = time.perf_counter()
+            for _, enqueued, _, trace in batch:
+                self.queue_wait_histogram.observe(dispatched - enqueued)
+                if trace is not None:
+                    trace.add('batch_wait', enqueued, dispatched)
+            self.batch_size_histogram.observe(len(batch))
+
+            traced = [trace for _, _, _, trace in batch if trace is not None]
+            token = current_trace.set(Trace()) if traced else None
+            try:
+                images = np.concatenate([item[0] for item in batch], axis=0)
+                results = await self._dispatch(images)
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                if token is not None:
+                    batch_trace = current_trace.get()
+                    current_trace.reset(token)
+                    for trace in traced:
+                        trace.extend(batch_trace)
+
+            self.batches_run += 1
+            self.images_run += len(batch)
+
+            for (_, _, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "batches_run": self.batches_run,
+            "images_run": self.images_run,
+            "average_batch_size": round(self.images_run / self.batches_run, 2) if self.batches_run else 0,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "batch_size": self.batch_size_histogram.snapshot(),
+            "queue_wait_ms": self.queue_wait_histogram.snapshot(scale=1000)
+        }
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_hash(contents):
+    return hashlib.blake2b(contents, digest_size=16).hexdigest()
+
+
+class DiskCacheTier:
+    def __init__(self, path, max_entries=100000, ttl_seconds=3600):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.puts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, created REAL, result TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS predictions_created ON predictions (created)")
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created, result FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or time.time() - row[0] > self.ttl:
+            return None
+        return json.loads(row[1])
+
+    def put(self, key, result):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO predictions (key, created, result) VALUES (?, ?, ?)",
+                (key, time.time(), json.dumps(result))
+            )
+            self.puts += 1
+            if self.puts % 1000 == 0:
+                self._prune()
+
+    def _prune(self):
+        self._conn.execute("DELETE FROM predictions WHERE created < ?", (time.time() - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM predictions WHERE key NOT IN "
+            "(SELECT key FROM predictions ORDER BY created DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM predictions")
+
+
+class PredictionCache:
+    def __init__(self, max_entries=1024, ttl_seconds=3600, disk_path=None, disk_max_entries=100000):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.entries = OrderedDict()
+        self.disk = DiskCacheTier(disk_path, disk_max_entries, ttl_seconds) if disk_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def make_key(self, contents, model_version):
+        return f"{content_hash(contents)}:{model_version}"
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self.entries[key]
+                self.expirations += 1
+
+        if self.disk is not None:
+            result = self.disk.get(key)
+            if result is not None:
+                self._store(key, result)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return result
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result):
+        if not self.enabled:
+            return
+        self._store(key, result)
+        if self.disk is not None:
+            self.disk.put(key, result)
+
+    def _store(self, key, result):
+        with self._lock:
+            self.entries[key] = (time.monotonic() + self.ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear_memory(self):
+        with self._lock:
+            self.entries.clear()
+
+    def clear(self):
+        self.clear_memory()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "disk_tier": self.disk.path if self.disk is not None else None
+            }
@@ -0,0 +1,122 @@
+import os
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+def env_str(name, default):
+    return os.environ.get(name, default)
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+BATCH_MAX_SIZE = env_int('BATCH_MAX_SIZE', 32)
+BATCH_MAX_WAIT_MS = env_float('BATCH_MAX_WAIT_MS', 5)
+
+EXECUTOR_KIND = env_str('EXECUTOR_KIND', 'thread')
+EXECUTOR_WORKERS = env_int('EXECUTOR_WORKERS', os.cpu_count() or 1)
+EXECUTOR_MAX_QUEUE = env_int('EXECUTOR_MAX_QUEUE', 64)
+EXECUTOR_RETRY_AFTER = env_int('EXECUTOR_RETRY_AFTER', 1)
+
+SERVING_WORKERS = env_int('SERVING_WORKERS', 0)
+SERVING_THREADS_PER_WORKER = env_int('SERVING_THREADS_PER_WORKER', 1)
+SERVING_CPUS = env_str('SERVING_CPUS', '')
+SERVING_PIN_CPUS = env_bool('SERVING_PIN_CPUS', False)
+SERVING_WORKER_INDEX = env_int('SERVING_WORKER_INDEX', 0)
+SERVING_COUNTERS_PATH = env_str('SERVING_COUNTERS_PATH', '')
+TF_INTRA_OP_THREADS = env_int('TF_INTRA_OP_THREADS', 0)
+TF_INTER_OP_THREADS = env_int('TF_INTER_OP_THREADS', 0)
+
+METRICS_WINDOW_SECONDS = env_float('METRICS_WINDOW_SECONDS', 60)
+METRICS_WINDOW_SLOTS = env_int('METRICS_WINDOW_SLOTS', 6)
+SAMPLER_INTERVAL = env_float('SAMPLER_INTERVAL', 1.0)
+READY_MAX_LOOP_LAG_MS = env_float('READY_MAX_LOOP_LAG_MS', 500)
+
+TRACE_SAMPLE_RATE = env_float('TRACE_SAMPLE_RATE', 0.0)
+TRACE_FORCE_HEADER = env_str('TRACE_FORCE_HEADER', 'X-Trace')
+DEBUG_PROFILING = env_bool('DEBUG_PROFILING', False)
+PROFILE_MAX_SECONDS = env_float('PROFILE_MAX_SECONDS', 60)
+
+SERVING_MODE = env_str('SERVING_MODE', 'graph')
+TF_RUN_EAGERLY = env_bool('TF_RUN_EAGERLY', False)
+RETRAIN_RUN_EAGERLY = env_bool('RETRAIN_RUN_EAGERLY', False)
+WARMUP_BATCH_SIZES = tuple(int(size) for size in env_str('WARMUP_BATCH_SIZES', '1,8,32').split(',') if size)
+
+INFERENCE_BACKEND = env_str('INFERENCE_BACKEND', 'keras')
+TFLITE_MODEL_PATH = env_str('TFLITE_MODEL_PATH', 'models/model_rgb.tflite')
+TFLITE_NUM_THREADS = env_int('TFLITE_NUM_THREADS', 0)
+TFLITE_QUANTIZATION = env_str('TFLITE_QUANTIZATION', 'none')
+
+MODEL_REGISTRY_DIR = env_str('MODEL_REGISTRY_DIR', 'models/registry')
+MODEL_REGISTRY_KEEP = env_int('MODEL_REGISTRY_KEEP', 5)
+MODEL_REFRESH_INTERVAL = env_float('MODEL_REFRESH_INTERVAL', 1.0)
+
+CASCADE_MARGIN = env_float('CASCADE_MARGIN', 0.0)
+CASCADE_SHADOW_RATE = env_float('CASCADE_SHADOW_RATE', 0.02)
+DISTILL_EPOCHS = env_int('DISTILL_EPOCHS', 40)
+DISTILL_TEMPERATURE = env_float('DISTILL_TEMPERATURE', 2.0)
+DISTILL_ALPHA = env_float('DISTILL_ALPHA', 0.3)
+DISTILL_MAX_IMAGES = env_int('DISTILL_MAX_IMAGES', 10000)
+
+PREDICTION_CACHE_SIZE = env_int('PREDICTION_CACHE_SIZE', 1024)
+PREDICTION_CACHE_TTL = env_float('PREDICTION_CACHE_TTL', 3600)
+PREDICTION_CACHE_DISK_PATH = env_str('PREDICTION_CACHE_DISK_PATH', '')
+PREDICTION_CACHE_DISK_SIZE = env_int('PREDICTION_CACHE_DISK_SIZE', 100000)
+
+PREDICTION_LOG_DIR = env_str('PREDICTION_LOG_DIR', 'logs/predictions')
+PREDICTION_LOG_BUFFER = env_int('PREDICTION_LOG_BUFFER', 65536)
+PREDICTION_LOG_FLUSH_SECONDS = env_float('PREDICTION_LOG_FLUSH_SECONDS', 1.0)
+PREDICTION_LOG_SEGMENT_ROWS = env_int('PREDICTION_LOG_SEGMENT_ROWS', 1000000)
+PREDICTION_LOG_KEEP_DAYS = env_int('PREDICTION_LOG_KEEP_DAYS', 30)
+
+PREDICT_BATCH_CHUNK = env_int('PREDICT_BATCH_CHUNK', BATCH_MAX_SIZE)
+PREDICT_BATCH_MAX_FILES = env_int('PREDICT_BATCH_MAX_FILES', 10000)
+ARCHIVE_MAX_MEMBER_BYTES = env_int('ARCHIVE_MAX_MEMBER_BYTES', 20 * 1024 * 1024)
+
+INGEST_CHUNK_SIZE = env_int('INGEST_CHUNK_SIZE', BATCH_MAX_SIZE)
+INGEST_WRITE_CONCURRENCY = env_int('INGEST_WRITE_CONCURRENCY', 16)
+
+TRAINING_STORE_DIR = env_str('TRAINING_STORE_DIR', 'uploads/training_store')
+TRAINING_STORE_KEEP_UPLOADS = env_bool('TRAINING_STORE_KEEP_UPLOADS', False)
+
+SCREEN_ENABLED = env_bool('SCREEN_ENABLED', True)
+SCREEN_NEIGHBOURS = env_int('SCREEN_NEIGHBOURS', 10)
+SCREEN_DUPLICATE_SIMILARITY = env_float('SCREEN_DUPLICATE_SIMILARITY', 0.995)
+SCREEN_OUTLIER_AGREEMENT = env_float('SCREEN_OUTLIER_AGREEMENT', 0.1)
+SCREEN_NPROBE = env_int('SCREEN_NPROBE', 8)
+
+JOB_DB_PATH = env_str('JOB_DB_PATH', 'uploads/jobs.sqlite')
+
+SCENE_DIR = env_str('SCENE_DIR', 'uploads/scenes')
+SCENE_TILE_SIZE = env_int('SCENE_TILE_SIZE', 64)
+SCENE_STRIDE = env_int('SCENE_STRIDE', 64)
+SCENE_BATCH_SIZE = env_int('SCENE_BATCH_SIZE', 256)
+SCENE_MAX_DECODE_PIXELS = env_int('SCENE_MAX_DECODE_PIXELS', 8192 * 8192)
+
+RETRAIN_BATCH_SIZE = env_int('RETRAIN_BATCH_SIZE', 8)
+RETRAIN_INPUT_PIPELINE = env_str('RETRAIN_INPUT_PIPELINE', 'tfdata')
+RETRAIN_CACHE = env_str('RETRAIN_CACHE', 'memory')
+RETRAIN_CACHE_DIR = env_str('RETRAIN_CACHE_DIR', 'cache/retrain')
+RETRAIN_SHUFFLE_BUFFER = env_int('RETRAIN_SHUFFLE_BUFFER', 10000)
+RETRAIN_VALID_ONLY = env_bool('RETRAIN_VALID_ONLY', False)
+RETRAIN_MODE = env_str('RETRAIN_MODE', 'full')
+RETRAIN_LEARNING_RATE = env_float('RETRAIN_LEARNING_RATE', 0.001)
+RETRAIN_REPLAY_RATIO = env_float('RETRAIN_REPLAY_RATIO', 2.0)
+RETRAIN_PATIENCE = env_int('RETRAIN_PATIENCE', 2)
+
+TRAINING_DIR = env_str('TRAINING_DIR', 'logs/training')
+TRAINING_THREADS = env_int('TRAINING_THREADS', max(1, (os.cpu_count() or 2) // 2))
+TRAINING_CPUS = env_str('TRAINING_CPUS', '')
+TRAINING_NICE = env_int('TRAINING_NICE', 10)
+TRAINING_MIN_ACCURACY = env_float('TRAINING_MIN_ACCURACY', 0.0)
+TRAINING_MAX_REGRESSION = env_float('TRAINING_MAX_REGRESSION', 0.02)
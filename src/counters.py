@@ -0,0 +1,42 @@
+import mmap
+import os
+import threading
+
+import numpy as np
+
+
+class SharedCounters:
+    def __init__(self, names, path='', slots=1, slot=0):
+        self.names = tuple(names)
+        self.columns = {name: i for i, name in enumerate(self.names)}
+        self.slot = slot
+        size = max(1, slots) * len(self.names) * 8
+        if path:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+                self._buffer = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        else:
+            self._buffer = bytearray(size)
+        self.values = np.frombuffer(self._buffer, dtype=np.int64).reshape(max(1, slots), len(self.names))
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1):
+        column = self.columns[name]
+        with self._lock:
+            self.values[self.slot, column] += amount
+
+    def set(self, name, value):
+        self.values[self.slot, self.columns[name]] = value
+
+    def get(self, name):
+        return int(self.values[self.slot, self.columns[name]])
+
+    def total(self, name):
+        return int(self.values[:, self.columns[name]].sum())
+
+    def per_slot(self):
+        return [dict(zip(self.names, row)) for row in self.values.tolist()]
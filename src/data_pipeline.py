@@ -0,0 +1,230 @@
+import hashlib
+import os
+
+import numpy as np
+
+IMAGE_SIZE = (64, 64)
+VALIDATION_SPLIT = 0.2
+WHITE_LIST_FORMATS = ('png', 'jpg', 'jpeg', 'bmp', 'ppm', 'tif', 'tiff')
+PIL_ONLY_PATTERN = r'.*\.(ppm|tif|tiff)'
+
+
+class RetrainData:
+    def __init__(self, train, validation, class_indices, train_samples, validation_samples, batch_size):
+        self.train = train
+        self.validation = validation
+        self.class_indices = class_indices
+        self.train_samples = train_samples
+        self.validation_samples = validation_samples
+        self.batch_size = batch_size
+
+
+def list_class_files(class_dir):
+    files = []
+    for root, _, filenames in sorted(os.walk(class_dir, followlinks=False)):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(WHITE_LIST_FORMATS):
+                files.append(os.path.join(root, filename))
+    return files
+
+
+def split_samples(data_path, validation_split=VALIDATION_SPLIT, class_indices=None):
+    class_names = sorted(d for d in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, d)))
+    if class_indices is None:
+        class_indices = {name: idx for idx, name in enumerate(class_names)}
+    else:
+        class_names = [name for name in class_names if name in class_indices]
+        class_indices = {name: class_indices[name] for name in class_names}
+
+    train = []
+    validation = []
+    for name in class_names:
+        files = list_class_files(os.path.join(data_path, name))
+        split = int(validation_split * len(files))
+        validation.extend((path, class_indices[name]) for path in files[:split])
+        train.extend((path, class_indices[name]) for path in files[split:])
+    return train, validation, class_indices
+
+
+def cache_file(cache_dir, subset, samples):
+    digest = hashlib.sha1()
+    for path, label in samples:
+        stat = os.stat(path)
+        digest.update(f"{path}|{label}|{stat.st_mtime_ns}|{stat.st_size}\n".encode())
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, f"{subset}_{digest.hexdigest()[:16]}")
+
+
+def decode_with_pil(path):
+    from PIL import Image
+
+    with Image.open(path.decode()) as image:
+        return np.asarray(image.convert('RGB'), dtype=np.uint8)
+
+
+def make_dataset(samples, batch_size, shuffle, cache, cache_path, shuffle_buffer, seed=None):
+    import tensorflow as tf
+
+    def load(path, label):
+        image = tf.cond(
+            tf.strings.regex_full_match(tf.strings.lower(path), PIL_ONLY_PATTERN),
+            lambda: tf.numpy_function(decode_with_pil, [path], tf.uint8, stateful=False),
+            lambda: tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        )
+        image.set_shape((None, None, 3))
+        image = tf.image.resize(image, IMAGE_SIZE, method='nearest')
+        return tf.cast(image, tf.uint8), label
+
+    def scale(images, labels):
+        return tf.cast(images, tf.float32) / 255.0, labels
+
+    paths = [path for path, _ in samples]
+    labels = [label for _, label in samples]
+
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    dataset = dataset.map(load, num_parallel_calls=tf.data.AUTOTUNE)
+    if cache == 'disk':
+        dataset = dataset.cache(cache_path)
+    elif cache == 'memory':
+        dataset = dataset.cache()
+    if shuffle:
+        dataset = dataset.shuffle(min(shuffle_buffer, len(samples)), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(scale, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def build_tfdata(data_path, batch_size, cache='memory', cache_dir='cache/retrain', shuffle_buffer=10000,
+                 validation_split=VALIDATION_SPLIT, class_indices=None):
+    if cache not in ('memory', 'disk', 'none'):
+        raise ValueError(f"unknown retrain cache mode: {cache}")
+
+    train, validation, class_indices = split_samples(data_path, validation_split, class_indices)
+    if not train:
+        raise ValueError(f"No training samples found. Directory: {data_path}, Subdirs: {list(class_indices)}")
+
+    train_batch_size = min(batch_size, len(train))
+    train_ds = make_dataset(
+        train, train_batch_size, True, cache,
+        cache_file(cache_dir, 'train', train) if cache == 'disk' else None, shuffle_buffer
+    )
+
+    validation_ds = None
+    if validation:
+        validation_ds = make_dataset(
+            validation, min(batch_size, len(validation)), False, cache,
+            cache_file(cache_dir, 'validation', validation) if cache == 'disk' else None, shuffle_buffer
+        )
+
+    return RetrainData(train_ds, validation_ds, class_indices, len(train), len(validation), train_batch_size)
+
+
+def split_store(store, validation_split=VALIDATION_SPLIT, valid_only=False, class_indices=None):
+    rows = np.arange(len(store))
+    if valid_only:
+        rows = rows[store.column('valid') == 1]
+    labels = np.asarray(store.column('labels'))
+    class_names = sorted(store.classes[label] for label in np.unique(labels[rows]))
+    if class_indices is None:
+        class_indices = {name: idx for idx, name in enumerate(class_names)}
+    else:
+        class_indices = {name: class_indices[name] for name in class_names if name in class_indices}
+    remap = np.full(len(store.classes), -1, dtype=np.int32)
+    for name, idx in class_indices.items():
+        remap[store.classes.index(name)] = idx
+    labels = remap[labels]
+    rows = rows[labels[rows] >= 0]
+
+    buckets = np.ascontiguousarray(store.column('hashes')[rows, :4]).view('>u4')[:, 0] / 2 ** 32
+    return rows[buckets >= validation_split], rows[buckets < validation_split], labels, class_indices
+
+
+def make_store_dataset(images, labels, rows, batch_size, shuffle, seed=None):
+    import tensorflow as tf
+    from src.preprocessing import SCALE
+
+    rng = np.random.default_rng(seed)
+
+    def batches():
+        order = rng.permutation(rows) if shuffle else rows
+        for start in range(0, len(order), batch_size):
+            index = np.sort(order[start:start + batch_size])
+            yield np.multiply(images[index], SCALE, dtype=np.float32), labels[index]
+
+    dataset = tf.data.Dataset.from_generator(batches, output_signature=(
+        tf.TensorSpec((None, *images.shape[1:]), tf.float32),
+        tf.TensorSpec((None,), tf.int32)
+    ))
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(-(-len(rows) // batch_size)))
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def build_store_data(store_path, batch_size, validation_split=VALIDATION_SPLIT, valid_only=False, class_indices=None):
+    from src.datastore import TrainingStore
+
+    store = TrainingStore(store_path)
+    train, validation, labels, class_indices = split_store(store, validation_split, valid_only, class_indices)
+    if not len(train):
+        raise ValueError(f"No training samples found. Store: {store_path}, {len(store)} samples, classes: {store.classes}")
+
+    images = store.column('images')
+    train_batch_size = min(batch_size, len(train))
+    train_ds = make_store_dataset(images, labels, train, train_batch_size, True)
+    validation_ds = None
+    if len(validation):
+        validation_ds = make_store_dataset(images, labels, validation, min(batch_size, len(validation)), False)
+    return RetrainData(train_ds, validation_ds, class_indices, len(train), len(validation), train_batch_size)
+
+
+def build_generators(data_path, batch_size, validation_split=VALIDATION_SPLIT, class_indices=None):
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+    classes = None
+    if class_indices is not None:
+        classes = sorted(class_indices, key=class_indices.get)
+    datagen = ImageDataGenerator(rescale=1./255, validation_split=validation_split)
+    train_generator = datagen.flow_from_directory(
+        data_path,
+        target_size=IMAGE_SIZE,
+        batch_size=batch_size,
+        class_mode='sparse',
+        classes=classes,
+        subset='training',
+        shuffle=True
+    )
+    if train_generator.samples == 0:
+        raise ValueError(f"No training samples found. Directory: {data_path}, Subdirs: {list(train_generator.class_indices)}")
+    present = set(np.unique(train_generator.classes).tolist())
+    found_indices = {name: idx for name, idx in train_generator.class_indices.items() if idx in present}
+    train_generator.batch_size = min(batch_size, train_generator.samples)
+
+    val_generator = datagen.flow_from_directory(
+        data_path,
+        target_size=IMAGE_SIZE,
+        batch_size=batch_size,
+        class_mode='sparse',
+        classes=classes,
+        subset='validation'
+    )
+    validation = None
+    if val_generator.samples > 0:
+        val_generator.batch_size = min(batch_size, val_generator.samples)
+        validation = val_generator
+
+    return RetrainData(
+        train_generator, validation, found_indices,
+        train_generator.samples, val_generator.samples, train_generator.batch_size
+    )
+
+
+def build_retrain_data(data_path, batch_size, pipeline='tfdata', cache='memory', cache_dir='cache/retrain',
+                       shuffle_buffer=10000, valid_only=False, class_indices=None):
+    from src.datastore import is_store
+
+    if is_store(data_path):
+        return build_store_data(data_path, batch_size, valid_only=valid_only, class_indices=class_indices)
+    if pipeline == 'generator':
+        return build_generators(data_path, batch_size, class_indices=class_indices)
+    if pipeline == 'tfdata':
+        return build_tfdata(data_path, batch_size, cache, cache_dir, shuffle_buffer, class_indices=class_indices)
+    raise ValueError(f"unknown retrain input pipeline: {pipeline}")
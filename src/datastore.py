@@ -0,0 +1,224 @@
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from src.config import TRAINING_STORE_DIR
+from src.preprocessing import TARGET_SIZE
+
+HEADER_FILENAME = 'store.json'
+HASH_BYTES = 20
+UNVALIDATED = -1
+COLUMNS = {
+    'images': (np.uint8, (TARGET_SIZE[1], TARGET_SIZE[0], 3)),
+    'hashes': (np.uint8, (HASH_BYTES,)),
+    'labels': (np.int16, ()),
+    'valid': (np.int8, ()),
+    'confidence': (np.float32, ()),
+    'batches': (np.int32, ())
+}
+
+
+def content_hash(pixels):
+    return hashlib.sha1(np.ascontiguousarray(pixels, dtype=np.uint8)).digest()
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, HEADER_FILENAME))
+
+
+def row_bytes(name):
+    dtype, shape = COLUMNS[name]
+    return np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64))
+
+
+class TrainingStore:
+    def __init__(self, directory=TRAINING_STORE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.header_path = os.path.join(directory, HEADER_FILENAME)
+        self.lock_path = os.path.join(directory, 'store.lock')
+        self.header = {'count': 0, 'classes': [], 'batches': []}
+        self._hashes = {}
+        self._lock = threading.Lock()
+        with self._lock:
+            self._refresh()
+        if not os.path.exists(self.header_path):
+            with self._locked():
+                if not os.path.exists(self.header_path):
+                    self._write_header(self.header)
+
+    def __len__(self):
+        return self.header['count']
+
+    @property
+    def classes(self):
+        return self.header['classes']
+
+    @property
+    def batches(self):
+        return self.header['batches']
+
+    def column_path(self, name):
+        return os.path.join(self.directory, f"{name}.bin")
+
+    def column(self, name, count=None):
+        count = self.header['count'] if count is None else count
+        dtype, shape = COLUMNS[name]
+        if count == 0:
+            return np.empty((0, *shape), dtype=dtype)
+        return np.memmap(self.column_path(name), dtype, 'r', shape=(count, *shape))
+
+    def refresh(self):
+        with self._lock:
+            return self._refresh()
+
+    def append(self, pixels, classes, batch, valid=None, confidence=None):
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        valid = [None] * len(pixels) if valid is None else valid
+        confidence = [0.0] * len(pixels) if confidence is None else confidence
+        digests = [content_hash(image) for image in pixels]
+
+        with self._locked():
+            header = self._refresh()
+            count = header['count']
+            pending = {}
+            rows = []
+            for digest in digests:
+                row = self._hashes.get(digest, pending.get(digest))
+                if row is None:
+                    row = pending[digest] = count + len(pending)
+                    rows.append((row, False))
+                else:
+                    rows.append((row, True))
+            if not pending:
+                return rows
+
+            keep = [i for i, (_, duplicate) in enumerate(rows) if not duplicate]
+            header = {
+                'count': count + len(keep),
+                'classes': header['classes'] + sorted({classes[i] for i in keep} - set(header['classes'])),
+                'batches': header['batches'] + ([batch] if batch not in header['batches'] else [])
+            }
+            class_index = {name: i for i, name in enumerate(header['classes'])}
+            values = {
+                'images': pixels[keep],
+                'hashes': np.frombuffer(b''.join(digests[i] for i in keep), dtype=np.uint8),
+                'labels': [class_index[classes[i]] for i in keep],
+                'valid': [UNVALIDATED if valid[i] is None else int(valid[i]) for i in keep],
+                'confidence': [confidence[i] for i in keep],
+                'batches': [header['batches'].index(batch)] * len(keep)
+            }
+            for name, column in values.items():
+                self._write_column(name, count, column)
+            self._write_header(header)
+            self._hashes.update(pending)
+            self.header = header
+        return rows
+
+    def stats(self):
+        header = self.refresh()
+        count = header['count']
+        labels = np.bincount(self.column('labels'), minlength=len(header['classes'])) if count else []
+        batches = np.bincount(self.column('batches'), minlength=len(header['batches'])) if count else []
+        valid = self.column('valid')
+        return {
+            'path': self.directory,
+            'samples': count,
+            'valid': int(np.count_nonzero(valid == 1)),
+            'invalid': int(np.count_nonzero(valid == 0)),
+            'unvalidated': int(np.count_nonzero(valid == UNVALIDATED)),
+            'bytes': sum(row_bytes(name) * count for name in COLUMNS),
+            'classes': {name: int(n) for name, n in zip(header['classes'], labels)},
+            'batches': {name: int(n) for name, n in zip(header['batches'], batches)}
+        }
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        try:
+            with open(self.header_path) as f:
+                header = json.load(f)
+        except FileNotFoundError:
+            return self.header
+        known = len(self._hashes)
+        if header['count'] > known:
+            hashes = self.column('hashes', header['count'])
+            for row in range(known, header['count']):
+                self._hashes[hashes[row].tobytes()] = row
+        self.header = header
+        return header
+
+    def _write_column(self, name, count, values):
+        dtype, _ = COLUMNS[name]
+        with open(self.column_path(name), 'ab') as f:
+            f.truncate(count * row_bytes(name))
+            f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_header(self, header):
+        path = f"{self.header_path}.tmp"
+        with open(path, 'w') as f:
+            json.dump(header, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path, self.header_path)
+
+
+def import_directory(store, data_path, batch, chunk_size=256):
+    from src.data_pipeline import split_samples
+    from src.preprocessing import decode_into
+
+    train, validation, class_indices = split_samples(data_path, 0)
+    names = {index: name for name, index in class_indices.items()}
+    samples = train + validation
+    added = duplicates = errors = 0
+    pixels = np.empty((chunk_size, *COLUMNS['images'][1]), dtype=np.uint8)
+    for start in range(0, len(samples), chunk_size):
+        classes = []
+        for path, label in samples[start:start + chunk_size]:
+            try:
+                decode_into(path, pixels[len(classes)])
+            except Exception as e:
+                print(f"skipping {path}: {e}")
+                errors += 1
+                continue
+            classes.append(names[label])
+        rows = store.append(pixels[:len(classes)], classes, batch)
+        duplicates += sum(1 for _, duplicate in rows if duplicate)
+        added += sum(1 for _, duplicate in rows if not duplicate)
+    return {'added': added, 'duplicates': duplicates, 'errors': errors}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="manage the deduplicated training data store")
+    parser.add_argument('--store', default=TRAINING_STORE_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help="append a <class>/<image> directory tree")
+    import_parser.add_argument('path')
+    import_parser.add_argument('--batch', help="batch name recorded for the imported samples (default: folder name)")
+    commands.add_parser('stats')
+    args = parser.parse_args(argv)
+
+    store = TrainingStore(args.store)
+    if args.command == 'import':
+        batch = args.batch or os.path.basename(os.path.normpath(args.path))
+        print(json.dumps(import_directory(store, args.path, batch)))
+    print(json.dumps(store.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
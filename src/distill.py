@@ -0,0 +1,306 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from src.config import (
+    INFERENCE_BACKEND, TFLITE_QUANTIZATION, CASCADE_MARGIN, DISTILL_EPOCHS, DISTILL_TEMPERATURE, DISTILL_ALPHA,
+    DISTILL_MAX_IMAGES,
+    MODEL_REGISTRY_DIR, MODEL_REGISTRY_KEEP
+)
+from src.data_pipeline import VALIDATION_SPLIT, list_class_files
+from src.datastore import TrainingStore, content_hash, is_store
+from src.preprocessing import SCALE, TARGET_SIZE
+from src.registry import (
+    CASCADE_FILENAME, FAST_KERAS_FILENAME, FAST_TFLITE_FILENAME, KERAS_FILENAME, MAPPING_FILENAME, TFLITE_FILENAME,
+    ModelRegistry
+)
+
+DATA_DIRS = ('data/real_training_data', 'data/demo_training_data', 'data/complete_training_data')
+REPORT_MARGINS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+BATCH_SIZE = 64
+FORWARD_BATCH = 256
+STORE_READ_BATCH = 4096
+TIMING_BATCH = 32
+TIMING_REPEATS = 20
+
+
+def load_images(data_dirs, store_path=None, max_images=DISTILL_MAX_IMAGES, seed=0):
+    from src.preprocessing import decode_into
+
+    paths = []
+    for data_dir in data_dirs:
+        if not os.path.isdir(data_dir):
+            continue
+        for name in sorted(os.listdir(data_dir)):
+            if os.path.isdir(os.path.join(data_dir, name)):
+                paths.extend((path, name) for path in list_class_files(os.path.join(data_dir, name)))
+
+    store = TrainingStore(store_path) if store_path and is_store(store_path) else None
+    count = len(paths) + (len(store) if store is not None else 0)
+    chosen = np.arange(count)
+    if max_images and count > max_images:
+        chosen = np.sort(np.random.default_rng(seed).choice(count, max_images, replace=False))
+    pixels = np.empty((len(chosen), TARGET_SIZE[1], TARGET_SIZE[0], 3), dtype=np.uint8)
+    names = []
+    seen = set()
+    for index in chosen[chosen < len(paths)]:
+        path, name = paths[index]
+        try:
+            decode_into(path, pixels[len(names)])
+        except Exception as e:
+            print(f"skipping {path}: {e}")
+            continue
+        digest = content_hash(pixels[len(names)])
+        if digest not in seen:
+            seen.add(digest)
+            names.append(name)
+
+    rows = chosen[chosen >= len(paths)] - len(paths)
+    if len(rows):
+        images, hashes, labels = store.column('images'), store.column('hashes'), store.column('labels')
+        for start in range(0, len(rows), STORE_READ_BATCH):
+            batch = rows[start:start + STORE_READ_BATCH]
+            for image, digest, label in zip(images[batch], hashes[batch], labels[batch]):
+                digest = digest.tobytes()
+                if digest not in seen:
+                    seen.add(digest)
+                    pixels[len(names)] = image
+                    names.append(store.classes[label])
+    return pixels[:len(names)], names
+
+
+def scaled(pixels):
+    return np.multiply(pixels, SCALE, dtype=np.float32)
+
+
+def forward_batches(backend, pixels):
+    return np.concatenate([
+        backend.forward(scaled(pixels[start:start + FORWARD_BATCH])) for start in range(0, len(pixels), FORWARD_BATCH)
+    ])
+
+
+def holdout_mask(pixels, validation_split=VALIDATION_SPLIT):
+    buckets = np.array([int.from_bytes(content_hash(image)[:4], 'big') for image in pixels]) / 2 ** 32
+    return buckets < validation_split
+
+
+def soften(probabilities, temperature):
+    logits = np.log(np.clip(probabilities, 1e-8, 1.0)) / temperature
+    logits -= logits.max(axis=1, keepdims=True)
+    softened = np.exp(logits)
+    return softened / softened.sum(axis=1, keepdims=True)
+
+
+def build_student(num_classes):
+    from tensorflow import keras
+
+    inputs = keras.Input(shape=(TARGET_SIZE[1], TARGET_SIZE[0], 3))
+    x = keras.layers.Conv2D(16, 3, strides=2, padding='same', activation='relu')(inputs)
+    x = keras.layers.SeparableConv2D(32, 3, strides=2, padding='same', activation='relu')(x)
+    x = keras.layers.SeparableConv2D(64, 3, strides=2, padding='same', activation='relu')(x)
+    x = keras.layers.GlobalAveragePooling2D()(x)
+    x = keras.layers.Dense(32, activation='relu')(x)
+    logits = keras.layers.Dense(num_classes)(x)
+    return inputs, logits
+
+
+def scale_batch(images, targets):
+    import tensorflow as tf
+
+    return tf.cast(images, tf.float32) * SCALE, targets
+
+
+def augment(images, targets):
+    import tensorflow as tf
+
+    images, targets = scale_batch(images, targets)
+    images = tf.image.rot90(images, tf.random.uniform((), 0, 4, dtype=tf.int32))
+    images = tf.image.random_flip_left_right(images)
+    return images, targets
+
+
+def train_student(pixels, targets, validation, num_classes, epochs=DISTILL_EPOCHS, temperature=DISTILL_TEMPERATURE,
+                  log=print, seed=0):
+    import tensorflow as tf
+    from tensorflow import keras
+
+    tf.random.set_seed(seed)
+    inputs, logits = build_student(num_classes)
+    trainer = keras.Model(inputs, keras.layers.Softmax()(keras.layers.Rescaling(1 / temperature)(logits)))
+    student = keras.Model(inputs, keras.layers.Softmax()(logits))
+    trainer.compile(optimizer=keras.optimizers.Adam(3e-3), loss='categorical_crossentropy')
+
+    dataset = tf.data.Dataset.from_tensor_slices((pixels, targets)).shuffle(len(pixels), seed=seed)
+    dataset = dataset.batch(BATCH_SIZE).map(augment, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+    callbacks = []
+    if validation is not None:
+        validation = tf.data.Dataset.from_tensor_slices(validation).batch(FORWARD_BATCH).map(scale_batch)
+        callbacks.append(keras.callbacks.EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True))
+    history = trainer.fit(dataset, epochs=epochs, validation_data=validation, verbose=0, callbacks=callbacks)
+    log(f"Distilled for {len(history.history['loss'])} epochs, final loss {history.history['loss'][-1]:.4f}")
+    return student
+
+
+def time_forward(backend, pixels):
+    batch = scaled(pixels[:TIMING_BATCH])
+    backend.forward(batch)
+    started = time.perf_counter()
+    for _ in range(TIMING_REPEATS):
+        backend.forward(batch)
+    return (time.perf_counter() - started) * 1000 / (TIMING_REPEATS * len(batch))
+
+
+def cascade_report(full, fast, labels, full_ms, fast_ms, margins=REPORT_MARGINS):
+    known = labels >= 0
+    full_top, fast_top = full.argmax(axis=1), fast.argmax(axis=1)
+    top2 = np.partition(fast, -2, axis=1)[:, -2:]
+    fast_margin = top2[:, 1] - top2[:, 0]
+    full_accuracy = float(np.mean(full_top[known] == labels[known])) if known.any() else None
+
+    rows = []
+    for margin in margins:
+        escalate = fast_margin < margin
+        served = np.where(escalate, full_top, fast_top)
+        accuracy = float(np.mean(served[known] == labels[known])) if known.any() else None
+        hit_rate = 1 - float(escalate.mean())
+        rows.append({
+            'margin': margin,
+            'hit_rate': round(hit_rate, 4),
+            'agreement': round(float(np.mean(served == full_top)), 4),
+            'accuracy': round(accuracy, 4) if accuracy is not None else None,
+            'accuracy_delta': round(accuracy - full_accuracy, 4) if accuracy is not None else None,
+            'relative_cost': round((fast_ms + (1 - hit_rate) * full_ms) / full_ms, 4)
+        })
+    return {
+        'images': len(labels),
+        'labelled_images': int(known.sum()),
+        'full_accuracy': round(full_accuracy, 4) if full_accuracy is not None else None,
+        'fast_accuracy': round(float(np.mean(fast_top[known] == labels[known])), 4) if known.any() else None,
+        'fast_agreement': round(float(np.mean(fast_top == full_top)), 4),
+        'full_ms_per_image': round(full_ms, 4),
+        'fast_ms_per_image': round(fast_ms, 4),
+        'margins': rows
+    }
+
+
+def distill(teacher_path, mapping_path, output_dir, data_dirs=DATA_DIRS, store_path=None, backend_name=INFERENCE_BACKEND,
+            epochs=DISTILL_EPOCHS, temperature=DISTILL_TEMPERATURE, alpha=DISTILL_ALPHA, max_images=DISTILL_MAX_IMAGES,
+            log=print):
+    from src.backends import create_backend
+    from src.model import CODE_TO_NAME, build_label_lookup
+
+    pixels, names = load_images(data_dirs, store_path, max_images)
+    if not len(pixels):
+        raise FileNotFoundError(f"no images to distill from in {list(data_dirs)}")
+    log(f"Distilling {teacher_path} on {len(pixels)} unique images")
+
+    teacher = create_backend('keras', teacher_path, None)
+    full = forward_batches(teacher, pixels)
+    num_classes = full.shape[1]
+    _, index_names = build_label_lookup(np.load(mapping_path, allow_pickle=True).item(), CODE_TO_NAME, num_classes)
+    name_index = {name: i for i, name in enumerate(index_names.tolist())}
+    labels = np.array([name_index.get(name, -1) for name in names])
+
+    targets = soften(full, temperature)
+    known = labels >= 0
+    targets[known] = (1 - alpha) * targets[known] + alpha * np.eye(num_classes, dtype=np.float32)[labels[known]]
+    holdout = holdout_mask(pixels)
+    if holdout.all() or not holdout.any():
+        holdout = np.zeros(len(pixels), dtype=bool)
+    validation = (pixels[holdout], targets[holdout]) if holdout.any() else None
+
+    student = train_student(pixels[~holdout], targets[~holdout], validation, num_classes, epochs, temperature, log)
+    os.makedirs(output_dir, exist_ok=True)
+    fast_path = os.path.join(output_dir, FAST_KERAS_FILENAME)
+    student.save(fast_path)
+    full_parameters = int(teacher.model.count_params())
+    log(f"Fast model: {student.count_params()} parameters, teacher {full_parameters}")
+
+    tflite_path = os.path.join(output_dir, FAST_TFLITE_FILENAME)
+    if backend_name == 'tflite':
+        from src.export import export_tflite
+        export_tflite(fast_path, tflite_path, quantization=TFLITE_QUANTIZATION)
+        teacher_tflite = os.path.join(os.path.dirname(teacher_path), TFLITE_FILENAME)
+        if os.path.exists(teacher_tflite):
+            teacher = create_backend('tflite', teacher_path, teacher_tflite)
+
+    fast_backend = create_backend(backend_name, fast_path, tflite_path)
+    rows = holdout if holdout.any() else np.ones(len(pixels), dtype=bool)
+    fast = forward_batches(fast_backend, pixels[rows])
+    report = cascade_report(
+        full[rows], fast, labels[rows], time_forward(teacher, pixels), time_forward(fast_backend, pixels)
+    )
+    report.update(
+        backend=backend_name,
+        evaluated_on='holdout' if holdout.any() else 'training images',
+        distilled_images=len(pixels),
+        fast_parameters=int(student.count_params()),
+        full_parameters=full_parameters,
+        temperature=temperature,
+        alpha=alpha,
+        created_at=time.time()
+    )
+    with open(os.path.join(output_dir, CASCADE_FILENAME), 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def expected_row(report, margin=CASCADE_MARGIN):
+    rows = report.get('margins', []) if report else []
+    return min(rows, key=lambda row: abs(row['margin'] - margin)) if rows else None
+
+
+def format_report(report):
+    lines = [
+        f"full accuracy {report['full_accuracy']}, fast accuracy {report['fast_accuracy']}, "
+        f"fast agreement {report['fast_agreement']} on {report['images']} {report['evaluated_on']}",
+        f"full {report['full_ms_per_image']}ms/image, fast {report['fast_ms_per_image']}ms/image ({report['backend']})",
+        f"{'margin':>8} {'hit rate':>9} {'agreement':>10} {'accuracy':>9} {'delta':>8} {'cost':>6}"
+    ]
+    for row in report['margins']:
+        lines.append(
+            f"{row['margin']:>8g} {row['hit_rate']:>9.2%} {row['agreement']:>10.2%} "
+            f"{'-' if row['accuracy'] is None else format(row['accuracy'], '.2%'):>9} "
+            f"{'-' if row['accuracy_delta'] is None else format(row['accuracy_delta'], '+.2%'):>8} {row['relative_cost']:>6.2f}"
+        )
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    from src.model import MAPPING_PATH, MODEL_PATH
+    from src.config import TFLITE_MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="distill the fast cascade model from a registered model version")
+    parser.add_argument('--version', help="model version to distill (default: the active one)")
+    parser.add_argument('--data', nargs='+', default=list(DATA_DIRS), help="<class>/<image> folders to distill on")
+    parser.add_argument('--store', help="also distill on a training data store")
+    parser.add_argument('--backend', choices=('keras', 'tflite'), default=INFERENCE_BACKEND)
+    parser.add_argument('--epochs', type=int, default=DISTILL_EPOCHS)
+    parser.add_argument('--temperature', type=float, default=DISTILL_TEMPERATURE)
+    parser.add_argument('--alpha', type=float, default=DISTILL_ALPHA, help="weight of the folder labels against the teacher")
+    parser.add_argument('--max-images', type=int, default=DISTILL_MAX_IMAGES, help="random sample size, 0 uses every image")
+    args = parser.parse_args(argv)
+
+    registry = ModelRegistry(MODEL_REGISTRY_DIR, MODEL_REGISTRY_KEEP)
+    version = args.version or registry.bootstrap(MODEL_PATH, TFLITE_MODEL_PATH, MAPPING_PATH)
+    if version not in registry.versions():
+        print(f"model version not found: {version}")
+        return 1
+    mapping_path = registry.path(version, MAPPING_FILENAME)
+    report = distill(
+        registry.path(version, KERAS_FILENAME), mapping_path if os.path.exists(mapping_path) else MAPPING_PATH,
+        registry.path(version, ''), args.data, args.store, args.backend, args.epochs, args.temperature, args.alpha,
+        args.max_images
+    )
+    print(format_report(report))
+    registry.touch()
+    print(f"fast model written to {registry.path(version, FAST_KERAS_FILENAME)}; serving workers reload it when CASCADE_MARGIN > 0")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
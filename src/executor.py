@@ -0,0 +1,106 @@
+import asyncio
+import contextvars
+from collections import deque
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after=1):
+        super().__init__("server overloaded, retry later")
+        self.retry_after = retry_after
+
+
+def _init_process_worker():
+    import src.prediction  # noqa: F401
+    from src.model import model_instance
+    model_instance.ensure_loaded()
+
+
+class InferenceExecutor:
+    def __init__(self, kind="thread", workers=None, max_queue=64, retry_after=1):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"unknown executor kind: {kind}")
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.capacity = self.workers + self.max_queue
+        self.in_flight = 0
+        self.rejected = 0
+        self.pool = None
+        self._waiters = deque()
+
+    def start(self):
+        if self.pool is not None:
+            return
+        if self.kind == "process":
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process_worker
+            )
+        else:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def check_capacity(self):
+        if self.in_flight >= self.capacity:
+            self.rejected += 1
+            raise Overloaded(self.retry_after)
+
+    @contextmanager
+    def admit(self):
+        self.check_capacity()
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._wake_next()
+
+    def _wake_next(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def wait_for_capacity(self):
+        while self.in_flight >= self.capacity:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_next()
+                raise
+
+    async def run(self, fn, *args):
+        if self.pool is None:
+            raise RuntimeError("executor not started")
+        loop = asyncio.get_running_loop()
+        if self.kind == "thread":
+            return await loop.run_in_executor(self.pool, contextvars.copy_context().run, fn, *args)
+        return await loop.run_in_executor(self.pool, fn, *args)
+
+    async def run_admitted(self, fn, *args):
+        await self.wait_for_capacity()
+        with self.admit():
+            return await self.run(fn, *args)
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected
+        }
@@ -0,0 +1,134 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from src.preprocessing import preprocess_image
+
+QUANTIZATION_MODES = ('none', 'float16', 'int8')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+REPRESENTATIVE_DIRS = ('data/real_training_data', 'data/demo_training_data', 'data/complete_training_data')
+
+
+def list_images(root, limit=None):
+    paths = []
+    for dirpath, _, filenames in sorted(os.walk(root)):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(dirpath, filename))
+                if limit and len(paths) >= limit:
+                    return paths
+    return paths
+
+
+def representative_dataset(data_dirs=REPRESENTATIVE_DIRS, limit=200):
+    paths = []
+    for data_dir in data_dirs:
+        if os.path.isdir(data_dir):
+            paths.extend(list_images(data_dir, limit - len(paths)))
+        if len(paths) >= limit:
+            break
+    if not paths:
+        raise FileNotFoundError(f"no representative images found in {list(data_dirs)}")
+
+    def generator():
+        for path in paths:
+            yield [preprocess_image(path).astype(np.float32)]
+
+    return generator
+
+
+def convert(converter, quantization, data_dirs=REPRESENTATIVE_DIRS):
+    import tensorflow as tf
+
+    if quantization == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(data_dirs)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    return converter.convert()
+
+
+def export_tflite(keras_model_path, output_path, quantization='none', data_dirs=REPRESENTATIVE_DIRS):
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"unknown quantization: {quantization}")
+
+    import tensorflow as tf
+    from src.backends import embedding_model, load_keras_model
+
+    model = embedding_model(load_keras_model(keras_model_path))
+
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        model.export(saved_model_dir)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        flatbuffer = convert(converter, quantization, data_dirs)
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(flatbuffer)
+    os.replace(tmp_path, output_path)
+    print(f"exported {keras_model_path} to {output_path} ({quantization}, {len(flatbuffer) / 1024:.1f} KiB)")
+    return output_path
+
+
+def verify_backend(keras_model_path, tflite_model_path, test_dir='data/test', images=None):
+    from src.backends import KerasBackend, TFLiteBackend
+
+    if images is None:
+        paths = list_images(test_dir)
+        if not paths:
+            raise FileNotFoundError(f"no test images found in {test_dir}")
+        images = np.concatenate([preprocess_image(path) for path in paths]).astype(np.float32)
+
+    reference = KerasBackend(keras_model_path)
+    candidate = TFLiteBackend(tflite_model_path)
+
+    started = time.perf_counter()
+    expected = reference.forward(images)
+    keras_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    actual = np.concatenate([candidate.forward(images[i:i + 1]) for i in range(len(images))])
+    tflite_ms = (time.perf_counter() - started) * 1000
+
+    agreement = float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1)))
+    return {
+        'images': len(images),
+        'top1_agreement': round(agreement, 4),
+        'max_abs_diff': round(float(np.max(np.abs(expected - actual))), 6),
+        'keras_ms': round(keras_ms, 2),
+        'tflite_ms': round(tflite_ms, 2)
+    }
+
+
+def main(argv=None):
+    from src.config import TFLITE_MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="export models/model_rgb.h5 to tflite")
+    parser.add_argument('--model', default='models/model_rgb.h5')
+    parser.add_argument('--output', default=TFLITE_MODEL_PATH)
+    parser.add_argument('--quantize', choices=QUANTIZATION_MODES, default='none')
+    parser.add_argument('--verify', action='store_true', help="compare against keras on data/test")
+    parser.add_argument('--test-dir', default='data/test')
+    parser.add_argument('--min-agreement', type=float, default=0.95)
+    args = parser.parse_args(argv)
+
+    export_tflite(args.model, args.output, quantization=args.quantize)
+
+    if args.verify:
+        report = verify_backend(args.model, args.output, args.test_dir)
+        print(report)
+        if report['top1_agreement'] < args.min_agreement:
+            print(f"top-1 agreement {report['top1_agreement']} below {args.min_agreement}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from src.data_pipeline import VALIDATION_SPLIT, build_store_data, split_store
+from src.datastore import TrainingStore
+from src.preprocessing import SCALE
+
+HEAD_LAYERS = ('Dense', 'Dropout', 'Activation')
+EMBEDDING_BATCH_SIZE = 256
+EARLY_STOPPING_SAMPLES = 2000
+KEEP_EMBEDDING_CACHES = 2
+
+
+def split_backbone(model):
+    from tensorflow import keras
+
+    layers = model.layers
+    split = len(layers)
+    while split > 0 and type(layers[split - 1]).__name__ in HEAD_LAYERS:
+        split -= 1
+    if split in (0, len(layers)):
+        raise ValueError(f"model has no frozen backbone / dense head split: {[type(layer).__name__ for layer in layers]}")
+
+    backbone = keras.Model(model.inputs[0], layers[split - 1].output, name='backbone')
+    head = keras.Sequential([keras.Input(shape=backbone.output_shape[1:]), *layers[split:]])
+    return backbone, head
+
+
+def backbone_key(backbone):
+    configs = [
+        {'class': type(layer).__name__, **{key: value for key, value in layer.get_config().items() if key != 'name'}}
+        for layer in backbone.layers
+    ]
+    digest = hashlib.sha1(json.dumps(configs, sort_keys=True, default=str).encode())
+    for weight in backbone.get_weights():
+        digest.update(np.ascontiguousarray(weight))
+    return digest.hexdigest()[:16]
+
+
+class EmbeddingCache:
+    def __init__(self, directory, key, shape):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{key}.bin")
+        self.shape = tuple(shape)
+        self.row_bytes = 4 * int(np.prod(self.shape))
+
+    def cached_rows(self):
+        try:
+            return os.path.getsize(self.path) // self.row_bytes
+        except FileNotFoundError:
+            return 0
+
+    def ensure(self, backbone, images, count, batch_size=EMBEDDING_BATCH_SIZE):
+        cached = self.cached_rows()
+        if cached < count:
+            with open(self.path, 'ab') as f:
+                f.truncate(cached * self.row_bytes)
+                for start in range(cached, count, batch_size):
+                    batch = np.multiply(images[start:min(start + batch_size, count)], SCALE, dtype=np.float32)
+                    f.write(np.asarray(backbone(batch, training=False), dtype=np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        embeddings = np.memmap(self.path, np.float32, 'r', shape=(count, *self.shape)) if count else None
+        return embeddings, max(0, count - cached)
+
+    def prune(self, keep=KEEP_EMBEDDING_CACHES):
+        caches = sorted(glob.glob(os.path.join(os.path.dirname(self.path), '*.bin')), key=os.path.getmtime)
+        for path in caches[:-keep]:
+            if path != self.path:
+                os.remove(path)
+
+
+def select_rows(train_rows, trained_rows, replay_ratio, rng):
+    new = train_rows[train_rows >= trained_rows]
+    old = train_rows[train_rows < trained_rows]
+    replay_size = min(len(old), int(round(len(new) * replay_ratio)))
+    replay = rng.choice(old, replay_size, replace=False) if replay_size else old[:0]
+    return new, np.sort(replay)
+
+
+def previous_store_rows(info_path, store_path):
+    try:
+        with open(info_path) as f:
+            info = json.load(f)
+    except FileNotFoundError:
+        return 0
+    if os.path.abspath(info.get('store', '')) != os.path.abspath(store_path):
+        return 0
+    return int(info.get('store_rows', 0))
+
+
+def fit_incremental(model, store_path, trained_rows, epochs, batch_size, learning_rate, replay_ratio, patience,
+                    cache_dir, callbacks=(), log=print, seed=None, class_indices=None):
+    import tensorflow as tf
+
+    store = TrainingStore(store_path)
+    count = len(store)
+    train, validation, labels, _ = split_store(store, VALIDATION_SPLIT, class_indices=class_indices)
+    rng = np.random.default_rng(seed)
+    new, replay = select_rows(train, min(trained_rows, count), replay_ratio, rng)
+    log(f"Incremental fine-tuning: {len(new)} new samples, {len(replay)} replayed from {len(train) - len(new)} earlier samples")
+    if not len(new):
+        raise ValueError(f"no new samples in {store_path} since the base version was trained on {trained_rows} rows")
+
+    backbone, head = split_backbone(model)
+    for layer in backbone.layers:
+        layer.trainable = False
+    key = backbone_key(backbone)
+    cache = EmbeddingCache(os.path.join(cache_dir, 'embeddings'), key, backbone.output_shape[1:])
+    embeddings, computed = cache.ensure(backbone, store.column('images'), count)
+    cache.prune()
+    log(f"Backbone embeddings {key}: {count - computed} cached, {computed} computed")
+
+    rows = np.concatenate([new, replay])
+    stop_rows = validation
+    if len(stop_rows) > EARLY_STOPPING_SAMPLES:
+        stop_rows = np.sort(rng.choice(stop_rows, EARLY_STOPPING_SAMPLES, replace=False))
+    validation_data = (np.asarray(embeddings[stop_rows]), labels[stop_rows]) if len(stop_rows) else None
+
+    head.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+        loss='sparse_categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    monitor = 'val_loss' if validation_data else 'loss'
+    early_stopping = tf.keras.callbacks.EarlyStopping(monitor=monitor, patience=patience, restore_best_weights=True)
+    history = head.fit(
+        np.asarray(embeddings[rows]), labels[rows],
+        batch_size=min(batch_size, len(rows)),
+        epochs=epochs,
+        validation_data=validation_data,
+        shuffle=True,
+        verbose=0,
+        callbacks=[*callbacks, early_stopping]
+    )
+    for layer in backbone.layers:
+        layer.trainable = True
+
+    epochs_run = len(history.history['loss'])
+    log(f"Stopped after {epochs_run} epochs (best {monitor} at epoch {early_stopping.best_epoch + 1})")
+    data = build_store_data(store_path, batch_size, class_indices=class_indices)
+    info = {
+        'new_samples': len(new),
+        'replay_samples': len(replay),
+        'epochs_run': epochs_run,
+        'best_epoch': early_stopping.best_epoch + 1,
+        'embeddings_computed': computed,
+        'store_rows': count
+    }
+    return history, data, info
@@ -0,0 +1,204 @@
+import asyncio
+import os
+import shutil
+
+import numpy as np
+
+from src.config import SCREEN_ENABLED
+from src.model import CODE_TO_NAME, model_instance
+from src.preprocessing import SCALE, TARGET_SIZE, allocate_batch, decode_into
+
+VALID_CLASSES = list(CODE_TO_NAME.values())
+BARE_SPARSE_SIMILAR_CLASSES = ['shrubland', 'cropland', 'grassland', 'built-up']
+BARE_SPARSE_CONFIDENCE_THRESHOLD = 0.85
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def error_record(filename, claimed_class, error):
+    return {
+        'filename': filename,
+        'claimed_class': claimed_class,
+        'predicted_class': 'n/a',
+        'confidence': 0,
+        'valid': False,
+        'error': error
+    }
+
+
+def validate_prediction(filename, claimed_class, prediction):
+    predicted_class = prediction['predicted_class_name'].lower()
+    validation_note = None
+
+    if claimed_class == 'bare_sparse':
+        if predicted_class == claimed_class:
+            is_valid = True
+        elif predicted_class in BARE_SPARSE_SIMILAR_CLASSES and prediction['confidence'] >= BARE_SPARSE_CONFIDENCE_THRESHOLD:
+            is_valid = True
+            validation_note = f"Accepted: {predicted_class} is similar to bare_sparse"
+        else:
+            is_valid = False
+    else:
+        is_valid = predicted_class == claimed_class
+
+    result = {
+        'filename': filename,
+        'claimed_class': claimed_class,
+        'predicted_class': predicted_class,
+        'confidence': prediction['confidence'],
+        'valid': is_valid
+    }
+    if validation_note:
+        result['note'] = validation_note
+    return result
+
+
+def validate_files(items):
+    pixels = np.empty((len(items), TARGET_SIZE[1], TARGET_SIZE[0], 3), dtype=np.uint8)
+    records = [None] * len(items)
+    decoded = []
+
+    for i, (filename, path, claimed_class) in enumerate(items):
+        try:
+            decode_into(path, pixels[len(decoded)])
+            decoded.append(i)
+        except Exception as e:
+            records[i] = error_record(filename, 'error', str(e))
+
+    pixels = pixels[:len(decoded)]
+    version = embeddings = None
+    if decoded:
+        buffer = np.multiply(pixels, SCALE, out=allocate_batch(len(decoded)), casting='unsafe')
+        model_instance.refresh()
+        active = model_instance.serving()
+        if SCREEN_ENABLED and active.backend.embedding_dim:
+            predictions, embeddings = active.predict_embed(buffer)
+            version = active.version
+        else:
+            predictions = active.predict_batch(buffer)
+        for i, prediction in zip(decoded, predictions):
+            filename, _, claimed_class = items[i]
+            records[i] = validate_prediction(filename, claimed_class, prediction)
+
+    return records, pixels, decoded, version, embeddings
+
+
+def store_samples(store, items, records, pixels, decoded, batch_id):
+    if not decoded:
+        return []
+    rows = store.append(
+        pixels,
+        [items[i][2] for i in decoded],
+        batch_id,
+        valid=[records[i]['valid'] for i in decoded],
+        confidence=[records[i]['confidence'] for i in decoded]
+    )
+    for i, (row, duplicate) in zip(decoded, rows):
+        records[i]['sample_id'] = row
+        records[i]['duplicate'] = duplicate
+    return rows
+
+
+def upload_destination(filename, batch_dir):
+    path_parts = filename.replace('\\', '/').split('/')
+    if len(path_parts) < 2:
+        return None, None
+
+    class_folder = path_parts[-2].lower()
+    name = path_parts[-1]
+    if class_folder in ('', '.', '..') or name in ('', '.', '..'):
+        return None, None
+    return class_folder, os.path.join(batch_dir, class_folder, name)
+
+
+def copy_upload(source, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    source.seek(0)
+    with open(path, 'wb') as buffer:
+        shutil.copyfileobj(source, buffer, COPY_BUFFER_SIZE)
+
+
+async def persist_uploads(files, batch_dir, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def persist(file):
+        if not (file.content_type or '').startswith('image/'):
+            return None
+        class_folder, path = upload_destination(file.filename, batch_dir)
+        if path is None:
+            return error_record(file.filename, 'unknown', 'file must be in class folder (e.g., trees/image1.png)')
+        try:
+            async with semaphore:
+                await asyncio.to_thread(copy_upload, file.file, path)
+        except Exception as e:
+            return error_record(file.filename, 'error', str(e))
+        return (file.filename, path, class_folder)
+
+    saved = []
+    errors = []
+    for outcome in await asyncio.gather(*[persist(file) for file in files]):
+        if isinstance(outcome, tuple):
+            saved.append(outcome)
+        elif outcome is not None:
+            errors.append(outcome)
+    return saved, errors
+
+
+async def screen_samples(screener, chunk, records, decoded, version, embeddings):
+    if screener is None or embeddings is None:
+        return
+    flags = await screener.screen(embeddings, [chunk[i][2] for i in decoded], version)
+    for i, screening in zip(decoded, flags):
+        if screening is not None:
+            records[i]['screening'] = screening
+
+
+async def run_ingest_job(job, saved, errors, executor, chunk_size, store, keep_uploads=False, screener=None):
+    job.start()
+    try:
+        chunks = [saved[i:i + chunk_size] for i in range(0, len(saved), chunk_size)]
+        records = [None] * len(saved)
+        job.advance(len(errors))
+        if screener is not None:
+            await screener.sync(executor)
+
+        parallelism = asyncio.Semaphore(executor.workers)
+
+        async def validate(offset, chunk):
+            async with parallelism:
+                chunk_records, pixels, decoded, version, embeddings = await executor.run_admitted(validate_files, chunk)
+            await screen_samples(screener, chunk, chunk_records, decoded, version, embeddings)
+            rows = await asyncio.to_thread(store_samples, store, chunk, chunk_records, pixels, decoded, job.meta["batch_id"])
+            if screener is not None and embeddings is not None:
+                known = {row: embedding for (row, duplicate), embedding in zip(rows, embeddings) if not duplicate}
+                await screener.sync(executor, version, known)
+            return offset, chunk_records
+
+        tasks = [validate(i * chunk_size, chunk) for i, chunk in enumerate(chunks)]
+        for finished in asyncio.as_completed(tasks):
+            offset, chunk_records = await finished
+            records[offset:offset + len(chunk_records)] = chunk_records
+            job.advance(len(chunk_records))
+
+        validation_results = records + errors
+        valid_count = sum(1 for r in validation_results if r['valid'])
+        result = {
+            "status": "success",
+            "files_uploaded": len(saved),
+            "valid_files": valid_count,
+            "invalid_files": len(saved) - valid_count,
+            "duplicate_files": sum(1 for r in records if r.get('duplicate')),
+            "near_duplicate_files": sum(1 for r in records if r.get('screening', {}).get('near_duplicate')),
+            "outlier_files": sum(1 for r in records if r.get('screening', {}).get('outlier')),
+            "validation_results": validation_results,
+            "batch_id": job.meta["batch_id"],
+            "train_data_path": store.directory
+        }
+        if keep_uploads:
+            result["batch_path"] = job.meta["batch_path"]
+        job.complete(result)
+    except Exception as e:
+        print(f"Error in bulk ingest job {job.id}: {str(e)}")
+        job.fail(e)
+    finally:
+        if not keep_uploads:
+            await asyncio.to_thread(shutil.rmtree, job.meta["batch_path"], True)
@@ -0,0 +1,192 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+FINISHED_STATUSES = ("completed", "failed")
+PROGRESS_SAVE_INTERVAL = 0.25
+COLUMNS = (
+    "id", "kind", "status", "total", "done", "meta", "result", "error", "owner",
+    "created_at", "started_at", "finished_at"
+)
+
+
+def owner_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def owner_alive(owner):
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Job:
+    def __init__(self, kind, total=0, meta=None, registry=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.status = "queued"
+        self.total = total
+        self.done = 0
+        self.meta = dict(meta or {})
+        self.result = None
+        self.error = None
+        self.owner = owner_id()
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+        self.registry = registry
+        self._saved_at = 0.0
+
+    def save(self, force=True):
+        if self.registry is None:
+            return
+        now = time.monotonic()
+        if force or now - self._saved_at >= PROGRESS_SAVE_INTERVAL:
+            self._saved_at = now
+            self.registry.save(self)
+
+    def start(self):
+        self.status = "running"
+        self.started_at = time.time()
+        self.save()
+
+    def set_total(self, total):
+        self.total = total
+        self.save()
+
+    def advance(self, count=1):
+        self.done += count
+        self.save(force=False)
+
+    def complete(self, result):
+        self.result = result
+        self.status = "completed"
+        self.finished_at = time.time()
+        self.save()
+
+    def fail(self, error):
+        self.error = str(error)
+        self.status = "failed"
+        self.finished_at = time.time()
+        self.save()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self, include_result=True):
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = round((self.finished_at or time.time()) - self.started_at, 3)
+
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "progress": int(self.done * 100 / self.total) if self.total else (100 if self.finished else 0),
+            "elapsed_seconds": elapsed,
+            **self.meta
+        }
+        if self.error is not None:
+            data["error"] = self.error
+        if include_result and self.result is not None:
+            data["result"] = self.result
+        return data
+
+    def to_row(self):
+        return (
+            self.id, self.kind, self.status, self.total, self.done, json.dumps(self.meta),
+            json.dumps(self.result) if self.result is not None else None, self.error, self.owner,
+            self.created_at, self.started_at, self.finished_at
+        )
+
+    @classmethod
+    def from_row(cls, row):
+        values = dict(zip(COLUMNS, row))
+        job = cls(values["kind"], values["total"], json.loads(values["meta"]))
+        job.id = values["id"]
+        job.status = values["status"]
+        job.done = values["done"]
+        job.result = json.loads(values["result"]) if values["result"] is not None else None
+        job.error = values["error"]
+        job.owner = values["owner"]
+        job.created_at = values["created_at"]
+        job.started_at = values["started_at"]
+        job.finished_at = values["finished_at"]
+        if not job.finished and not owner_alive(job.owner):
+            job.status = "failed"
+            job.error = f"worker {job.owner} exited before the job finished"
+        return job
+
+
+class JobRegistry:
+    def __init__(self, path=None, max_finished=100):
+        self.path = path
+        self.max_finished = max_finished
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, status TEXT, total INTEGER, done INTEGER, meta TEXT, result TEXT, "
+                "error TEXT, owner TEXT, created_at REAL, started_at REAL, finished_at REAL)"
+            )
+
+    def create(self, kind, total=0, meta=None):
+        job = Job(kind, total, meta, self)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._prune()
+        job.save()
+        return job
+
+    def save(self, job):
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                job.to_row()
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is not None or self._conn is None:
+                return job
+            row = self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row else None
+
+    def list(self, kind=None):
+        with self._lock:
+            return [job for job in self.jobs.values() if kind is None or job.kind == kind]
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+        if self._conn is not None:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE finished_at IS NOT NULL "
+                "ORDER BY finished_at DESC LIMIT -1 OFFSET ?)", (self.max_finished,)
+            )
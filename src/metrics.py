@@ -0,0 +1,212 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from src.config import METRICS_WINDOW_SECONDS, METRICS_WINDOW_SLOTS
+
+QUANTILES = (0.5, 0.9, 0.99)
+PREFIX = 'landcover_'
+
+
+class LogHistogram:
+    def __init__(self, min_value=1e-6, max_value=1e4, precision=0.01):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.growth = 1 + 2 * precision
+        self._inv_log_growth = 1 / math.log(self.growth)
+        self.num_buckets = int(math.ceil(math.log(max_value / min_value) * self._inv_log_growth)) + 2
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * self.num_buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def bucket(self, value):
+        if value < self.min_value:
+            return 0
+        if value >= self.max_value:
+            return self.num_buckets - 1
+        return 1 + int(math.log(value / self.min_value) * self._inv_log_growth)
+
+    def observe(self, value):
+        self.counts[self.bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        self.counts = np.add(self.counts, other.counts)
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = max(1, int(math.ceil(q * self.count)))
+        idx = int(np.searchsorted(np.cumsum(self.counts), rank))
+        if idx == 0:
+            value = self.min
+        elif idx == self.num_buckets - 1:
+            value = self.max
+        else:
+            value = self.min_value * self.growth ** (idx - 0.5)
+        return min(max(value, self.min), self.max)
+
+
+class WindowedHistogram:
+    def __init__(self, window_seconds=METRICS_WINDOW_SECONDS, slots=METRICS_WINDOW_SLOTS, **bucket_args):
+        self.window_seconds = window_seconds
+        self.slot_seconds = window_seconds / slots
+        self.bucket_args = bucket_args
+        self.slots = [LogHistogram(**bucket_args) for _ in range(slots)]
+        self.epochs = [-1] * slots
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value, now=None):
+        epoch = int((now if now is not None else time.monotonic()) / self.slot_seconds)
+        pos = epoch % len(self.slots)
+        with self._lock:
+            if self.epochs[pos] != epoch:
+                self.slots[pos].reset()
+                self.epochs[pos] = epoch
+            self.slots[pos].observe(value)
+            self.count += 1
+            self.total += value
+
+    @contextmanager
+    def timer(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def window(self, now=None):
+        epoch = int((now if now is not None else time.monotonic()) / self.slot_seconds)
+        merged = LogHistogram(**self.bucket_args)
+        with self._lock:
+            for slot, slot_epoch in zip(self.slots, self.epochs):
+                if 0 <= epoch - slot_epoch < len(self.slots):
+                    merged.merge(slot)
+        return merged
+
+    def snapshot(self, scale=1.0, quantiles=QUANTILES, digits=3):
+        window = self.window()
+        data = {
+            "count": window.count,
+            "mean": round(window.total / window.count * scale, digits) if window.count else 0,
+            "min": round(window.min * scale, digits) if window.count else 0,
+            "max": round(window.max * scale, digits) if window.count else 0
+        }
+        for q in quantiles:
+            data[f"p{q * 100:g}"] = round(window.quantile(q) * scale, digits)
+        data["total_count"] = self.count
+        return data
+
+
+def format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + '}'
+
+
+class MetricsRegistry:
+    def __init__(self, window_seconds=METRICS_WINDOW_SECONDS, slots=METRICS_WINDOW_SLOTS):
+        self.window_seconds = window_seconds
+        self.slots = slots
+        self.definitions = {}
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def define(self, name, help_text, kind='summary', **bucket_args):
+        self.definitions[name] = (kind, help_text, bucket_args)
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        series = self.histograms.get(key)
+        if series is None:
+            _, _, bucket_args = self.definitions.get(name, ('summary', '', {}))
+            with self._lock:
+                series = self.histograms.setdefault(
+                    key, WindowedHistogram(self.window_seconds, self.slots, **bucket_args)
+                )
+        return series
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self, scale=1000.0):
+        data = {}
+        for (name, labels), series in list(self.histograms.items()):
+            label = ','.join(f"{key}={value}" for key, value in labels) or 'all'
+            data.setdefault(name, {})[label] = series.snapshot(scale if name.endswith('_seconds') else 1.0)
+        return data
+
+    def prometheus(self, gauges=None):
+        lines = []
+        by_name = {}
+        for (name, labels), series in list(self.histograms.items()):
+            by_name.setdefault(name, []).append((labels, series))
+
+        for name in sorted(by_name):
+            _, help_text, _ = self.definitions.get(name, ('summary', '', {}))
+            metric = PREFIX + name
+            lines.append(f"# HELP {metric} {help_text or name} (quantiles over the last {self.window_seconds:g}s)")
+            lines.append(f"# TYPE {metric} summary")
+            for labels, series in sorted(by_name[name], key=lambda item: item[0]):
+                window = series.window()
+                for q in QUANTILES:
+                    lines.append(f"{metric}{format_labels(labels, quantile=f'{q:g}')} {window.quantile(q):.9g}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {series.total:.9g}")
+                lines.append(f"{metric}_count{format_labels(labels)} {series.count}")
+
+        counters = {}
+        with self._lock:
+            for (name, labels), value in self.counters.items():
+                counters.setdefault(name, []).append((labels, value))
+        for name in sorted(counters):
+            _, help_text, _ = self.definitions.get(name, ('counter', '', {}))
+            metric = PREFIX + name
+            lines.append(f"# HELP {metric} {help_text or name}")
+            lines.append(f"# TYPE {metric} counter")
+            for labels, value in sorted(counters[name]):
+                lines.append(f"{metric}{format_labels(labels)} {value}")
+
+        for name, (help_text, value) in sorted((gauges or {}).items()):
+            metric = PREFIX + name
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.append(f"{metric} {value:.9g}")
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+metrics.define('request_seconds', 'http request latency by endpoint')
+metrics.define('prediction_seconds', '/predict handler latency')
+metrics.define('stage_seconds', 'per-image or per-batch time spent in each pipeline stage')
+metrics.define('batch_size', 'images per micro-batch forward pass', min_value=1, max_value=4096)
+metrics.define('batch_queue_wait_seconds', 'time a request waits in the micro-batch queue')
+metrics.define('event_loop_lag_seconds', 'how late the event loop wakes up a sleeping task')
+metrics.define('requests_total', 'http requests by endpoint and status', kind='counter')
@@ -1,89 +1,390 @@
+import json
 import os
+import threading
+import time
 import numpy as np
-import tensorflow as tf
-from tensorflow import keras
-from datetime import datetime
 
-tf.config.run_functions_eagerly(True)
+from src.backends import create_backend, warm_up
+from src.config import (
+    INFERENCE_BACKEND, TFLITE_MODEL_PATH, RETRAIN_BATCH_SIZE,
+    MODEL_REGISTRY_DIR, MODEL_REGISTRY_KEEP, MODEL_REFRESH_INTERVAL, CASCADE_MARGIN, CASCADE_SHADOW_RATE
+)
+from src.metrics import metrics
+from src.distill import expected_row
+from src.tracing import span
+from src.registry import (
+    CASCADE_FILENAME, FAST_KERAS_FILENAME, FAST_TFLITE_FILENAME, KERAS_FILENAME, MAPPING_FILENAME, TFLITE_FILENAME,
+    ModelRegistry
+)
+from src.training import fine_tune
 
 MODEL_PATH = 'models/model_rgb.h5'
 MAPPING_PATH = 'models/reverse_mapping_rgb.npy'
+INFERENCE_SECONDS = metrics.histogram('stage_seconds', stage='inference')
+POSTPROCESS_SECONDS = metrics.histogram('stage_seconds', stage='postprocess')
+FAST_SECONDS = metrics.histogram('stage_seconds', stage='fast_inference')
 
-class LandCoverModel:
-    def __init__(self):
-        self.model = None
-        self.reverse_mapping = None
-        self.code_to_name = {
-            10: 'trees',
-            20: 'shrubland',
-            30: 'grassland',
-            40: 'cropland',
-            50: 'built-up',
-            60: 'bare_sparse',
-            80: 'water',
-            90: 'wetland',
-            95: 'mangroves'
+CODE_TO_NAME = {
+    10: 'trees',
+    20: 'shrubland',
+    30: 'grassland',
+    40: 'cropland',
+    50: 'built-up',
+    60: 'bare_sparse',
+    80: 'water',
+    90: 'wetland',
+    95: 'mangroves'
+}
+
+def build_label_lookup(reverse_mapping, code_to_name, num_classes):
+    codes = []
+    names = []
+    for idx in range(num_classes):
+        code = reverse_mapping.get(idx, f"unknown_{idx}")
+        if isinstance(code, (np.generic, int)):
+            code = int(code)
+        codes.append(code)
+        names.append(code_to_name.get(code, f"unknown_{code}"))
+    return np.array(codes, dtype=object), np.array(names, dtype=object)
+
+def top_k(predictions, k=3):
+    predictions = np.asarray(predictions)
+    k = min(k, predictions.shape[1])
+    indices = np.argpartition(predictions, -k, axis=1)[:, -k:]
+    confidences = np.take_along_axis(predictions, indices, axis=1)
+    order = np.argsort(-confidences, axis=1)
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(confidences, order, axis=1)
+
+def decode_predictions(predictions, index_codes, index_names, k=3):
+    indices, confidences = top_k(predictions, k)
+    codes = index_codes[indices[:, 0]].tolist()
+    names = index_names[indices].tolist()
+    confidences = confidences.tolist()
+    key = f"top_{indices.shape[1]}"
+
+    return [
+        {
+            'predicted_class': code,
+            'predicted_class_name': row_names[0],
+            'confidence': row_confidences[0],
+            key: [{'class': name, 'confidence': confidence} for name, confidence in zip(row_names, row_confidences)]
         }
-        self.load_model()
+        for code, row_names, row_confidences in zip(codes, names, confidences)
+    ]
 
-    def load_model(self):
-        if os.path.exists(MODEL_PATH):
-            self.model = keras.models.load_model(MODEL_PATH)
-            print(f"model loaded from {MODEL_PATH}")
-        else:
+class Cascade:
+    def __init__(self, backend, margin=CASCADE_MARGIN, shadow_rate=CASCADE_SHADOW_RATE, path=None, report=None):
+        self.backend = backend
+        self.margin = margin
+        self.shadow_rate = shadow_rate
+        self.path = path
+        self.signature = file_signature(path)
+        self.report = report
+        self.images = 0
+        self.escalated = 0
+        self.shadowed = 0
+        self.shadow_agreed = 0
+        self._rng = np.random.default_rng()
+        self._lock = threading.Lock()
+
+    def forward(self, full_backend, image_array):
+        started = time.perf_counter()
+        with span('fast_inference'):
+            probabilities = self.backend.forward(image_array)
+        FAST_SECONDS.observe(time.perf_counter() - started)
+        top = np.partition(probabilities, -2, axis=1)[:, -2:]
+        escalate = top[:, 1] - top[:, 0] < self.margin
+        shadow = ~escalate & (self._rng.random(len(probabilities)) < self.shadow_rate)
+        rows = escalate | shadow
+        agreed = 0
+        if rows.any():
+            full = full_backend.forward(image_array[rows])
+            shadow_rows = shadow[rows]
+            agreed = int(np.count_nonzero(full[shadow_rows].argmax(axis=1) == probabilities[shadow].argmax(axis=1)))
+            probabilities[escalate] = full[~shadow_rows]
+        with self._lock:
+            self.images += len(probabilities)
+            self.escalated += int(np.count_nonzero(escalate))
+            self.shadowed += int(np.count_nonzero(shadow))
+            self.shadow_agreed += agreed
+        return probabilities
+
+    def stats(self):
+        with self._lock:
+            return {
+                'margin': self.margin,
+                'fast_model': self.path,
+                'images': self.images,
+                'fast_hits': self.images - self.escalated,
+                'escalated': self.escalated,
+                'hit_rate': round(1 - self.escalated / self.images, 4) if self.images else None,
+                'shadow_images': self.shadowed,
+                'shadow_agreement': round(self.shadow_agreed / self.shadowed, 4) if self.shadowed else None,
+                'expected': expected_row(self.report, self.margin)
+            }
+
+
+def file_signature(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except (FileNotFoundError, TypeError):
+        return None
+
+
+class ServingModel:
+    def __init__(self, version, backend, reverse_mapping, code_to_name, cascade=None):
+        self.version = version
+        self.backend = backend
+        self.cascade = cascade
+        self.model = getattr(backend, 'model', None)
+        self.reverse_mapping = reverse_mapping
+        self.index_codes, self.index_names = build_label_lookup(reverse_mapping, code_to_name, backend.num_classes)
+
+    def forward(self, image_array):
+        if self.cascade is None:
+            return self.backend.forward(image_array)
+        return self.cascade.forward(self.backend, image_array)
+
+    def predict_batch(self, image_array, k=3):
+        started = time.perf_counter()
+        with span('inference'):
+            predictions = self.forward(image_array)
+        inferred = time.perf_counter()
+        with span('postprocess'):
+            results = decode_predictions(predictions, self.index_codes, self.index_names, k)
+        INFERENCE_SECONDS.observe(inferred - started)
+        POSTPROCESS_SECONDS.observe(time.perf_counter() - inferred)
+        return results
+
+    def predict_embed(self, image_array, k=3):
+        started = time.perf_counter()
+        with span('inference'):
+            predictions, embeddings = self.backend.forward_embed(image_array)
+        inferred = time.perf_counter()
+        with span('postprocess'):
+            results = decode_predictions(predictions, self.index_codes, self.index_names, k)
+        INFERENCE_SECONDS.observe(inferred - started)
+        POSTPROCESS_SECONDS.observe(time.perf_counter() - inferred)
+        return results, embeddings
+
+class LandCoverModel:
+    def __init__(self, backend_name=INFERENCE_BACKEND, registry=None):
+        self.backend_name = backend_name
+        self.registry = registry or ModelRegistry(MODEL_REGISTRY_DIR, MODEL_REGISTRY_KEEP)
+        self.active = None
+        self.last_swap = {}
+        self.reload_listeners = []
+        self.code_to_name = dict(CODE_TO_NAME)
+        self._swap_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refresh_checked_at = 0.0
+        self._refresh_mtime = None
+
+    @property
+    def backend(self):
+        return self.serving().backend
+
+    @property
+    def model(self):
+        return self.serving().model
+
+    @property
+    def version(self):
+        return self.serving().version
+
+    @property
+    def reverse_mapping(self):
+        return self.serving().reverse_mapping
+
+    @property
+    def index_codes(self):
+        return self.serving().index_codes
+
+    @property
+    def index_names(self):
+        return self.serving().index_names
+
+    def serving(self):
+        active = self.active
+        if active is None:
+            active = self.ensure_loaded().active
+        return active
+
+    def ensure_loaded(self):
+        if self.active is None:
+            with self._load_lock:
+                if self.active is None:
+                    self.load_model()
+        return self
+
+    def bootstrap(self):
+        version = self.registry.bootstrap(MODEL_PATH, TFLITE_MODEL_PATH, MAPPING_PATH)
+        if version is None:
             print(f"model not found at {MODEL_PATH}")
             raise FileNotFoundError(f"model file missing: {MODEL_PATH}")
+        return version
+
+    def active_model_path(self):
+        filename = TFLITE_FILENAME if self.backend_name == 'tflite' else KERAS_FILENAME
+        return self.registry.path(self.bootstrap(), filename)
+
+    def load_model(self):
+        return self.activate(self.bootstrap())
+
+    def load_version(self, version):
+        filename = TFLITE_FILENAME if self.backend_name == 'tflite' else KERAS_FILENAME
+        model_path = self.registry.path(version, filename)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"model file missing: {model_path}")
 
-        if os.path.exists(MAPPING_PATH):
-            self.reverse_mapping = np.load(MAPPING_PATH, allow_pickle=True).item()
-            print(f"mapping loaded from {MAPPING_PATH}")
-        else:
-            print(f"mapping not found at {MAPPING_PATH}")
-            raise FileNotFoundError(f"mapping file missing: {MAPPING_PATH}")
-
-    def predict(self, image_array):
-        predictions = self.model.predict(image_array, verbose=0)
-        class_idx = int(np.argmax(predictions[0]))
-        confidence = float(predictions[0][class_idx])
-        
-        class_code = self.reverse_mapping.get(class_idx, f"unknown_{class_idx}")
-        if hasattr(class_code, 'item'):
-            class_code = int(class_code.item())
-        elif isinstance(class_code, np.generic):
-            class_code = int(class_code)
-
-        top_3_indices = np.argsort(predictions[0])[-3:][::-1]
-        top_3 = []
-        for idx in top_3_indices:
-            idx = int(idx)
-            class_val = self.reverse_mapping.get(idx, f"unknown_{idx}")
-            if hasattr(class_val, 'item'):
-                class_val = int(class_val.item())
-            elif isinstance(class_val, np.generic):
-                class_val = int(class_val)
-            
-            top_3.append({
-                'class': class_val,
-                'confidence': float(predictions[0][idx])
-            })
-
-        class_name = self.code_to_name.get(class_code, f"unknown_{class_code}")
-        
-        top_3_with_names = []
-        for item in top_3:
-            top_3_with_names.append({
-                'class': self.code_to_name.get(item['class'], f"unknown_{item['class']}"),
-                'confidence': item['confidence']
-            })
-        
+        backend = create_backend(
+            self.backend_name, self.registry.path(version), self.registry.path(version, TFLITE_FILENAME)
+        )
+        print(f"model {version} loaded from {model_path} ({backend.describe()})")
+
+        mapping_path = self.registry.path(version, MAPPING_FILENAME)
+        if not os.path.exists(mapping_path):
+            mapping_path = MAPPING_PATH
+        if not os.path.exists(mapping_path):
+            print(f"mapping not found at {mapping_path}")
+            raise FileNotFoundError(f"mapping file missing: {mapping_path}")
+        reverse_mapping = np.load(mapping_path, allow_pickle=True).item()
+
+        return ServingModel(version, backend, reverse_mapping, self.code_to_name, self.load_cascade(version, backend))
+
+    def fast_model_path(self, version):
+        filename = FAST_TFLITE_FILENAME if self.backend_name == 'tflite' else FAST_KERAS_FILENAME
+        return self.registry.path(version, filename)
+
+    def load_cascade(self, version, backend):
+        if CASCADE_MARGIN <= 0:
+            return None
+        fast_path = self.fast_model_path(version)
+        if not os.path.exists(fast_path):
+            print(f"no fast model for {version} at {fast_path}; run python -m src.distill to enable the cascade")
+            return None
+        fast = create_backend(
+            self.backend_name, self.registry.path(version, FAST_KERAS_FILENAME), self.registry.path(version, FAST_TFLITE_FILENAME)
+        )
+        if fast.num_classes != backend.num_classes:
+            print(f"fast model for {version} has {fast.num_classes} classes, expected {backend.num_classes}; cascade disabled")
+            return None
+        report = None
+        try:
+            with open(self.registry.path(version, CASCADE_FILENAME)) as f:
+                report = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+        print(f"cascade enabled for {version}: fast model {fast_path}, margin {CASCADE_MARGIN}")
+        return Cascade(fast, path=fast_path, report=report)
+
+    def cascade_changed(self):
+        active = self.active
+        if active is None or CASCADE_MARGIN <= 0:
+            return False
+        signature = active.cascade.signature if active.cascade is not None else None
+        return file_signature(self.fast_model_path(active.version)) != signature
+
+    def activate(self, version, rollback=False):
+        with self._swap_lock:
+            if self.active is not None and self.active.version == version and not rollback and \
+                    not self.cascade_changed():
+                return self.last_swap
+
+            started = time.perf_counter()
+            loaded = self.load_version(version)
+            loaded_at = time.perf_counter()
+            warm_up(loaded.backend)
+            if loaded.cascade is not None:
+                warm_up(loaded.cascade.backend)
+
+            previous = self.active
+            flipped = time.perf_counter()
+            self.active = loaded
+            swapped = time.perf_counter()
+
+            if rollback or self.registry.active_version() != version:
+                self.registry.promote(version, rollback=rollback)
+                self.registry.publish(version, MODEL_PATH, TFLITE_MODEL_PATH)
+            self._refresh_mtime = self.registry.state_mtime()
+
+            self.last_swap = {
+                'version': version,
+                'previous_version': previous.version if previous is not None else None,
+                'activated_at': time.time(),
+                'load_seconds': round(loaded_at - started, 3),
+                'warm_seconds': round(flipped - loaded_at, 3),
+                'swap_ms': round((swapped - flipped) * 1000, 4),
+                'total_seconds': round(swapped - started, 3)
+            }
+
+        for listener in self.reload_listeners:
+            listener()
+        return self.last_swap
+
+    def rollback(self):
+        version = self.registry.rollback_target()
+        if version is None:
+            raise ValueError("no previous model version to roll back to")
+        return self.activate(version, rollback=True)
+
+    def refresh(self):
+        now = time.monotonic()
+        if now - self._refresh_checked_at < MODEL_REFRESH_INTERVAL:
+            return
+        self._refresh_checked_at = now
+
+        mtime = self.registry.state_mtime()
+        if mtime is None or mtime == self._refresh_mtime or self._swap_lock.locked():
+            return
+        self._refresh_mtime = mtime
+        version = self.registry.active_version()
+        if version and (version != self.version or self.cascade_changed()):
+            threading.Thread(target=self.activate, args=(version,), daemon=True).start()
+
+    def describe(self):
         return {
-            'predicted_class': class_code,
-            'predicted_class_name': class_name,
-            'confidence': confidence,
-            'top_3': top_3_with_names
+            'version': self.version,
+            'backend': self.backend_name,
+            **{key: value for key, value in self.last_swap.items() if key != 'version'}
         }
 
-    def retrain(self, train_data_path, epochs=10, batch_size=8, log_callback=None, progress_callback=None):
+    def cascade_stats(self):
+        active = self.active
+        if active is None or active.cascade is None:
+            return {'margin': CASCADE_MARGIN, 'enabled': False}
+        return {'enabled': True, **active.cascade.stats()}
+
+    def add_reload_listener(self, listener):
+        self.reload_listeners.append(listener)
+
+    def forward(self, image_array):
+        return self.serving().forward(image_array)
+
+    def predict(self, image_array, k=3, batch=False):
+        results = self.predict_batch(image_array, k)
+        return results if batch else results[0]
+
+    def predict_batch(self, image_array, k=3):
+        self.refresh()
+        return self.serving().predict_batch(image_array, k)
+
+    def predict_embed(self, image_array, k=3):
+        self.refresh()
+        active = self.serving()
+        results, embeddings = active.predict_embed(image_array, k)
+        return active.version, results, embeddings
+
+    def embed(self, image_array):
+        active = self.serving()
+        return active.version, active.backend.forward_embed(image_array)[1]
+
+    def decode_predictions(self, predictions, k=3):
+        active = self.serving()
+        return decode_predictions(predictions, active.index_codes, active.index_names, k)
+
+    def retrain(self, train_data_path, epochs=10, batch_size=RETRAIN_BATCH_SIZE, log_callback=None, progress_callback=None,
+                mode='full'):
         def log(msg):
             print(msg)
             if log_callback:
@@ -94,134 +395,15 @@ class LandCoverModel:
         log(f"Epochs: {epochs}, Batch size: {batch_size}")
 
         try:
-            from tensorflow.keras.preprocessing.image import ImageDataGenerator
-            from tensorflow.keras.callbacks import Callback
-
-            class LoggingCallback(Callback):
-                def __init__(self, log_fn, progress_fn, total_epochs):
-                    super().__init__()
-                    self.log_fn = log_fn
-                    self.progress_fn = progress_fn
-                    self.total_epochs = total_epochs
-
-                def on_epoch_begin(self, epoch, logs=None):
-                    self.log_fn(f"Epoch {epoch + 1}/{epochs} started")
-
-                def on_epoch_end(self, epoch, logs=None):
-                    loss = logs.get('loss', 0)
-                    acc = logs.get('accuracy', 0)
-                    if 'val_loss' in logs:
-                        val_loss = logs.get('val_loss', 0)
-                        val_acc = logs.get('val_accuracy', 0)
-                        self.log_fn(f"Epoch {epoch + 1}/{self.total_epochs} - loss: {loss:.4f}, val_loss: {val_loss:.4f}, accuracy: {acc:.4f}, val_accuracy: {val_acc:.4f}")
-                    else:
-                        self.log_fn(f"Epoch {epoch + 1}/{self.total_epochs} - loss: {loss:.4f}, accuracy: {acc:.4f}")
-                    
-                    if self.progress_fn:
-                        self.progress_fn(epoch + 1, self.total_epochs)
-
-            datagen = ImageDataGenerator(
-                rescale=1./255,
-                validation_split=0.2
-            )
-
-            log("Loading training data...")
-            log(f"Training path: {train_data_path}")
-            log(f"Checking directory exists: {os.path.exists(train_data_path)}")
-            if os.path.exists(train_data_path):
-                subdirs = [d for d in os.listdir(train_data_path) if os.path.isdir(os.path.join(train_data_path, d))]
-                log(f"Found subdirectories: {subdirs}")
-            
-            train_generator = datagen.flow_from_directory(
-                train_data_path,
-                target_size=(64, 64),
-                batch_size=batch_size,
-                class_mode='sparse',
-                subset='training',
-                shuffle=True
-            )
-            log(f"Found {train_generator.samples} training samples")
-            log(f"Class indices: {train_generator.class_indices}")
-            
-            if train_generator.samples == 0:
-                raise ValueError(f"No training samples found. Directory: {train_data_path}, Subdirs: {subdirs if 'subdirs' in locals() else 'unknown'}")
-            
-            actual_batch_size = min(batch_size, train_generator.samples)
-            train_generator.batch_size = actual_batch_size
-            log(f"Using batch size: {actual_batch_size}")
-            log(f"Found {len(train_generator.class_indices)} classes: {list(train_generator.class_indices.keys())}")
-
-            if len(train_generator.class_indices) < 2:
-                raise ValueError(f"Need at least 2 classes for training. Found only {len(train_generator.class_indices)}")
-
-            num_classes_in_data = len(train_generator.class_indices)
-            num_classes_in_model = self.model.output_shape[-1]
-
-            if num_classes_in_data != num_classes_in_model:
-                log(f"Warning: Data has {num_classes_in_data} classes but model expects {num_classes_in_model}")
-                log("Model will be retrained on available classes only")
-
-            log("Loading validation data...")
-            val_generator = datagen.flow_from_directory(
-                train_data_path,
-                target_size=(64, 64),
-                batch_size=batch_size,
-                class_mode='sparse',
-                subset='validation'
-            )
-            log(f"Found {val_generator.samples} validation samples")
-            
-            validation_data = None
-            if val_generator.samples > 0:
-                val_generator.batch_size = min(batch_size, val_generator.samples)
-                log(f"Validation batch size: {val_generator.batch_size}")
-                validation_data = val_generator
-            else:
-                log("Warning: No validation samples, training without validation")
-
-            log("Recompiling model with fresh optimizer...")
-            self.model.compile(
-                optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
-                loss='sparse_categorical_crossentropy',
-                metrics=['accuracy']
-            )
-
-            log("Starting model training...")
-            history = self.model.fit(
-                train_generator,
-                epochs=epochs,
-                validation_data=validation_data,
-                verbose=0,
-                callbacks=[LoggingCallback(log, progress_callback, epochs)]
+            base_version = self.version
+            version, result, _ = fine_tune(
+                self.registry, base_version, train_data_path, epochs, batch_size,
+                backend_name=self.backend_name, log=log, progress_callback=progress_callback, mode=mode
             )
 
-            backup_path = f"models/model_rgb_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.h5"
-            if os.path.exists(MODEL_PATH):
-                os.rename(MODEL_PATH, backup_path)
-                log(f"Previous model backed up to {backup_path}")
-
-            self.model.save(MODEL_PATH)
-            log(f"Retrained model saved successfully!")
-            
-            log("Reloading model into memory...")
-            self.model = keras.models.load_model(MODEL_PATH)
-            log("Model reloaded successfully!")
-
-            final_loss = history.history['loss'][-1]
-            final_acc = history.history.get('accuracy', [0])[-1]
-            
-            result = {
-                'status': 'success',
-                'final_loss': float(final_loss) if hasattr(final_loss, 'numpy') else final_loss,
-                'final_accuracy': float(final_acc) if hasattr(final_acc, 'numpy') else final_acc
-            }
-            
-            if 'val_loss' in history.history:
-                final_val_loss = history.history['val_loss'][-1]
-                final_val_acc = history.history.get('val_accuracy', [0])[-1]
-                result['final_val_loss'] = float(final_val_loss) if hasattr(final_val_loss, 'numpy') else final_val_loss
-                result['final_val_accuracy'] = float(final_val_acc) if hasattr(final_val_acc, 'numpy') else final_val_acc
-            
+            log("Loading and warming up new version...")
+            swap = self.activate(version)
+            log(f"Model {version} is live (load {swap['load_seconds']}s, swap {swap['swap_ms']}ms); previous version {base_version} kept for rollback")
             return result
 
         except Exception as e:
@@ -1,5 +1,15 @@
-from src.preprocessing import preprocess_image, preprocess_image_from_bytes
+from src.preprocessing import preprocess_image, preprocess_image_from_bytes, preprocess_into, allocate_batch
 from src.model import model_instance
+from src.cache import PredictionCache, content_hash
+from src.tracing import span
+from src.config import (
+    PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL, PREDICTION_CACHE_DISK_PATH, PREDICTION_CACHE_DISK_SIZE
+)
+
+prediction_cache = PredictionCache(
+    PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL, PREDICTION_CACHE_DISK_PATH or None, PREDICTION_CACHE_DISK_SIZE
+)
+model_instance.add_reload_listener(prediction_cache.clear_memory)
 
 def predict_from_path(image_path):
     img_array = preprocess_image(image_path)
@@ -7,6 +17,43 @@ def predict_from_path(image_path):
     return result
 
 def predict_from_bytes(image_bytes):
-    img_array = preprocess_image_from_bytes(image_bytes)
-    result = model_instance.predict(img_array)
+    contents = image_bytes.getvalue() if hasattr(image_bytes, 'getvalue') else image_bytes
+    with span('cache'):
+        cache_key = prediction_cache.make_key(contents, model_instance.version)
+        result = prediction_cache.get(cache_key)
+    if result is None:
+        img_array = preprocess_image_from_bytes(contents)
+        result = model_instance.predict(img_array)
+        prediction_cache.put(cache_key, result)
     return result
+
+def predict_batch(image_batch):
+    return model_instance.predict_batch(image_batch)
+
+def predict_named(items):
+    buffer = allocate_batch(len(items))
+    decoded = []
+    records = [None] * len(items)
+    digests = [None] * len(items)
+    version = None
+
+    for i, (name, contents) in enumerate(items):
+        if contents is None:
+            records[i] = {'filename': name, 'error': 'archive member too large'}
+            continue
+        try:
+            preprocess_into(contents, buffer[len(decoded)])
+            decoded.append(i)
+        except Exception as e:
+            records[i] = {'filename': name, 'error': str(e)}
+
+    if decoded:
+        model_instance.refresh()
+        active = model_instance.serving()
+        version = active.version
+        predictions = active.predict_batch(buffer[:len(decoded)])
+        for i, prediction in zip(decoded, predictions):
+            records[i] = {'filename': items[i][0], **prediction}
+            digests[i] = content_hash(items[i][1])
+
+    return version, records, digests
@@ -0,0 +1,285 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from src.config import (
+    PREDICTION_LOG_DIR, PREDICTION_LOG_BUFFER, PREDICTION_LOG_FLUSH_SECONDS,
+    PREDICTION_LOG_SEGMENT_ROWS, PREDICTION_LOG_KEEP_DAYS
+)
+from src.model import CODE_TO_NAME
+
+SEGMENT_FILENAME = 'segment.json'
+TOP_K = 3
+HASH_BYTES = 16
+DAY_SECONDS = 86400
+ENDPOINTS = ('predict', 'predict-batch')
+ENDPOINT_IDS = {name: i for i, name in enumerate(ENDPOINTS)}
+STAGES = ('read', 'cache', 'preprocess', 'inference', 'total')
+NAME_TO_CODE = {name: code for code, name in CODE_TO_NAME.items()}
+RECORD = np.dtype([
+    ('time', np.float64),
+    ('hash', np.uint8, (HASH_BYTES,)),
+    ('version', np.uint16),
+    ('endpoint', np.uint8),
+    ('cached', np.uint8),
+    ('classes', np.int16, (TOP_K,)),
+    ('confidence', np.float32, (TOP_K,)),
+    *((f'{stage}_ms', np.float32) for stage in STAGES)
+])
+COLUMNS = RECORD.names
+
+
+def day_of(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+
+
+def top_classes(result):
+    top = next(value for key, value in result.items() if key.startswith('top_'))[:TOP_K]
+    classes = [NAME_TO_CODE.get(entry['class'], -1) for entry in top]
+    confidence = [entry['confidence'] for entry in top]
+    pad = TOP_K - len(top)
+    return classes + [-1] * pad, confidence + [0.0] * pad
+
+
+class PredictionLog:
+    def __init__(self, directory=PREDICTION_LOG_DIR, capacity=PREDICTION_LOG_BUFFER,
+                 flush_seconds=PREDICTION_LOG_FLUSH_SECONDS, segment_rows=PREDICTION_LOG_SEGMENT_ROWS,
+                 keep_days=PREDICTION_LOG_KEEP_DAYS, worker=0):
+        self.directory = directory
+        self.capacity = capacity
+        self.flush_seconds = flush_seconds
+        self.segment_rows = segment_rows
+        self.keep_days = keep_days
+        self.worker = worker
+        self.buffer = np.zeros(capacity, dtype=RECORD)
+        self.spare = np.zeros(capacity, dtype=RECORD)
+        self.size = 0
+        self.versions = []
+        self.version_ids = {}
+        self.logged = 0
+        self.dropped = 0
+        self.written = 0
+        self.segments = 0
+        self.segment = None
+        self.segment_day = None
+        self.segment_count = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def log(self, digest, version, result, endpoint='predict', cached=False, **stages_ms):
+        classes, confidence = top_classes(result)
+        now = time.time()
+        with self._lock:
+            if self.size >= self.capacity:
+                self.dropped += 1
+                return False
+            version_id = self.version_ids.get(version)
+            if version_id is None:
+                version_id = self.version_ids[version] = len(self.versions)
+                self.versions.append(version)
+            self.buffer[self.size] = (
+                now, tuple(bytes.fromhex(digest)), version_id, ENDPOINT_IDS[endpoint], cached, classes, confidence,
+                *(stages_ms.get(stage, 0.0) for stage in STAGES)
+            )
+            self.size += 1
+            self.logged += 1
+            if self.size * 2 >= self.capacity:
+                self._wake.set()
+        return True
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='prediction-log', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+                self.prune()
+            except Exception as e:
+                print(f"prediction log flush failed: {e}")
+            if self._stopping:
+                return
+
+    def flush(self):
+        with self._lock:
+            if not self.size:
+                return 0
+            records = self.buffer[:self.size]
+            self.buffer, self.spare = self.spare, self.buffer
+            self.size = 0
+            versions = list(self.versions)
+
+        days = (records['time'] // DAY_SECONDS).astype(np.int64)
+        written = 0
+        try:
+            for day in np.unique(days):
+                rows = records[days == day]
+                while len(rows):
+                    if self.segment is None or self.segment_day != day_of(rows['time'][0]) or \
+                            self.segment_count >= self.segment_rows:
+                        self._open_segment(day_of(rows['time'][0]))
+                    take = min(len(rows), self.segment_rows - self.segment_count)
+                    self._append(rows[:take], versions)
+                    written += take
+                    rows = rows[take:]
+        except Exception:
+            self.segment = None
+            with self._lock:
+                self.dropped += len(records) - written
+            raise
+        finally:
+            self.written += written
+        return written
+
+    def _open_segment(self, day):
+        name = f"{datetime.now(timezone.utc).strftime('%H%M%S')}-w{self.worker}-{os.getpid()}-{self.segments:04d}"
+        self.segment = os.path.join(self.directory, day, name)
+        os.makedirs(self.segment)
+        self.segment_day = day
+        self.segment_count = 0
+        self.segments += 1
+
+    def _append(self, rows, versions):
+        for name in COLUMNS:
+            with open(os.path.join(self.segment, f"{name}.bin"), 'ab') as f:
+                f.write(np.ascontiguousarray(rows[name]).tobytes())
+        self.segment_count += len(rows)
+        header = {'count': self.segment_count, 'versions': versions, 'dtype': RECORD.descr}
+        path = os.path.join(self.segment, f"{SEGMENT_FILENAME}.tmp")
+        with open(path, 'w') as f:
+            json.dump(header, f)
+        os.replace(path, os.path.join(self.segment, SEGMENT_FILENAME))
+
+    def prune(self):
+        if not self.keep_days:
+            return
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.keep_days)).strftime('%Y-%m-%d')
+        for day in os.listdir(self.directory):
+            if day < cutoff and os.path.isdir(os.path.join(self.directory, day)):
+                shutil.rmtree(os.path.join(self.directory, day), ignore_errors=True)
+
+    def stats(self):
+        return {
+            'directory': self.directory,
+            'logged': self.logged,
+            'written': self.written,
+            'dropped': self.dropped,
+            'queued': self.size,
+            'capacity': self.capacity,
+            'segment': self.segment
+        }
+
+
+def read_day(directory, day, columns=COLUMNS):
+    parts = {name: [] for name in columns}
+    versions = []
+    day_dir = os.path.join(directory, day)
+    segments = sorted(os.listdir(day_dir)) if os.path.isdir(day_dir) else []
+    for segment in segments:
+        path = os.path.join(day_dir, segment)
+        try:
+            with open(os.path.join(path, SEGMENT_FILENAME)) as f:
+                header = json.load(f)
+        except FileNotFoundError:
+            continue
+        for version in header['versions']:
+            if version not in versions:
+                versions.append(version)
+        remap = np.array([versions.index(version) for version in header['versions']], dtype=np.uint16)
+        count = header['count']
+        for name in columns:
+            dtype = RECORD.fields[name][0]
+            values = np.fromfile(os.path.join(path, f"{name}.bin"), dtype.base, count * int(np.prod(dtype.shape)))
+            values = values.reshape(count, *dtype.shape)
+            parts[name].append(remap[values] if name == 'version' else values)
+    data = {
+        name: np.concatenate(values) if values else np.empty((0, *RECORD.fields[name][0].shape), RECORD.fields[name][0].base)
+        for name, values in parts.items()
+    }
+    return data, versions
+
+
+def summarize(data, versions):
+    count = len(data['time'])
+    if not count:
+        return {'predictions': 0}
+    top1 = data['classes'][:, 0]
+    confidence = data['confidence'][:, 0]
+    codes, per_class = np.unique(top1, return_counts=True)
+    hours = np.bincount(((data['time'] % DAY_SECONDS) // 3600).astype(np.int64), minlength=24)
+    total = data['total_ms']
+    unique = len(np.unique(data['hash'].view(f'V{HASH_BYTES}').ravel()))
+    return {
+        'predictions': count,
+        'unique_images': unique,
+        'cached_fraction': round(float(data['cached'].mean()), 4),
+        'endpoints': {ENDPOINTS[i]: int(n) for i, n in enumerate(np.bincount(data['endpoint'], minlength=len(ENDPOINTS)))},
+        'versions': {versions[i]: int(n) for i, n in enumerate(np.bincount(data['version'], minlength=len(versions))) if n},
+        'classes': {CODE_TO_NAME.get(int(code), str(int(code))): int(n) for code, n in zip(codes, per_class)},
+        'confidence': {
+            'mean': round(float(confidence.mean()), 4),
+            'p10': round(float(np.percentile(confidence, 10)), 4),
+            'below_0.5': int(np.count_nonzero(confidence < 0.5)),
+            'histogram': np.histogram(confidence, bins=10, range=(0, 1))[0].tolist()
+        },
+        'latency_ms': {
+            stage: {
+                'p50': round(float(np.percentile(data[f'{stage}_ms'], 50)), 3),
+                'p99': round(float(np.percentile(data[f'{stage}_ms'], 99)), 3)
+            }
+            for stage in STAGES
+        },
+        'per_hour': {f'{hour:02d}': int(n) for hour, n in enumerate(hours) if n},
+        'slow_over_100ms': int(np.count_nonzero(total > 100))
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="summarize a day of the prediction log")
+    parser.add_argument('--dir', default=PREDICTION_LOG_DIR)
+    parser.add_argument('--day', default=day_of(time.time()), help="utc day, YYYY-MM-DD (default: today)")
+    parser.add_argument('--version', help="only predictions served by this model version")
+    parser.add_argument('--endpoint', choices=ENDPOINTS)
+    parser.add_argument('--min-confidence', type=float)
+    parser.add_argument('--max-confidence', type=float)
+    args = parser.parse_args(argv)
+
+    data, versions = read_day(args.dir, args.day)
+    mask = np.ones(len(data['time']), dtype=bool)
+    if args.version:
+        mask &= data['version'] == (versions.index(args.version) if args.version in versions else -1)
+    if args.endpoint:
+        mask &= data['endpoint'] == ENDPOINTS.index(args.endpoint)
+    if args.min_confidence is not None:
+        mask &= data['confidence'][:, 0] >= args.min_confidence
+    if args.max_confidence is not None:
+        mask &= data['confidence'][:, 0] <= args.max_confidence
+    data = {name: values[mask] for name, values in data.items()}
+    print(json.dumps({'day': args.day, **summarize(data, versions)}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
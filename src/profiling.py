@@ -0,0 +1,81 @@
+import cProfile
+import io
+import pstats
+import sys
+import threading
+from collections import Counter
+
+IDLE_FUNCTIONS = {'wait', 'select', 'poll', '_worker', 'get', 'accept', '_wait_for_tstate_lock'}
+
+
+def frame_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = frame_stack(frame)
+                if stack[-1].split(' ', 1)[0] in IDLE_FUNCTIONS:
+                    continue
+                self.stacks[(names.get(thread_id, str(thread_id)), *stack)] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, limit=40):
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in self.stacks.items():
+            self_counts[stack[-1]] += count
+            for frame in set(stack[1:]):
+                total_counts[frame] += count
+
+        busy = sum(self.stacks.values()) or 1
+        lines = [f"{self.samples} samples every {self.interval * 1000:g}ms, {busy} busy thread samples", "", "  self%  total%  function"]
+        for frame, count in self_counts.most_common(limit):
+            lines.append(f"{count * 100 / busy:6.1f}  {total_counts[frame] * 100 / busy:6.1f}  {frame}")
+        return '\n'.join(lines) + '\n'
+
+
+def format_cprofile(profile, limit=40, sort='cumulative'):
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+def start_cprofile():
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
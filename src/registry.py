@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+
+KERAS_FILENAME = 'model_rgb.h5'
+TFLITE_FILENAME = 'model_rgb.tflite'
+MAPPING_FILENAME = 'reverse_mapping_rgb.npy'
+TRAINING_FILENAME = 'training.json'
+FAST_KERAS_FILENAME = 'model_fast.h5'
+FAST_TFLITE_FILENAME = 'model_fast.tflite'
+CASCADE_FILENAME = 'cascade.json'
+STATE_FILENAME = 'registry.json'
+STAGING_PREFIX = '.staging-'
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def replace_file(source, destination):
+    tmp_path = f"{destination}.{uuid.uuid4().hex[:8]}.tmp"
+    shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+
+class ModelRegistry:
+    def __init__(self, root, keep=5):
+        self.root = root
+        self.keep = max(1, keep)
+        self._lock = threading.Lock()
+
+    @property
+    def state_path(self):
+        return os.path.join(self.root, STATE_FILENAME)
+
+    def path(self, version, filename=KERAS_FILENAME):
+        return os.path.join(self.root, version, filename)
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if not name.startswith(STAGING_PREFIX) and os.path.isfile(self.path(name))
+        )
+
+    def read_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            state = {}
+        state.setdefault('active', None)
+        state.setdefault('history', [])
+        return state
+
+    def _write_state(self, state):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.state_path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def active_version(self):
+        return self.read_state()['active']
+
+    def state_mtime(self):
+        try:
+            return os.stat(self.state_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def rollback_target(self):
+        versions = set(self.versions())
+        for version in reversed(self.read_state()['history']):
+            if version in versions:
+                return version
+        return None
+
+    def stage(self):
+        staging_dir = os.path.join(self.root, f"{STAGING_PREFIX}{uuid.uuid4().hex[:12]}")
+        os.makedirs(staging_dir)
+        return staging_dir
+
+    def commit(self, staging_dir, created_at=None):
+        keras_path = os.path.join(staging_dir, KERAS_FILENAME)
+        if not os.path.isfile(keras_path):
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise FileNotFoundError(f"staged version has no {KERAS_FILENAME}: {staging_dir}")
+
+        timestamp = datetime.fromtimestamp(created_at or time.time()).strftime('%Y%m%dT%H%M%S')
+        version = f"{timestamp}-{file_digest(keras_path)[:8]}"
+        destination = os.path.join(self.root, version)
+        if os.path.isdir(destination):
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        else:
+            os.rename(staging_dir, destination)
+        return version
+
+    def register_files(self, keras_path, tflite_path=None, mapping_path=None, created_at=None):
+        staging_dir = self.stage()
+        for source, filename in ((keras_path, KERAS_FILENAME), (tflite_path, TFLITE_FILENAME), (mapping_path, MAPPING_FILENAME)):
+            if source and os.path.isfile(source):
+                link_or_copy(source, os.path.join(staging_dir, filename))
+        return self.commit(staging_dir, created_at)
+
+    def bootstrap(self, keras_path, tflite_path=None, mapping_path=None):
+        with self._lock:
+            if self.read_state()['active'] in self.versions():
+                return self.read_state()['active']
+            if not os.path.isfile(keras_path):
+                return None
+            version = self.register_files(keras_path, tflite_path, mapping_path, os.path.getmtime(keras_path))
+            state = self.read_state()
+            state['active'] = version
+            state['activated_at'] = time.time()
+            self._write_state(state)
+            return version
+
+    def promote(self, version, rollback=False):
+        if version not in self.versions():
+            raise FileNotFoundError(f"model version not found: {version}")
+        with self._lock:
+            state = self.read_state()
+            previous = state['active']
+            if rollback:
+                state['history'] = [v for v in state['history'] if v != version]
+            elif previous and previous != version:
+                state['history'] = [v for v in state['history'] if v != previous] + [previous]
+            state['active'] = version
+            state['activated_at'] = time.time()
+            self._write_state(state)
+        self.prune()
+        return previous
+
+    def touch(self):
+        with self._lock:
+            self._write_state(self.read_state())
+
+    def publish(self, version, keras_path, tflite_path=None, mapping_path=None):
+        for destination, filename in ((keras_path, KERAS_FILENAME), (tflite_path, TFLITE_FILENAME), (mapping_path, MAPPING_FILENAME)):
+            source = self.path(version, filename)
+            if destination and os.path.isfile(source):
+                os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+                replace_file(source, destination)
+
+    def prune(self):
+        with self._lock:
+            state = self.read_state()
+            versions = self.versions()
+            keep = set(versions[-self.keep:])
+            keep.add(state['active'])
+            keep.update(state['history'][-1:])
+            removed = [version for version in versions if version not in keep]
+            for version in removed:
+                shutil.rmtree(os.path.join(self.root, version), ignore_errors=True)
+            if removed:
+                state['history'] = [v for v in state['history'] if v not in removed]
+                self._write_state(state)
+            return removed
+
+    def describe(self):
+        state = self.read_state()
+        return {
+            'active': state['active'],
+            'activated_at': state.get('activated_at'),
+            'rollback_target': self.rollback_target(),
+            'versions': self.versions(),
+            'keep': self.keep
+        }
@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import psutil
+
+from src.config import SAMPLER_INTERVAL
+from src.metrics import metrics
+
+LAG_PROBES = 10
+STALE_INTERVALS = 5
+MB = 1024 * 1024
+
+
+class SystemSampler:
+    def __init__(self, interval=SAMPLER_INTERVAL, queue_depth=None):
+        self.interval = interval
+        self.queue_depth = queue_depth
+        self.process = psutil.Process()
+        self.builders = {}
+        self.reports = {}
+        self.system = {
+            "cpu_percent": 0.0,
+            "memory_percent": 0.0,
+            "process_cpu_percent": 0.0,
+            "process_rss_mb": 0.0,
+            "children_rss_mb": 0.0,
+            "event_loop_lag_ms": 0.0,
+            "inference_queue_depth": 0
+        }
+        self.sampled_at = 0.0
+        self.samples = 0
+        self.task = None
+        self._lag = metrics.histogram("event_loop_lag_seconds")
+
+    def report(self, name, builder):
+        self.builders[name] = builder
+
+    def get(self, name):
+        return self.reports[name]
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def age(self):
+        return time.monotonic() - self.sampled_at if self.sampled_at else None
+
+    def stale(self):
+        age = self.age()
+        return age is None or age > STALE_INTERVALS * self.interval
+
+    async def start(self):
+        if self.running:
+            return
+        psutil.cpu_percent(interval=None)
+        self.process.cpu_percent(interval=None)
+        await asyncio.to_thread(self.sample, 0.0)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        probe = self.interval / LAG_PROBES
+        while True:
+            worst = 0.0
+            for _ in range(LAG_PROBES):
+                expected = loop.time() + probe
+                await asyncio.sleep(probe)
+                lag = max(0.0, loop.time() - expected)
+                self._lag.observe(lag)
+                worst = max(worst, lag)
+            try:
+                await asyncio.to_thread(self.sample, worst)
+            except Exception as e:
+                print(f"system sampler failed: {e}")
+
+    def sample(self, loop_lag):
+        memory = psutil.virtual_memory()
+        children = 0
+        for child in self.process.children():
+            try:
+                children += child.memory_info().rss
+            except psutil.Error:
+                pass
+        self.system = {
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "memory_percent": memory.percent,
+            "process_cpu_percent": self.process.cpu_percent(interval=None),
+            "process_rss_mb": round(self.process.memory_info().rss / MB, 1),
+            "children_rss_mb": round(children / MB, 1),
+            "event_loop_lag_ms": round(loop_lag * 1000, 2),
+            "inference_queue_depth": self.queue_depth() if self.queue_depth is not None else 0
+        }
+        self.reports = {name: builder(self.system) for name, builder in self.builders.items()}
+        self.sampled_at = time.monotonic()
+        self.samples += 1
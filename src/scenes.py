@@ -0,0 +1,329 @@
+import asyncio
+import json
+import os
+
+import numpy as np
+from PIL import Image, TiffImagePlugin
+
+from src.config import SCENE_TILE_SIZE, SCENE_STRIDE, SCENE_BATCH_SIZE, SCENE_MAX_DECODE_PIXELS
+from src.model import model_instance
+from src.preprocessing import REDUCING_GAP, SCALE, TARGET_SIZE, allocate_batch
+
+try:
+    import rasterio
+    from rasterio.windows import Window
+except ImportError:
+    rasterio = None
+
+OUTPUTS = ('classes.npy', 'confidence.npy', 'classes.png')
+RAW_MODES = {'RGB': 3, 'RGBA': 4, 'RGBX': 4, 'L': 1}
+CODE_COLORS = {
+    10: (0, 100, 0),
+    20: (255, 187, 34),
+    30: (255, 255, 76),
+    40: (240, 150, 255),
+    50: (250, 0, 0),
+    60: (180, 180, 180),
+    80: (0, 100, 200),
+    90: (0, 150, 160),
+    95: (0, 207, 117)
+}
+
+
+def to_rgb(pixels):
+    if pixels.ndim == 2:
+        return np.repeat(pixels[..., None], 3, axis=2)
+    if pixels.shape[2] == 1:
+        return np.repeat(pixels, 3, axis=2)
+    return pixels[..., :3]
+
+
+class SceneTooLarge(ValueError):
+    pass
+
+
+class UnreadableScene(ValueError):
+    pass
+
+
+class ArrayScene:
+    def __init__(self, array, geo=None):
+        if array.dtype != np.uint8:
+            raise ValueError(f"scene must be 8-bit, got {array.dtype}")
+        self.array = array
+        self.height, self.width = array.shape[:2]
+        self.geo = geo
+
+    def read_rows(self, y0, y1):
+        return to_rgb(np.asarray(self.array[y0:y1]))
+
+    def close(self):
+        self.array = None
+
+
+class RawTiffScene:
+    def __init__(self, path, image):
+        self.width, self.height = image.size
+        self.geo = tiff_geo(image)
+        self.tiles = []
+        for _, (x0, y0, x1, y1), offset, (rawmode, stride, ystep) in image.tile:
+            channels = RAW_MODES[rawmode]
+            row_bytes = stride or (x1 - x0) * channels
+            pixels = np.memmap(path, np.uint8, 'r', offset=offset, shape=(y1 - y0, row_bytes))
+            self.tiles.append((x0, y0, x1, y1, pixels[:, :(x1 - x0) * channels].reshape(y1 - y0, x1 - x0, channels)))
+
+    @staticmethod
+    def supported(image):
+        return bool(image.tile) and all(
+            tile[0] == 'raw' and len(tile[3]) == 3 and tile[3][0] in RAW_MODES and tile[3][2] == 1
+            for tile in image.tile
+        )
+
+    def read_rows(self, y0, y1):
+        out = np.empty((y1 - y0, self.width, 3), dtype=np.uint8)
+        for x0, tile_y0, x1, tile_y1, pixels in self.tiles:
+            top, bottom = max(y0, tile_y0), min(y1, tile_y1)
+            if top < bottom:
+                out[top - y0:bottom - y0, x0:x1] = to_rgb(pixels[top - tile_y0:bottom - tile_y0])
+        return out
+
+    def close(self):
+        self.tiles = []
+
+
+class RasterioScene:
+    def __init__(self, path):
+        self.dataset = rasterio.open(path)
+        if self.dataset.dtypes[0] != 'uint8':
+            self.dataset.close()
+            raise ValueError(f"scene must be 8-bit, got {self.dataset.dtypes[0]}")
+        self.width, self.height = self.dataset.width, self.dataset.height
+        self.bands = [1, 2, 3] if self.dataset.count >= 3 else [1]
+        transform = self.dataset.transform
+        self.geo = {
+            'geotransform': [transform.c, transform.a, transform.b, transform.f, transform.d, transform.e],
+            'crs': self.dataset.crs.to_string() if self.dataset.crs else None
+        }
+
+    def read_rows(self, y0, y1):
+        pixels = self.dataset.read(self.bands, window=Window(0, y0, self.width, y1 - y0))
+        return to_rgb(np.moveaxis(pixels, 0, -1))
+
+    def close(self):
+        self.dataset.close()
+
+
+def tiff_geo(image):
+    tags = image.tag_v2
+    scale, tiepoint = tags.get(33550), tags.get(33922)
+    if not scale or not tiepoint:
+        return None
+    i, j, _, x, y, _ = tiepoint[:6]
+    crs = None
+    keys = tags.get(34735)
+    if keys:
+        for offset in range(4, len(keys) - 3, 4):
+            key_id, location, _, value = keys[offset:offset + 4]
+            if key_id in (3072, 2048) and location == 0:
+                crs = f"EPSG:{value}"
+                break
+    return {'geotransform': [x - i * scale[0], scale[0], 0.0, y + j * scale[1], 0.0, -scale[1]], 'crs': crs}
+
+
+def open_streaming(path):
+    if path.lower().endswith('.npy'):
+        return ArrayScene(np.load(path, mmap_mode='r'))
+
+    with open(path, 'rb') as f:
+        is_tiff = f.read(4) in (b'II*\x00', b'MM\x00*')
+    if is_tiff:
+        with open(path, 'rb') as f:
+            image = TiffImagePlugin.TiffImageFile(f)
+            if RawTiffScene.supported(image):
+                return RawTiffScene(path, image)
+    if rasterio is not None:
+        return RasterioScene(path)
+    return None
+
+
+def check_decode_size(path, max_pixels=SCENE_MAX_DECODE_PIXELS):
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+    except Image.DecompressionBombError as e:
+        raise SceneTooLarge(f"scene too large to decode whole without rasterio: {e}")
+    if width * height > max_pixels:
+        raise SceneTooLarge(
+            f"{width}x{height} scene can not be read in bands without rasterio and is above the "
+            f"{max_pixels} pixel limit for decoding it whole; upload an uncompressed tiff or .npy"
+        )
+
+
+def check_scene(path, max_decode_pixels=SCENE_MAX_DECODE_PIXELS):
+    try:
+        scene = open_streaming(path)
+        if scene is None:
+            check_decode_size(path, max_decode_pixels)
+        else:
+            scene.close()
+    except SceneTooLarge:
+        raise
+    except (OSError, ValueError, SyntaxError) as e:
+        raise UnreadableScene(f"scene is not a readable 8-bit image or raster: {e}") from e
+
+
+def open_scene(path, max_decode_pixels=SCENE_MAX_DECODE_PIXELS):
+    scene = open_streaming(path)
+    if scene is not None:
+        return scene
+
+    check_decode_size(path, max_decode_pixels)
+    with Image.open(path) as image:
+        geo = tiff_geo(image) if isinstance(image, TiffImagePlugin.TiffImageFile) else None
+        pixels = np.asarray(image.convert('RGB'))
+    return ArrayScene(pixels, geo)
+
+
+def grid_shape(width, height, tile_size, stride):
+    if width < tile_size or height < tile_size:
+        return 0, 0
+    return (height - tile_size) // stride + 1, (width - tile_size) // stride + 1
+
+
+def iter_tile_batches(scene, rows, cols, tile_size, stride, batch_size):
+    buffer = allocate_batch(batch_size)
+    filled = 0
+    start = 0
+    for row in range(rows):
+        y0 = row * stride
+        band = scene.read_rows(y0, y0 + tile_size)
+        for col in range(cols):
+            tile = band[:, col * stride:col * stride + tile_size]
+            if (tile_size, tile_size) != TARGET_SIZE:
+                tile = np.asarray(Image.fromarray(tile).resize(TARGET_SIZE, Image.BICUBIC, reducing_gap=REDUCING_GAP))
+            np.multiply(tile, SCALE, out=buffer[filled], casting='unsafe')
+            filled += 1
+            if filled == batch_size:
+                yield start, buffer
+                start += filled
+                filled = 0
+                buffer = allocate_batch(batch_size)
+    if filled:
+        yield start, buffer[:filled]
+
+
+def classify_tiles(batch):
+    serving = model_instance.serving()
+    probabilities = serving.forward(batch)
+    return serving.version, probabilities.argmax(axis=1).astype(np.uint8), probabilities.max(axis=1).astype(np.float32)
+
+
+def write_preview(path, classes, index_codes):
+    palette = []
+    for code in index_codes:
+        palette.extend(CODE_COLORS.get(code, (0, 0, 0)))
+    preview = Image.fromarray(np.asarray(classes))
+    preview.putpalette(palette)
+    preview.save(path)
+
+
+def summarize(classes, confidence, versions, scene, tile_size, stride):
+    serving = model_instance.serving()
+    counts = np.bincount(np.asarray(classes).ravel(), minlength=len(serving.index_codes))
+    total = int(counts.sum())
+    geo = None
+    if scene.geo:
+        x, dx, rx, y, ry, dy = scene.geo['geotransform']
+        geo = {'geotransform': [x, dx * stride, rx * stride, y, ry * stride, dy * stride], 'crs': scene.geo['crs']}
+    return {
+        'model_versions': sorted(versions),
+        'width': scene.width,
+        'height': scene.height,
+        'tile_size': tile_size,
+        'stride': stride,
+        'rows': int(classes.shape[0]),
+        'cols': int(classes.shape[1]),
+        'tiles': total,
+        'mean_confidence': round(float(np.mean(confidence, dtype=np.float64)), 4),
+        'classes': [
+            {
+                'index': index,
+                'class': code,
+                'class_name': name,
+                'tiles': int(count),
+                'fraction': round(int(count) / total, 4) if total else 0.0
+            }
+            for index, (code, name, count) in enumerate(zip(serving.index_codes.tolist(), serving.index_names.tolist(), counts))
+        ],
+        'geo': geo
+    }
+
+
+async def classify_scene(scene, output_dir, executor, tile_size, stride, batch_size, job=None):
+    rows, cols = grid_shape(scene.width, scene.height, tile_size, stride)
+    if not rows:
+        raise ValueError(f"scene {scene.width}x{scene.height} is smaller than one {tile_size}px tile")
+    if job is not None:
+        job.set_total(rows * cols)
+
+    os.makedirs(output_dir, exist_ok=True)
+    classes = np.lib.format.open_memmap(os.path.join(output_dir, 'classes.npy'), 'w+', np.uint8, (rows, cols))
+    confidence = np.lib.format.open_memmap(os.path.join(output_dir, 'confidence.npy'), 'w+', np.float32, (rows, cols))
+    flat_classes, flat_confidence = classes.reshape(-1), confidence.reshape(-1)
+    versions = set()
+
+    async def classify(start, batch):
+        version, indices, scores = await executor.run_admitted(classify_tiles, batch)
+        flat_classes[start:start + len(batch)] = indices
+        flat_confidence[start:start + len(batch)] = scores
+        versions.add(version)
+        if job is not None:
+            job.advance(len(batch))
+
+    batches = iter_tile_batches(scene, rows, cols, tile_size, stride, batch_size)
+    pending = set()
+    try:
+        while True:
+            item = await asyncio.to_thread(next, batches, None)
+            if item is None:
+                break
+            pending.add(asyncio.create_task(classify(*item)))
+            if len(pending) >= executor.workers:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+        if pending:
+            done, pending = await asyncio.wait(pending)
+            for task in done:
+                task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    classes.flush()
+    confidence.flush()
+    write_preview(os.path.join(output_dir, 'classes.png'), classes, model_instance.serving().index_codes.tolist())
+    result = summarize(classes, confidence, versions, scene, tile_size, stride)
+    with open(os.path.join(output_dir, 'scene.json'), 'w') as f:
+        json.dump(result, f, indent=2)
+    return result
+
+
+async def run_scene_job(job, path, output_dir, executor, tile_size=SCENE_TILE_SIZE, stride=SCENE_STRIDE,
+                        batch_size=SCENE_BATCH_SIZE):
+    job.start()
+    try:
+        scene = await asyncio.to_thread(open_scene, path)
+        try:
+            result = await classify_scene(scene, output_dir, executor, tile_size, stride, batch_size, job)
+        finally:
+            scene.close()
+        result['outputs'] = {name: f"/scenes/{job.id}/{name}" for name in OUTPUTS}
+        job.complete(result)
+    except Exception as e:
+        job.fail(e)
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
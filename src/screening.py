@@ -0,0 +1,267 @@
+import asyncio
+import fcntl
+import math
+import os
+
+import numpy as np
+
+from src.config import (
+    SCREEN_NEIGHBOURS, SCREEN_DUPLICATE_SIMILARITY, SCREEN_OUTLIER_AGREEMENT, SCREEN_NPROBE
+)
+from src.model import model_instance
+from src.preprocessing import SCALE
+
+FLAT_LIMIT = 2048
+RETRAIN_GROWTH = 4
+LISTS_PER_SQRT = 4
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+ASSIGN_CHUNK = 4096
+EMBED_BATCH_SIZE = 256
+KEEP_VERSIONS = 2
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def nearest_centroid(vectors, centroids):
+    assign = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        assign[start:start + ASSIGN_CHUNK] = np.argmax(vectors[start:start + ASSIGN_CHUNK] @ centroids.T, axis=1)
+    return assign
+
+
+def kmeans(vectors, clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)]
+    for _ in range(iterations):
+        assign = nearest_centroid(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        empty = np.bincount(assign, minlength=clusters) == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+def top_k(similarities, ids, k):
+    k = min(k, similarities.shape[-1])
+    best = np.argpartition(-similarities, k - 1)[:k] if k < len(similarities) else np.arange(k)
+    best = best[np.argsort(-similarities[best])]
+    return ids[best], similarities[best]
+
+
+class IVFIndex:
+    def __init__(self, dim, nprobe=SCREEN_NPROBE):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.size = 0
+        self.vectors = np.empty((1024, dim), dtype=np.float32)
+        self.assign = np.empty(1024, dtype=np.int32)
+        self.centroids = None
+        self.trained_size = 0
+        self._lists = None
+
+    def __len__(self):
+        return self.size
+
+    def add(self, vectors):
+        vectors = normalize(vectors)
+        end = self.size + len(vectors)
+        if end > len(self.vectors):
+            capacity = max(end, 2 * len(self.vectors))
+            self.vectors = np.concatenate([self.vectors[:self.size], np.empty((capacity - self.size, self.dim), np.float32)])
+            self.assign = np.concatenate([self.assign[:self.size], np.empty(capacity - self.size, np.int32)])
+        self.vectors[self.size:end] = vectors
+        if self.centroids is not None:
+            self.assign[self.size:end] = nearest_centroid(vectors, self.centroids)
+        self.size = end
+        self._lists = None
+        if self.size >= FLAT_LIMIT and self.size >= self.trained_size * RETRAIN_GROWTH:
+            self.train()
+
+    def train(self):
+        vectors = self.vectors[:self.size]
+        clusters = int(LISTS_PER_SQRT * math.sqrt(self.size))
+        rng = np.random.default_rng(self.size)
+        sample = vectors[rng.choice(self.size, min(self.size, clusters * KMEANS_SAMPLES_PER_LIST), replace=False)]
+        self.centroids = kmeans(sample, clusters)
+        self.assign[:self.size] = nearest_centroid(vectors, self.centroids)
+        self.trained_size = self.size
+        self._lists = None
+
+    def lists(self):
+        if self._lists is None:
+            order = np.argsort(self.assign[:self.size], kind='stable')
+            offsets = np.searchsorted(self.assign[:self.size][order], np.arange(len(self.centroids) + 1))
+            self._lists = order, offsets
+        return self._lists
+
+    def search(self, queries, k):
+        queries = normalize(queries)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        if not self.size:
+            return ids, similarities
+
+        if self.centroids is None:
+            candidates = np.arange(self.size)
+            scores = queries @ self.vectors[:self.size].T
+            for i in range(len(queries)):
+                found, sims = top_k(scores[i], candidates, k)
+                ids[i, :len(found)], similarities[i, :len(found)] = found, sims
+            return ids, similarities
+
+        order, offsets = self.lists()
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([order[offsets[probe]:offsets[probe + 1]] for probe in probes[i]])
+            if not len(candidates):
+                continue
+            found, sims = top_k(self.vectors[candidates] @ query, candidates, k)
+            ids[i, :len(found)], similarities[i, :len(found)] = found, sims
+        return ids, similarities
+
+    def describe(self):
+        return {
+            'vectors': self.size,
+            'lists': 0 if self.centroids is None else len(self.centroids),
+            'nprobe': self.nprobe if self.centroids is not None else None
+        }
+
+
+def embed_images(pixels):
+    return model_instance.embed(np.multiply(pixels, SCALE, dtype=np.float32))
+
+
+def append_embeddings(path, start, embeddings):
+    row_bytes = embeddings.shape[1] * 4
+    with open(path, 'ab') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            rows = os.fstat(f.fileno()).st_size // row_bytes
+            f.truncate(rows * row_bytes)
+            if start <= rows < start + len(embeddings):
+                f.write(np.ascontiguousarray(embeddings[rows - start:], dtype=np.float32).tobytes())
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_embeddings(path, start, dim):
+    try:
+        with open(path, 'rb') as f:
+            f.seek(start * dim * 4)
+            data = f.read()
+    except FileNotFoundError:
+        return np.empty((0, dim), dtype=np.float32)
+    return np.frombuffer(data[:len(data) // (dim * 4) * dim * 4], dtype=np.float32).reshape(-1, dim)
+
+
+class Screener:
+    def __init__(self, store, neighbours=SCREEN_NEIGHBOURS, duplicate_similarity=SCREEN_DUPLICATE_SIMILARITY,
+                 outlier_agreement=SCREEN_OUTLIER_AGREEMENT, nprobe=SCREEN_NPROBE):
+        self.store = store
+        self.neighbours = neighbours
+        self.duplicate_similarity = duplicate_similarity
+        self.outlier_agreement = outlier_agreement
+        self.nprobe = nprobe
+        self.directory = os.path.join(store.directory, 'embeddings')
+        self.version = None
+        self.index = None
+        self.labels = np.empty(0, dtype=np.int16)
+        self.class_counts = np.empty(0, dtype=np.int64)
+        self._lock = asyncio.Lock()
+
+    def cache_path(self, version):
+        return os.path.join(self.directory, f"{version}.bin")
+
+    async def sync(self, executor, version=None, known=None):
+        async with self._lock:
+            active = model_instance.version
+            dim = model_instance.backend.embedding_dim
+            if not dim or (version is not None and version != active):
+                return False
+            if active != self.version:
+                self.version, self.index = active, None
+                self.labels = np.empty(0, dtype=np.int16)
+            await asyncio.to_thread(self.store.refresh)
+            count = len(self.store)
+            indexed = len(self.index) if self.index is not None else 0
+            if indexed >= count:
+                return True
+
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.cache_path(active)
+            images = self.store.column('images', count)
+            known = known or {}
+            start = indexed
+            while start < count:
+                cached = await asyncio.to_thread(read_embeddings, path, start, dim)
+                if len(cached):
+                    embeddings = cached[:count - start]
+                elif all(row in known for row in range(start, min(start + EMBED_BATCH_SIZE, count))):
+                    embeddings = np.stack([known[row] for row in range(start, min(start + EMBED_BATCH_SIZE, count))])
+                else:
+                    embedded_version, embeddings = await executor.run_admitted(
+                        embed_images, np.asarray(images[start:min(start + EMBED_BATCH_SIZE, count)])
+                    )
+                    if embedded_version != active:
+                        return False
+                if not len(cached):
+                    await asyncio.to_thread(append_embeddings, path, start, embeddings)
+                if self.index is None:
+                    self.index = IVFIndex(dim, self.nprobe)
+                await asyncio.to_thread(self.index.add, embeddings)
+                start += len(embeddings)
+
+            self.labels = np.array(self.store.column('labels', count))
+            self.class_counts = np.bincount(self.labels, minlength=len(self.store.classes))
+            self._prune(active)
+            return True
+
+    def _prune(self, version, keep=KEEP_VERSIONS):
+        paths = sorted(
+            (os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.bin')),
+            key=os.path.getmtime
+        )
+        for path in paths[:-keep]:
+            if path != self.cache_path(version):
+                os.remove(path)
+
+    async def screen(self, embeddings, classes, version):
+        async with self._lock:
+            if version != self.version or self.index is None or not len(self.index):
+                return [None] * len(classes)
+            return await asyncio.to_thread(self._screen, embeddings, classes)
+
+    def _screen(self, embeddings, classes):
+        index, labels, class_counts = self.index, self.labels, self.class_counts
+
+        ids, similarities = index.search(embeddings, self.neighbours)
+        class_index = {name: i for i, name in enumerate(self.store.classes)}
+        results = []
+        for row_ids, row_similarities, claimed in zip(ids, similarities, classes):
+            found = row_ids[row_ids >= 0]
+            if not len(found):
+                results.append(None)
+                continue
+            label = class_index.get(claimed)
+            known_samples = int(class_counts[label]) if label is not None and label < len(class_counts) else 0
+            agreement = float(np.mean(labels[found] == label)) if len(found) and label is not None else 0.0
+            results.append({
+                'nearest_sample': int(found[0]),
+                'similarity': round(float(row_similarities[0]), 4),
+                'near_duplicate': bool(row_similarities[0] >= self.duplicate_similarity),
+                'class_agreement': round(agreement, 4),
+                'outlier': known_samples >= self.neighbours and agreement < self.outlier_agreement
+            })
+        return results
+
+    def describe(self):
+        return {
+            'model_version': self.version,
+            **(self.index.describe() if self.index is not None else {'vectors': 0, 'lists': 0, 'nprobe': None})
+        }
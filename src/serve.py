@@ -0,0 +1,172 @@
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from src.config import (
+    SERVING_WORKERS, SERVING_THREADS_PER_WORKER, SERVING_CPUS, SERVING_PIN_CPUS, INFERENCE_BACKEND
+)
+from src.training import parse_cpus
+
+RESTART_BACKOFF_SECONDS = (1, 2, 5, 10, 30)
+
+
+def available_cpus(spec=SERVING_CPUS):
+    if spec:
+        return sorted(parse_cpus(spec))
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_workers(cpus, workers=0, threads=1):
+    threads = max(1, min(threads, len(cpus)))
+    workers = workers or max(1, len(cpus) // threads)
+    return [[cpus[(index * threads + offset) % len(cpus)] for offset in range(threads)] for index in range(workers)]
+
+
+def worker_env(index, workers, cpus, all_cpus, counters_path):
+    threads = len(cpus)
+    env = dict(os.environ)
+    defaults = {
+        'OMP_NUM_THREADS': threads,
+        'OPENBLAS_NUM_THREADS': threads,
+        'MKL_NUM_THREADS': threads,
+        'TF_NUM_INTRAOP_THREADS': threads,
+        'TF_NUM_INTEROP_THREADS': max(1, threads // 2),
+        'TF_INTRA_OP_THREADS': threads,
+        'TF_INTER_OP_THREADS': max(1, threads // 2),
+        'TFLITE_NUM_THREADS': threads,
+        'EXECUTOR_WORKERS': threads * 2
+    }
+    for name, value in defaults.items():
+        env.setdefault(name, str(value))
+    env.update({
+        'SERVING_WORKER_INDEX': str(index),
+        'SERVING_WORKERS': str(workers),
+        'SERVING_CPUS': ','.join(map(str, all_cpus)),
+        'SERVING_COUNTERS_PATH': counters_path
+    })
+    return env
+
+
+def preload():
+    from src.model import LandCoverModel
+
+    started = time.perf_counter()
+    model = LandCoverModel()
+    path = model.active_model_path()
+    with open(path, 'rb') as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        while f.read(1024 * 1024):
+            pass
+    print(f"model {model.registry.active_version()} preloaded into the page cache from {path} ({time.perf_counter() - started:.2f}s)")
+
+
+class Supervisor:
+    def __init__(self, app, host, port, plan, pin, log_level):
+        self.app = app
+        self.plan = plan
+        self.pin = pin
+        self.log_level = log_level
+        self.all_cpus = sorted({cpu for cpus in plan for cpu in cpus})
+        self.sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(2048)
+        self.sock.set_inheritable(True)
+        fd, self.counters_path = tempfile.mkstemp(
+            prefix='landcover-counters-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None
+        )
+        os.close(fd)
+        self.processes = [None] * len(plan)
+        self.restarts = [0] * len(plan)
+        self.restart_at = [0.0] * len(plan)
+        self.stopping = False
+
+    def spawn(self, index):
+        cpus = self.plan[index]
+        command = [
+            sys.executable, '-m', 'uvicorn', self.app,
+            '--fd', str(self.sock.fileno()), '--log-level', self.log_level
+        ]
+        affinity = None
+        if self.pin and hasattr(os, 'sched_setaffinity'):
+            def affinity():
+                os.sched_setaffinity(0, cpus)
+        process = subprocess.Popen(
+            command, env=worker_env(index, len(self.plan), cpus, self.all_cpus, self.counters_path),
+            pass_fds=(self.sock.fileno(),), preexec_fn=affinity
+        )
+        print(f"worker {index} started (pid {process.pid}, {len(cpus)} threads{f', cpus {cpus}' if self.pin else ''})")
+        self.processes[index] = process
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        try:
+            for index in range(len(self.plan)):
+                self.spawn(index)
+            while not self.stopping:
+                time.sleep(0.5)
+                self.reap()
+        finally:
+            self.shutdown()
+
+    def reap(self):
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process is not None and process.poll() is not None:
+                delay = RESTART_BACKOFF_SECONDS[min(self.restarts[index], len(RESTART_BACKOFF_SECONDS) - 1)]
+                print(f"worker {index} (pid {process.pid}) exited with {process.returncode}, restarting in {delay}s")
+                self.processes[index] = None
+                self.restarts[index] += 1
+                self.restart_at[index] = now + delay
+            elif process is None and now >= self.restart_at[index]:
+                self.spawn(index)
+
+    def shutdown(self, timeout=30):
+        running = [process for process in self.processes if process is not None and process.poll() is None]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in running:
+            try:
+                process.wait(max(0.1, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.sock.close()
+        try:
+            os.unlink(self.counters_path)
+        except FileNotFoundError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="run the api with one uvicorn worker process per core group")
+    parser.add_argument('--app', default='api.main:app')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=SERVING_WORKERS, help="0 sizes the pool to the available cpus")
+    parser.add_argument('--threads-per-worker', type=int, default=SERVING_THREADS_PER_WORKER)
+    parser.add_argument('--pin', action=argparse.BooleanOptionalAction, default=SERVING_PIN_CPUS)
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args(argv)
+
+    cpus = available_cpus()
+    plan = plan_workers(cpus, args.workers, args.threads_per_worker)
+    print(f"starting {len(plan)} workers x {len(plan[0])} threads on {len(cpus)} cpus ({INFERENCE_BACKEND} backend)")
+    preload()
+    Supervisor(args.app, args.host, args.port, plan, args.pin, args.log_level).run()
+
+
+if __name__ == '__main__':
+    main()
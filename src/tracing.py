@@ -0,0 +1,67 @@
+import random
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from src.config import TRACE_SAMPLE_RATE
+
+current_trace = ContextVar('current_trace', default=None)
+_NOOP = nullcontext()
+
+
+class Trace:
+    def __init__(self, trace_id=None):
+        self.id = trace_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.spans = []
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, started, time.perf_counter())
+
+    def add(self, name, started, finished):
+        self.spans.append((name, started - self.started, finished - started))
+
+    def extend(self, other):
+        offset = other.started - self.started
+        self.spans.extend((name, start + offset, duration) for name, start, duration in other.spans)
+
+    def server_timing(self):
+        totals = {}
+        for name, _, duration in self.spans:
+            totals[name] = totals.get(name, 0.0) + duration
+        return ', '.join(f"{name};dur={duration * 1000:.3f}" for name, duration in totals.items())
+
+    def to_dict(self):
+        return {
+            "trace_id": self.id,
+            "spans": [
+                {"name": name, "start_ms": round(start * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+                for name, start, duration in self.spans
+            ]
+        }
+
+
+def span(name):
+    trace = current_trace.get()
+    if trace is None:
+        return _NOOP
+    return trace.span(name)
+
+
+def should_sample(forced=False, sample_rate=TRACE_SAMPLE_RATE):
+    return forced or (sample_rate > 0 and random.random() < sample_rate)
+
+
+def start_trace(trace=None):
+    trace = trace or Trace()
+    return trace, current_trace.set(trace)
+
+
+def end_trace(token):
+    current_trace.reset(token)
@@ -0,0 +1,538 @@
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from src.config import (
+    INFERENCE_BACKEND, TFLITE_QUANTIZATION, RETRAIN_RUN_EAGERLY, RETRAIN_BATCH_SIZE, RETRAIN_INPUT_PIPELINE,
+    RETRAIN_CACHE, RETRAIN_CACHE_DIR, RETRAIN_SHUFFLE_BUFFER, RETRAIN_VALID_ONLY, RETRAIN_MODE, RETRAIN_LEARNING_RATE,
+    RETRAIN_REPLAY_RATIO, RETRAIN_PATIENCE, CASCADE_MARGIN, MODEL_REGISTRY_DIR, MODEL_REGISTRY_KEEP,
+    TRAINING_THREADS, TRAINING_CPUS, TRAINING_NICE, TRAINING_MIN_ACCURACY, TRAINING_MAX_REGRESSION, SERVING_CPUS
+)
+from src.data_pipeline import build_retrain_data
+from src.datastore import TrainingStore, is_store
+from src.registry import KERAS_FILENAME, MAPPING_FILENAME, TFLITE_FILENAME, TRAINING_FILENAME, ModelRegistry, link_or_copy
+
+ACTIVE_STATUSES = ('running', 'validating', 'validated', 'promoting')
+FINISHED_STATUSES = ('completed', 'rejected', 'failed', 'cancelled')
+MODES = ('full', 'incremental')
+MIN_TFLITE_AGREEMENT = 0.95
+MAX_AGREEMENT_IMAGES = 1000
+COLUMNS = (
+    'id', 'status', 'train_data_path', 'epochs', 'mode', 'progress', 'version', 'base_version', 'result',
+    'validation', 'error', 'cancel_requested', 'owner_pid', 'created_at', 'started_at', 'finished_at'
+)
+
+
+def model_class_indices(registry, version, num_classes):
+    import numpy as np
+    from src.model import CODE_TO_NAME, build_label_lookup
+
+    mapping = np.load(registry.path(version, MAPPING_FILENAME), allow_pickle=True).item()
+    _, index_names = build_label_lookup(mapping, CODE_TO_NAME, num_classes)
+    return {name: idx for idx, name in enumerate(index_names.tolist())}
+
+
+def fine_tune(registry, base_version, train_data_path, epochs=10, batch_size=RETRAIN_BATCH_SIZE,
+              backend_name=INFERENCE_BACKEND, log=print, progress_callback=None, mode='full'):
+    import tensorflow as tf
+    from tensorflow.keras.callbacks import Callback
+    from src.backends import load_keras_model
+
+    class LoggingCallback(Callback):
+        def __init__(self, log_fn, progress_fn, total_epochs):
+            super().__init__()
+            self.log_fn = log_fn
+            self.progress_fn = progress_fn
+            self.total_epochs = total_epochs
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self.log_fn(f"Epoch {epoch + 1}/{self.total_epochs} started")
+
+        def on_epoch_end(self, epoch, logs=None):
+            loss = logs.get('loss', 0)
+            acc = logs.get('accuracy', 0)
+            if 'val_loss' in logs:
+                val_loss = logs.get('val_loss', 0)
+                val_acc = logs.get('val_accuracy', 0)
+                self.log_fn(f"Epoch {epoch + 1}/{self.total_epochs} - loss: {loss:.4f}, val_loss: {val_loss:.4f}, accuracy: {acc:.4f}, val_accuracy: {val_acc:.4f}")
+            else:
+                self.log_fn(f"Epoch {epoch + 1}/{self.total_epochs} - loss: {loss:.4f}, accuracy: {acc:.4f}")
+
+            if self.progress_fn:
+                self.progress_fn(epoch + 1, self.total_epochs)
+
+    if mode not in MODES:
+        raise ValueError(f"unknown retrain mode: {mode}")
+    if mode == 'incremental':
+        return fine_tune_incremental(
+            registry, base_version, train_data_path, epochs, batch_size, backend_name, log,
+            LoggingCallback(log, progress_callback, epochs)
+        )
+
+    log(f"Fine-tuning from model version {base_version}")
+    model = load_keras_model(registry.path(base_version))
+    num_classes_in_model = model.output_shape[-1]
+    class_indices = model_class_indices(registry, base_version, num_classes_in_model)
+
+    log("Loading training data...")
+    log(f"Training path: {train_data_path}")
+    log(f"Checking directory exists: {os.path.exists(train_data_path)}")
+    info = {'mode': 'full'}
+    if is_store(train_data_path):
+        info.update(store=train_data_path, store_rows=len(TrainingStore(train_data_path)))
+        log(f"Input pipeline: training data store ({'valid samples only' if RETRAIN_VALID_ONLY else 'all samples'})")
+    else:
+        if os.path.exists(train_data_path):
+            subdirs = [d for d in os.listdir(train_data_path) if os.path.isdir(os.path.join(train_data_path, d))]
+            log(f"Found subdirectories: {subdirs}")
+        log(f"Input pipeline: {RETRAIN_INPUT_PIPELINE} (cache: {RETRAIN_CACHE})")
+    data = build_retrain_data(
+        train_data_path,
+        batch_size,
+        pipeline=RETRAIN_INPUT_PIPELINE,
+        cache=RETRAIN_CACHE,
+        cache_dir=RETRAIN_CACHE_DIR,
+        shuffle_buffer=RETRAIN_SHUFFLE_BUFFER,
+        valid_only=RETRAIN_VALID_ONLY,
+        class_indices=class_indices
+    )
+    log(f"Found {data.train_samples} training samples")
+    log(f"Class indices: {data.class_indices}")
+    log(f"Using batch size: {data.batch_size}")
+    log(f"Found {len(data.class_indices)} classes: {list(data.class_indices.keys())}")
+
+    if len(data.class_indices) < 2:
+        raise ValueError(f"Need at least 2 classes for training. Found only {len(data.class_indices)}")
+
+    num_classes_in_data = len(data.class_indices)
+    if num_classes_in_data != num_classes_in_model:
+        log(f"Warning: Data has {num_classes_in_data} classes but model expects {num_classes_in_model}")
+        log("Model will be retrained on available classes only")
+
+    log(f"Found {data.validation_samples} validation samples")
+    if data.validation is None:
+        log("Warning: No validation samples, training without validation")
+
+    log("Recompiling model with fresh optimizer...")
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=RETRAIN_LEARNING_RATE),
+        loss='sparse_categorical_crossentropy',
+        metrics=['accuracy'],
+        run_eagerly=RETRAIN_RUN_EAGERLY
+    )
+
+    log("Starting model training...")
+    history = model.fit(
+        data.train,
+        epochs=epochs,
+        validation_data=data.validation,
+        verbose=0,
+        callbacks=[LoggingCallback(log, progress_callback, epochs)]
+    )
+
+    return save_candidate(registry, base_version, model, history, data, info, backend_name, log)
+
+
+def fine_tune_incremental(registry, base_version, store_path, epochs, batch_size, backend_name, log, callback):
+    from src.backends import load_keras_model
+    from src.incremental import fit_incremental, previous_store_rows
+
+    if not is_store(store_path):
+        raise ValueError(f"incremental retraining needs a training data store, got {store_path}")
+
+    log(f"Fine-tuning the head of model version {base_version} on {store_path}")
+    model = load_keras_model(registry.path(base_version))
+    class_indices = model_class_indices(registry, base_version, model.output_shape[-1])
+    trained_rows = previous_store_rows(registry.path(base_version, TRAINING_FILENAME), store_path)
+    history, data, info = fit_incremental(
+        model, store_path, trained_rows, epochs, batch_size, RETRAIN_LEARNING_RATE, RETRAIN_REPLAY_RATIO,
+        RETRAIN_PATIENCE, RETRAIN_CACHE_DIR, callbacks=[callback], log=log, class_indices=class_indices
+    )
+    info.update(mode='incremental', store=store_path)
+    return save_candidate(registry, base_version, model, history, data, info, backend_name, log)
+
+
+def save_candidate(registry, base_version, model, history, data, info, backend_name, log):
+    staging_dir = registry.stage()
+    model.save(os.path.join(staging_dir, KERAS_FILENAME))
+    link_or_copy(registry.path(base_version, MAPPING_FILENAME), os.path.join(staging_dir, MAPPING_FILENAME))
+    with open(os.path.join(staging_dir, TRAINING_FILENAME), 'w') as f:
+        json.dump({**info, 'base_version': base_version}, f, indent=2)
+
+    if backend_name == 'tflite':
+        from src.export import export_tflite
+        export_tflite(os.path.join(staging_dir, KERAS_FILENAME), os.path.join(staging_dir, TFLITE_FILENAME), quantization=TFLITE_QUANTIZATION)
+        log(f"Exported tflite model ({TFLITE_QUANTIZATION})")
+
+    if CASCADE_MARGIN > 0:
+        from src.distill import distill, expected_row
+        report = distill(
+            os.path.join(staging_dir, KERAS_FILENAME), os.path.join(staging_dir, MAPPING_FILENAME), staging_dir,
+            store_path=info.get('store'), backend_name=backend_name, log=log
+        )
+        info['cascade'] = expected_row(report)
+
+    version = registry.commit(staging_dir)
+    log(f"Retrained model saved as version {version}")
+
+    result = {
+        'status': 'success',
+        'version': version,
+        'final_loss': float(history.history['loss'][-1]),
+        'final_accuracy': float(history.history.get('accuracy', [0])[-1]),
+        **info
+    }
+    if 'val_loss' in history.history:
+        result['final_val_loss'] = float(history.history['val_loss'][-1])
+        result['final_val_accuracy'] = float(history.history.get('val_accuracy', [0])[-1])
+    return version, result, data
+
+
+def evaluate_accuracy(model_path, dataset):
+    from src.backends import load_keras_model
+
+    model = load_keras_model(model_path)
+    model.compile(loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    return float(model.evaluate(dataset, verbose=0, return_dict=True)['accuracy'])
+
+
+def validation_images(dataset, limit=MAX_AGREEMENT_IMAGES):
+    import numpy as np
+
+    if hasattr(dataset, '__getitem__'):
+        batches = (dataset[i] for i in range(len(dataset)))
+    else:
+        batches = iter(dataset)
+    images = []
+    count = 0
+    for batch, _ in batches:
+        images.append(np.asarray(batch, dtype=np.float32))
+        count += len(images[-1])
+        if count >= limit:
+            break
+    return np.concatenate(images)[:limit]
+
+
+def validate_candidate(registry, version, base_version, data, min_accuracy=TRAINING_MIN_ACCURACY,
+                       max_regression=TRAINING_MAX_REGRESSION, log=print):
+    if data.validation is None:
+        return {'passed': False, 'reason': 'no validation samples to check the candidate against'}
+
+    candidate_accuracy = evaluate_accuracy(registry.path(version), data.validation)
+    baseline_accuracy = evaluate_accuracy(registry.path(base_version), data.validation)
+    log(f"Validation accuracy: candidate {candidate_accuracy:.4f}, active {baseline_accuracy:.4f}")
+
+    report = {
+        'passed': True,
+        'classes': data.class_indices,
+        'candidate_accuracy': round(candidate_accuracy, 4),
+        'baseline_accuracy': round(baseline_accuracy, 4),
+        'min_accuracy': min_accuracy,
+        'max_regression': max_regression
+    }
+    if candidate_accuracy < min_accuracy:
+        report.update(passed=False, reason=f"accuracy {candidate_accuracy:.4f} below minimum {min_accuracy}")
+    elif candidate_accuracy < baseline_accuracy - max_regression:
+        report.update(passed=False, reason=f"accuracy regressed from {baseline_accuracy:.4f} to {candidate_accuracy:.4f}")
+
+    if report['passed'] and os.path.exists(registry.path(version, TFLITE_FILENAME)):
+        from src.export import verify_backend
+        agreement = verify_backend(
+            registry.path(version), registry.path(version, TFLITE_FILENAME), images=validation_images(data.validation)
+        )
+        report['tflite'] = agreement
+        if agreement['top1_agreement'] < MIN_TFLITE_AGREEMENT:
+            report.update(passed=False, reason=f"tflite export agrees with keras on {agreement['top1_agreement']:.2%} of validation images")
+    return report
+
+
+def parse_cpus(spec):
+    cpus = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def limit_resources(threads=TRAINING_THREADS, cpus=TRAINING_CPUS or SERVING_CPUS, nice=TRAINING_NICE):
+    for name in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, parse_cpus(cpus))
+    if nice:
+        os.nice(nice)
+
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(max(1, threads // 2))
+
+
+class TrainingJobStore:
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, 'jobs.sqlite')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT, train_data_path TEXT, epochs INTEGER, mode TEXT DEFAULT 'full', progress INTEGER DEFAULT 0, "
+            "version TEXT, base_version TEXT, result TEXT, validation TEXT, error TEXT, "
+            "cancel_requested INTEGER DEFAULT 0, owner_pid INTEGER, created_at REAL, started_at REAL, finished_at REAL)"
+        )
+        if 'mode' not in {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN mode TEXT DEFAULT 'full'")
+
+    def log_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.log")
+
+    def create(self, train_data_path, epochs, mode='full'):
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, train_data_path, epochs, mode, created_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, train_data_path, epochs, mode, time.time())
+            )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list(self, limit=50):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def update(self, job_id, **fields):
+        for key in ('result', 'validation'):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key])
+        if fields.get('status') in FINISHED_STATUSES:
+            fields.setdefault('finished_at', time.time())
+        assignments = ', '.join(f"{key} = ?" for key in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim_next(self, owner_pid):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._conn.execute(
+                    f"SELECT 1 FROM jobs WHERE status IN ({', '.join('?' * len(ACTIVE_STATUSES))})", ACTIVE_STATUSES
+                ).fetchone():
+                    self._conn.execute("COMMIT")
+                    return None
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', owner_pid = ?, started_at = ?, progress = 0 WHERE id = ?",
+                        (owner_pid, time.time(), row[0])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row[0]) if row else None
+
+    def request_cancel(self, job_id):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            )
+            self._conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status IN ('running', 'validating')", (job_id,)
+            )
+        return self.get(job_id)
+
+    def recover(self):
+        requeued = []
+        for job in self.list(limit=1000):
+            if job['status'] in ACTIVE_STATUSES and not pid_alive(job['owner_pid']):
+                self.update(job['job_id'], status='queued', owner_pid=None, progress=0, cancel_requested=0)
+                requeued.append(job['job_id'])
+        return requeued
+
+    def read_logs(self, job_id, tail=200):
+        try:
+            with open(self.log_path(job_id)) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return []
+        return lines[-tail:]
+
+    def _row_to_job(self, row):
+        job = dict(zip(COLUMNS, row))
+        job['job_id'] = job.pop('id')
+        for key in ('result', 'validation'):
+            job[key] = json.loads(job[key]) if job[key] else None
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        started = job['started_at']
+        job['elapsed_seconds'] = round((job['finished_at'] or time.time()) - started, 3) if started else None
+        return job
+
+
+def pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def run_training_job(directory, job_id):
+    store = TrainingJobStore(directory)
+    job = store.get(job_id)
+    log_file = open(store.log_path(job_id), 'a', buffering=1)
+
+    def log(msg):
+        print(msg)
+        log_file.write(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}\n")
+
+    def progress(current_epoch, total_epochs):
+        store.update(job_id, progress=int(current_epoch / total_epochs * 90))
+
+    try:
+        limit_resources()
+        log(f"Training process {os.getpid()} started ({TRAINING_THREADS} threads, cpus: {TRAINING_CPUS or 'all'}, nice: {TRAINING_NICE})")
+        log(f"Training data path: {job['train_data_path']}")
+        log(f"Epochs: {job['epochs']}, mode: {job['mode']}")
+
+        registry = ModelRegistry(MODEL_REGISTRY_DIR, MODEL_REGISTRY_KEEP)
+        base_version = registry.active_version()
+        if base_version is None:
+            raise FileNotFoundError(f"no active model version in {MODEL_REGISTRY_DIR}")
+        store.update(job_id, base_version=base_version)
+
+        version, result, data = fine_tune(
+            registry, base_version, job['train_data_path'], job['epochs'], log=log, progress_callback=progress, mode=job['mode']
+        )
+        store.update(job_id, status='validating', version=version, result=result, progress=90)
+
+        log("Validating candidate against the active model...")
+        validation = validate_candidate(registry, version, base_version, data, log=log)
+        if validation['passed']:
+            log(f"Validation passed, version {version} is ready for promotion")
+            store.update(job_id, status='validated', validation=validation, progress=95)
+        else:
+            log(f"Validation failed: {validation['reason']}")
+            store.update(job_id, status='rejected', validation=validation, error=validation['reason'], progress=100)
+    except Exception as e:
+        log(f"Error during retraining: {str(e)}")
+        store.update(job_id, status='failed', error=str(e))
+    finally:
+        log_file.close()
+
+
+class TrainingManager:
+    def __init__(self, directory, promote, poll_interval=0.5, stop_timeout=10):
+        self.store = TrainingJobStore(directory)
+        self.promote = promote
+        self.poll_interval = poll_interval
+        self.stop_timeout = stop_timeout
+        self.process = None
+        self.current_job = None
+        self._task = None
+        self._stopping = False
+
+    async def start(self):
+        if self._task is not None:
+            return
+        for job_id in self.store.recover():
+            print(f"requeued interrupted training job {job_id}")
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping = True
+        process, job_id = self.process, self.current_job
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if process is not None and process.poll() is None:
+            await asyncio.to_thread(self._terminate, process)
+            self.store.update(job_id, status='queued', owner_pid=None, progress=0)
+
+    def submit(self, train_data_path, epochs, mode=RETRAIN_MODE):
+        return self.store.create(train_data_path, epochs, mode)
+
+    def cancel(self, job_id):
+        return self.store.request_cancel(job_id)
+
+    def _terminate(self, process):
+        process.terminate()
+        try:
+            process.wait(self.stop_timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    async def _run(self):
+        while not self._stopping:
+            job = self.store.claim_next(os.getpid())
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            try:
+                await self._run_job(job['job_id'])
+            except Exception as e:
+                print(f"Error in training job {job['job_id']}: {str(e)}")
+                self.store.update(job['job_id'], status='failed', error=str(e))
+            finally:
+                self.process = None
+                self.current_job = None
+
+    async def _run_job(self, job_id):
+        self.current_job = job_id
+        self.process = subprocess.Popen([sys.executable, '-m', 'src.training', self.store.directory, job_id])
+
+        while self.process.poll() is None:
+            await asyncio.sleep(self.poll_interval)
+            if self.store.get(job_id)['cancel_requested']:
+                await asyncio.to_thread(self._terminate, self.process)
+                self.store.update(job_id, status='cancelled', error='cancelled by request')
+                return
+
+        job = self.store.get(job_id)
+        if job['status'] in ('running', 'validating'):
+            self.store.update(job_id, status='failed', error=f"training process exited with code {self.process.returncode}")
+            return
+        if job['status'] != 'validated':
+            return
+
+        self.store.update(job_id, status='promoting')
+        swap = await asyncio.to_thread(self.promote, job['version'])
+        result = {**(job['result'] or {}), 'swap': swap}
+        self.store.update(job_id, status='completed', result=result, progress=100)
+
+
+if __name__ == '__main__':
+    run_training_job(sys.argv[1], sys.argv[2])
@@ -11,10 +11,18 @@ if os.path.exists(venv_python):
 else:
     python_executable = sys.executable
 
-subprocess.run([
-    python_executable, "-m", "uvicorn",
-    "api.main:app",
-    "--reload",
-    "--host", "0.0.0.0",
-    "--port", "8000"
-])
+if "--prod" in sys.argv:
+    subprocess.run([
+        python_executable, "-m", "src.serve",
+        "--host", "0.0.0.0",
+        "--port", "8000",
+        *[arg for arg in sys.argv[1:] if arg != "--prod"]
+    ])
+else:
+    subprocess.run([
+        python_executable, "-m", "uvicorn",
+        "api.main:app",
+        "--reload",
+        "--host", "0.0.0.0",
+        "--port", "8000"
+    ])